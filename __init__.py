@@ -56,7 +56,7 @@ class RenderRadianceSettingsScene(bpy.types.PropertyGroup):
             default=True)
     deletefiles_enable = BoolProperty(
             name="Delete files",
-            description="Delete files after rendering. Doesn't work with the image",
+            description="Delete the temp files when Blender quits. Doesn't work with the image",
             default=True)
     scene_name = StringProperty(
             name="Scene Name",
@@ -143,7 +143,9 @@ class RenderRadianceSettingsScene(bpy.types.PropertyGroup):
             default="1")
 
     antialias_depth = IntProperty(
-            name="Antialias Depth", description="Depth of pixel for sampling",
+            name="Antialias Depth",
+            description="Depth of pixel for sampling. Higher samples more pixels: rpict -ps halves " \
+                        "with every step, down to every pixel from 4",
             min=1, max=9, default=3)
 
     antialias_threshold = FloatProperty(
@@ -277,6 +279,29 @@ class RenderRadianceSettingsScene(bpy.types.PropertyGroup):
                         "in the mosaic preview last pass",
             min=0.001, max=1.00, soft_min=0.01, soft_max=1.00, default=0.04, precision=3)
 
+    # Quality autotuning
+    autotune_target = FloatProperty(
+            name="Target Error",
+            description="Largest relative RMS luminance difference from the best preset " \
+                        "accepted by the quality tuner",
+            min=0.001, max=1.0, soft_min=0.01, soft_max=0.2, default=0.05, precision=3)
+
+    autotune_size = IntProperty(
+            name="Probe Size",
+            description="Largest side in pixels of the probe pictures rendered by the quality tuner",
+            min=16, max=1024, default=64)
+
+    tuned_preset = StringProperty(
+            name="Tuned Preset",
+            description="Quality preset chosen by the last tuning of this scene",
+            default="", maxlen=64)
+
+    tuned_options = StringProperty(
+            name="Tuned Options",
+            description="rpict options of the last tuning of this scene, used by the exported " \
+                        "run scripts",
+            default="", maxlen=500)
+
 
 ###############################################################################
 # Material Radiance properties.
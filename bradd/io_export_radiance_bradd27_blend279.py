@@ -36,16 +36,307 @@ bl_info = {
 
 import bpy
 import os
+import time
+import json
+import hashlib
+import multiprocessing
 import bmesh
-from mathutils import Vector, Quaternion, Color, Matrix
+from mathutils import Vector, Color
 from os.path import splitext
 import math
 from math import degrees
+import numpy as np
 
-from bpy.props import StringProperty, IntProperty, BoolProperty, FloatProperty
+from bpy.props import StringProperty, IntProperty, BoolProperty, FloatProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper
 
 
+# run3_tiles.py, written into the export folder next to run3: the view
+# split into tiles rendered by parallel rpict processes, put together by pcompos
+TILES_DRIVER = '''#!/usr/bin/env python3
+"""
+Tiled rpict: the view split into a grid of tiles, rendered by parallel
+rpict processes (-vs/-vl shifted views of the tile size) and put back
+together with pcompos. Written by the BRADD exporter.
+
+python3 run3_tiles.py Camera.vf scene.oct scene.hdr [-x 1024] [-y 1024] [-n cores] [--tiles n] [--dry-run] [-- rpict options]
+
+--dry-run prints the tile jobs and the pcompos step instead of running them.
+"""
+
+import os
+import sys
+import math
+import time
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_view(filename):
+    view = {"vt": "v", "vh": 45.0, "vv": 45.0, "vs": 0.0, "vl": 0.0}
+    f = open(filename)
+    words = f.read().split()
+    f.close()
+    for i, word in enumerate(words):
+        if word.startswith("-vt") and len(word) == 4:
+            view["vt"] = word[3]
+        elif word in ("-vh", "-vv", "-vs", "-vl") and i + 1 < len(words):
+            view[word[1:]] = float(words[i + 1])
+    return view
+
+
+def view_size(view, key, fraction):
+    # the view angle (or parallel size) spanning fraction of the whole view
+    if view["vt"] == "l":
+        return view[key] * fraction
+    return 2.0 * math.degrees(math.atan(math.tan(math.radians(view[key]) / 2.0) * fraction))
+
+
+def fit(view, xres, yres):
+    # as rpict -pa 1: the largest picture within xres by yres with the aspect of the view
+    if view["vt"] == "l":
+        aspect = view["vv"] / view["vh"]
+    else:
+        aspect = math.tan(math.radians(view["vv"]) / 2.0) / math.tan(math.radians(view["vh"]) / 2.0)
+    if yres > xres * aspect:
+        yres = max(int(xres * aspect + 0.5), 1)
+    else:
+        xres = max(int(yres / aspect + 0.5), 1)
+    return xres, yres
+
+
+def tile_grid(xres, yres, ntiles):
+    # about ntiles tiles, as close to square as the picture allows
+    ny = max(1, int(round(math.sqrt(ntiles * yres / float(xres)))))
+    nx = max(1, int(math.ceil(ntiles / float(ny))))
+    return min(nx, xres), min(ny, yres)
+
+
+def tiles(view, xres, yres, nx, ny):
+    # (x0, y0, width, height, -vh, -vv, -vs, -vl) of every tile, y0 from the bottom as pcompos places them
+    xs = [xres * i // nx for i in range(nx + 1)]
+    ys = [yres * j // ny for j in range(ny + 1)]
+    for j in range(ny):
+        for i in range(nx):
+            fx = (xs[i + 1] - xs[i]) / float(xres)
+            fy = (ys[j + 1] - ys[j]) / float(yres)
+            vs = (view["vs"] + (xs[i] + xs[i + 1]) / (2.0 * xres) - 0.5) / fx
+            vl = (view["vl"] + (ys[j] + ys[j + 1]) / (2.0 * yres) - 0.5) / fy
+            yield (xs[i], ys[j], xs[i + 1] - xs[i], ys[j + 1] - ys[j],
+                   view_size(view, "vh", fx), view_size(view, "vv", fy), vs, vl)
+
+
+def render(job):
+    command, output = job
+    t0 = time.time()
+    f = open(output, "wb")
+    status = subprocess.call(command, stdout=f)
+    f.close()
+    if status != 0:
+        raise RuntimeError("%s failed with exit status %d" % (" ".join(command), status))
+    return time.time() - t0
+
+
+def main(argv):
+    options = []
+    if "--" in argv:
+        options = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    if len(argv) < 3:
+        print(__doc__)
+        return 1
+    vf, octree, output = argv[0:3]
+    xres = yres = 512
+    cores = os.cpu_count() or 1
+    ntiles = None
+    dry_run = False
+    args = argv[3:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-x":
+            xres = int(args.pop(0))
+        elif arg == "-y":
+            yres = int(args.pop(0))
+        elif arg == "-n":
+            cores = int(args.pop(0))
+        elif arg == "--tiles":
+            ntiles = int(args.pop(0))
+        elif arg == "--dry-run":
+            dry_run = True
+    view = read_view(vf)
+    if view["vt"] not in ("v", "l"):
+        # fisheye and panoramic views do not split into shifted views
+        command = ["rpict"] + options + ["-vf", vf, "-x", str(xres), "-y", str(yres), octree]
+        print(" ".join(command) + " > " + output)
+        if not dry_run:
+            render((command, output))
+        return 0
+    xres, yres = fit(view, xres, yres)
+    # twice as many tiles as cores, so the cores stay busy as tiles finish unevenly
+    nx, ny = tile_grid(xres, yres, ntiles or 2 * cores)
+    root = os.path.splitext(output)[0]
+    folder = os.path.join(os.path.dirname(output), "tiles")
+    jobs = []
+    compose = ["pcompos", "-x", str(xres), "-y", str(yres)]
+    for x0, y0, width, height, vh, vv, vs, vl in tiles(view, xres, yres, nx, ny):
+        tile = os.path.join(folder, "%s_%d_%d.hdr" % (os.path.basename(root), x0, y0))
+        command = ["rpict"] + options + ["-vf", vf, "-vh", "%.6f" % vh, "-vv", "%.6f" % vv,
+                                         "-vs", "%.6f" % vs, "-vl", "%.6f" % vl,
+                                         "-x", str(width), "-y", str(height), "-pa", "0", octree]
+        jobs.append((command, tile))
+        compose += [tile, str(x0), str(y0)]
+    if dry_run:
+        for command, tile in jobs:
+            print(" ".join(command) + " > " + tile)
+        print(" ".join(compose) + " > " + output)
+        return 0
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    t0 = time.time()
+    pool = ThreadPoolExecutor(max_workers=cores)
+    seconds = list(pool.map(render, jobs))
+    pool.shutdown()
+    render((compose, output))
+    wall = max(time.time() - t0, 1e-6)
+    print("%d x %d tiles of a %d x %d picture on %d cores: %.1fs, %.1fs of rpict (%.1fx)" %
+          (nx, ny, xres, yres, cores, wall, sum(seconds), sum(seconds) / wall))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
+'''
+
+
+def tuned_options(scene):
+    # rpict options tuned by the Radiance render add-on for this scene, if it is installed
+    return getattr(getattr(scene, "Radiance", None), "tuned_options", "")
+
+
+# untextured meshes are formatted from plain arrays, so this part of the
+# export needs no Blender and can run in forked worker processes
+
+def polygon_pieces(modifier, geom_name, loop_co, loop_start, loop_total):
+    # one polygon primitive per face, from (n,3) loop coordinates
+    flat = loop_co.ravel().tolist()
+    loop_start = loop_start.tolist()
+    loop_total = loop_total.tolist()
+    for pcount in range(0,len(loop_start)):
+        start = loop_start[pcount]
+        total = loop_total[pcount]
+        poly_str = "%s polygon %s.p%s\n0\n0\n" % (modifier,geom_name,str(pcount))
+        poly_str = poly_str + "%d\n" % (total * 3)
+        poly_str = poly_str + ("  %.6f %.6f %.6f\n" * total) % tuple(flat[start*3:(start + total)*3])
+        yield poly_str + '\n'
+
+def write_pieces(f, pieces, buffer_size):
+    # gather generated primitives into chunks of about buffer_size characters
+    # returns (number of pieces, characters written)
+    chunk = []
+    size = 0
+    count = 0
+    total = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size = size + len(piece)
+        count = count + 1
+        if size >= buffer_size:
+            f.write(''.join(chunk))
+            total = total + size
+            chunk = []
+            size = 0
+    if chunk:
+        f.write(''.join(chunk))
+        total = total + size
+    return (count, total)
+
+def format_polygons(job):
+    # job: (path, modifier, geom_name, loop_co, loop_start, loop_total, buffer_size)
+    (path, modifier, geom_name, loop_co, loop_start, loop_total, buffer_size) = job
+    gfn = open(path,"w+")
+    result = write_pieces(gfn,polygon_pieces(modifier,geom_name,loop_co,loop_start,loop_total),buffer_size)
+    gfn.close()
+    return result
+
+# snapshots handed to the pool: forked children inherit them copy-on-write
+# rather than receiving a pickled copy of every array
+_format_jobs = []
+
+def _format_job(i):
+    return format_polygons(_format_jobs[i])
+
+def fork_context():
+    # None where fork is unavailable (Windows): the export then stays serial
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+
+# view frustum culling, from plain arrays: a camera is a world matrix and
+# its Blender camera settings, planes are (normal, offset) pairs in the
+# camera's frame, with inside points at normal . p + offset >= 0
+
+def frustum_planes(cam_type, angle_x, angle_y, shift_x, shift_y, clip_start, ortho_scale):
+    # (k,3) normals and (k,) offsets of the planes bounding what a camera sees
+    # (looking down -Z); no far plane, as the export leaves -va at 0
+    if cam_type == 'PANO':
+        # cylindrical views see all around
+        return np.zeros((0,3)), np.zeros(0)
+    if cam_type != 'ORTHO' and max(angle_x, angle_y) > math.radians(160.0):
+        # rendered as a hemispherical fisheye: everything in front of the camera
+        return np.array([[0.0,0.0,-1.0]]), np.zeros(1)
+    normals = [[0.0,0.0,-1.0]]
+    offsets = [-clip_start]
+    if cam_type == 'ORTHO':
+        # parallel view: slabs across x and y, sized in world units
+        half_x = ortho_scale / 2.0
+        half_y = half_x * math.tan(angle_y / 2.0) / math.tan(angle_x / 2.0)
+        for axis, half, shift in ((0, half_x, shift_x), (1, half_y, shift_y)):
+            lo = 2.0 * half * (shift - 0.5)
+            hi = 2.0 * half * (shift + 0.5)
+            n = [0.0,0.0,0.0]
+            n[axis] = 1.0
+            normals.append(list(n))
+            offsets.append(-lo)
+            n[axis] = -1.0
+            normals.append(n)
+            offsets.append(hi)
+    else:
+        # x / -z within the (shifted) view window, for x and y
+        for axis, angle, shift in ((0, angle_x, shift_x), (1, angle_y, shift_y)):
+            t = math.tan(angle / 2.0)
+            lo = 2.0 * t * (shift - 0.5)
+            hi = 2.0 * t * (shift + 0.5)
+            n = [0.0,0.0,0.0]
+            n[axis] = 1.0
+            n[2] = lo
+            normals.append(list(n))
+            n[axis] = -1.0
+            n[2] = -hi
+            normals.append(n)
+            offsets.extend([0.0,0.0])
+    normals = np.array(normals)
+    lengths = np.sqrt((normals * normals).sum(axis=1))
+    return normals / lengths[:,None], np.array(offsets) / lengths
+
+def visible_boxes(corners, cameras, margin=0.0):
+    # mask of the (n,8,3) world box corners seen by any of the cameras,
+    # (matrix_world (4,4), planes) pairs; a box is culled by a camera when all
+    # of its corners are more than margin outside one of the frustum planes
+    visible = np.zeros(len(corners), dtype=bool)
+    for matrix, (normals, offsets) in cameras:
+        matrix = np.asarray(matrix, dtype=np.float64)
+        # rotation without scale, so distances stay in world units
+        rotation = matrix[0:3,0:3] / np.sqrt((matrix[0:3,0:3] ** 2).sum(axis=0))
+        local = np.einsum('nkj,ji->nki', corners - matrix[0:3,3], rotation)
+        inside = np.ones(len(corners), dtype=bool)
+        for normal, offset in zip(normals, offsets):
+            inside &= (np.dot(local, normal) + offset).max(axis=1) >= -margin
+        visible |= inside
+    return visible
+
+
 class RadianceExporter(bpy.types.Operator, ExportHelper):
     """Export to Radiance"""
     
@@ -66,6 +357,44 @@ class RadianceExporter(bpy.types.Operator, ExportHelper):
             default=False)
     add_sky = BoolProperty(name="Add Sky",
             default=False)
+    write_buffer_kb = IntProperty(name="Write Buffer (KB)",
+            description="Size of the chunks geometry is streamed to disk in",
+            default=1024, min=16, max=65536)
+    geometry_mode = EnumProperty(name="Mesh Output",
+            description="Radiance primitives general meshes are written as",
+            items=(('POLYGON', "Polygons", "One polygon primitive per face"),
+                   ('MESH', "Mesh", "One mesh primitive per datablock, compiled by obj2mesh in run1")),
+            default='POLYGON')
+    incremental = BoolProperty(name="Incremental",
+            description="Export into an existing folder, leaving geometry, materials and images "
+                        "whose content hash has not changed since the last export",
+            default=False)
+    use_instances = BoolProperty(name="Instances",
+            description="Compile datablocks shared by several objects into their own octree "
+                        "and place them with instance primitives instead of !xform",
+            default=False)
+    frame_start = IntProperty(name="Start Frame",
+            description="Start frame for export",
+            default=1, min=1, max=300000)
+    frame_end = IntProperty(name="End Frame",
+            description="End frame for export",
+            default=1, min=1, max=300000)
+    use_sequence = BoolProperty(name="Frame Sequence",
+            description="Step through the frame range, writing only the transforms, cameras and lamps "
+                        "that change into frames/, with a run_frames script",
+            default=False)
+    cull_to_cameras = BoolProperty(name="Cull to Cameras",
+            description="Leave out objects whose bounding box no exported camera can see "
+                        "(single frame exports only)",
+            default=False)
+    cull_margin = FloatProperty(name="Cull Margin",
+            description="Keep objects this far outside the camera views, for the light they reflect into them",
+            default=2.0, min=0.0, max=100000.0)
+    workers = IntProperty(name="Workers",
+            description="Processes formatting untextured meshes in parallel (1 writes serially, 0 uses every core). "
+                        "Workers are forked from Blender, which is not safe with every add-on or platform; "
+                        "above 1 it also sets the cores of the tiled run3 scripts",
+            default=1, min=0, max=256)
             
 
     def execute(self, context):
@@ -73,14 +402,28 @@ class RadianceExporter(bpy.types.Operator, ExportHelper):
         self.folder = self.filepath
         self.camname = None
         self.images_to_convert = None
+        self.mesh_compiles = []
+        self.octree_compiles = []
+        scene = bpy.context.scene
+        frame_current = scene.frame_current
+        if self.use_sequence:
+            scene.frame_set(self.frame_start)
+        self.stats = {}
         self.make_folder()
-        self.write_cameras()
-        self.write_lighting()
-        self.write_sky()
-        self.write_radiance()
-        self.copy_images()
-        self.write_runs()
-        self.write_rif()
+        self.read_manifest()
+        self.timed(self.scan_scene)
+        self.timed(self.write_cameras)
+        self.timed(self.write_lighting)
+        self.timed(self.write_sky)
+        self.timed(self.write_radiance)
+        self.timed(self.copy_images)
+        self.timed(self.write_runs)
+        self.timed(self.write_rif)
+        if self.use_sequence:
+            self.timed(self.write_sequence)
+            scene.frame_set(frame_current)
+        self.write_manifest()
+        self.report_stats()
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -97,16 +440,154 @@ class RadianceExporter(bpy.types.Operator, ExportHelper):
     #3. add export functions to Exporter class
     # for fun / something different, here we implement #3
     def make_folder(self):
-        os.mkdir(self.folder)
+        os.makedirs(self.folder, exist_ok=True)
         return
 
+    def read_manifest(self):
+        # content hashes from the last export into this folder, see write_manifest
+        # {"geoms": {name: {"hash", "compile", "images"}}, "materials": hash, "images": {key: hash}}
+        self.manifest = {"geoms": {}, "materials": None, "images": {}}
+        self.old_manifest = {"geoms": {}, "materials": None, "images": {}}
+        manifest_name = os.path.join(self.folder,'manifest.json')
+        if self.incremental and os.path.exists(manifest_name):
+            mfn = open(manifest_name,"r")
+            self.old_manifest.update(json.load(mfn))
+            mfn.close()
+
+    def write_manifest(self):
+        mfn = open(os.path.join(self.folder,'manifest.json'),"w+")
+        json.dump(self.manifest, mfn, indent=1, sort_keys=True)
+        mfn.close()
+
+    def is_unchanged(self,path,old_hash,new_hash):
+        # incremental export: the file is kept if it is there and its inputs hash the same
+        return self.incremental and old_hash == new_hash and os.path.exists(path)
+
+    def geom_hash(self,obj_type,obj_data,mat,mat_name,arrays=None):
+        # hash everything a geom/<name>.rad depends on: the datablock,
+        # its material and the export settings that change its content;
+        # arrays are the mesh_arrays of a mesh, when they are already extracted
+        h = hashlib.sha1()
+        h.update(repr((obj_type,obj_data.name,mat_name,self.geometry_mode)).encode('utf-8'))
+        if mat is not None:
+            h.update(self.make_material(mat,mat_name).encode('utf-8'))
+            image = self.mat_has_image(mat)
+            if image:
+                h.update(repr((image.filepath,tuple(image.size),mat.texture_slots[0].texture_coords)).encode('utf-8'))
+        if obj_type == 'MESH':
+            if arrays is None:
+                arrays = self.mesh_arrays(obj_data)
+            for a in arrays[0:4]:
+                h.update(a.tobytes())
+            if obj_data.uv_layers.active:
+                uv = np.empty(len(obj_data.loops)*2, dtype=np.float32)
+                obj_data.uv_layers.active.data.foreach_get("uv", uv)
+                h.update(uv.tobytes())
+            smooth = np.empty(len(obj_data.polygons), dtype=np.bool_)
+            obj_data.polygons.foreach_get("use_smooth", smooth)
+            h.update(smooth.tobytes())
+        elif obj_type == 'FONT':
+            h.update(repr((obj_data.body,obj_data.size,obj_data.shear)).encode('utf-8'))
+        return h.hexdigest()
+
+    def image_hash(self,path_abs,image):
+        # source file and size of an image texture; the .hdr is redone when either changes
+        mtime = None
+        if os.path.exists(path_abs):
+            mtime = os.path.getmtime(path_abs)
+        h = hashlib.sha1(repr((path_abs,mtime,tuple(image.size),image.name)).encode('utf-8'))
+        return h.hexdigest()
+
     def is_visible(self,obj):
         # check if object is on a visible layer
         # when hacking a scene we often have construction junk on other layers
-        vis = False
-        for i in range(0,20):
-            vis = vis or obj.layers[i] and bpy.context.scene.layers[i]
-        return vis
+        # obj.layers[:] reads all 20 flags in one call, scene_layers comes from scan_scene
+        layers = obj.layers[:]
+        for i in self.scene_layers:
+            if layers[i]:
+                return True
+        return False
+
+    def scan_scene(self):
+        # single pass over scene.objects shared by all the writers:
+        # self.scene_table["types"]      type: [(obj, obj.data)] of exported objects, in scene order
+        # self.scene_table["hidden"]     objects left out by only_selected or layer visibility
+        # self.scene_table["geometry"]   exported MESH and FONT objects, in scene order
+        # self.scene_table["datablocks"] data name: [obj] for those
+        # self.scene_table["culled"]     geometry outside every camera frustum, with cull_to_cameras
+        scene = bpy.context.scene
+        self.scene_layers = [i for i in range(0,20) if scene.layers[i]]
+        types = {}
+        hidden = []
+        geometry = []
+        datablocks = {}
+        for obj in scene.objects:
+            if self.only_selected and not obj.select:
+                hidden.append(obj)
+                continue
+            if not self.is_visible(obj):
+                hidden.append(obj)
+                continue
+            obj_type = obj.type
+            obj_data = obj.data
+            types.setdefault(obj_type,[]).append((obj, obj_data))
+            if obj_type == 'MESH' or obj_type == 'FONT':
+                geometry.append(obj)
+                datablocks.setdefault(obj_data.name,[]).append(obj)
+        culled = []
+        if self.cull_to_cameras and not self.use_sequence and types.get('CAMERA') and geometry:
+            keep = self.cull_geometry(geometry, types['CAMERA'])
+            culled = [obj for obj, seen in zip(geometry, keep) if not seen]
+            geometry = [obj for obj, seen in zip(geometry, keep) if seen]
+            datablocks = {}
+            for obj in geometry:
+                datablocks.setdefault(obj.data.name,[]).append(obj)
+            for obj_type in ('MESH','FONT'):
+                if obj_type in types:
+                    types[obj_type] = [(obj, obj.data) for obj in geometry if obj.type == obj_type]
+            print("culled: %d of %d objects outside the camera views (margin %g)" %
+                  (len(culled), len(culled) + len(geometry), self.cull_margin))
+        elif self.cull_to_cameras:
+            print("culling skipped: it needs an exported camera, and a single frame")
+        self.scene_table = {"types": types, "hidden": hidden, "geometry": geometry, "datablocks": datablocks,
+                            "culled": culled}
+        self.stats["objects"] = len(scene.objects)
+        self.stats["culled"] = len(culled)
+        self.stats["hidden"] = len(hidden)
+        self.stats["datablocks"] = len(datablocks)
+        for obj_type in types:
+            self.stats["objects_" + obj_type.lower()] = len(types[obj_type])
+
+    def cull_geometry(self,geometry,cameras):
+        # mask of the geometry whose world bounding box some camera can see,
+        # give or take cull_margin for surfaces only reflecting light into view
+        corners = np.array([[tuple(c) for c in obj.bound_box] for obj in geometry])
+        matrices = np.array([np.array(obj.matrix_world) for obj in geometry])
+        corners = np.einsum('nij,nkj->nki', matrices[:,0:3,0:3], corners) + matrices[:,None,0:3,3]
+        views = []
+        for obj, obj_data in cameras:
+            planes = frustum_planes(obj_data.type, obj_data.angle_x, obj_data.angle_y, obj_data.shift_x,
+                                    obj_data.shift_y, obj_data.clip_start, obj_data.ortho_scale)
+            views.append((np.array(obj.matrix_world), planes))
+        return visible_boxes(corners, views, self.cull_margin)
+
+    def table_objects(self,obj_type):
+        # exported (obj, obj.data) of one type, in scene order
+        return self.scene_table["types"].get(obj_type,[])
+
+    def timed(self,stage):
+        # run an export stage and keep its wall time in self.stats
+        t0 = time.time()
+        stage()
+        self.stats["time_" + stage.__name__] = time.time() - t0
+
+    def report_stats(self):
+        for key in sorted(self.stats.keys()):
+            value = self.stats[key]
+            if key.startswith("time_"):
+                print("stats: %s %.3fs" % (key, value))
+            else:
+                print("stats: %s %d" % (key, value))
         
     def write_cameras(self):
 
@@ -126,65 +607,59 @@ class RadianceExporter(bpy.types.Operator, ExportHelper):
         
         fn = self.folder
 
-        scene = bpy.context.scene
-
-        cameras = []
-
-        for obj in scene.objects:
-            if self.only_selected and not obj.select:
-                continue
-            if not self.is_visible(obj):
-                continue
-            if obj.type != 'CAMERA':
-                continue
-
-            cameras.append((obj, obj.data))
+        cameras = self.table_objects('CAMERA')
 
+        self.cameras = cameras
         for obj, obj_data in cameras:
             cname = bpy.path.clean_name(obj.name)
             if self.camname is None:
                 self.camname = cname
             camfn = os.path.join(fn,cname)+'.vf'
-            cam = obj
-            mtx = obj.matrix_world.copy()
-            loc, rot, sca = mtx.decompose()
-            #rot = rot.to_euler()
-            vp = loc
-            vu = rot * Vector((0.0, 1.0, 0.0))
-            vd = rot * Vector((0.0, 0.0, -1.0))
-            vpx, vpy, vpz = vp
-            vux, vuy, vuz = vu
-            vdx, vdy, vdz = vd
-            lens = repr(getattr(obj_data, 'lens'))
-            vh = degrees(float(repr(getattr(obj_data, 'angle_x'))))
-            vv = degrees(float(repr(getattr(obj_data, 'angle_y'))))
-            vs = float(repr(getattr(obj_data, 'shift_x')))
-            vl = float(repr(getattr(obj_data, 'shift_y')))
-            vo = float(repr(getattr(obj_data, 'clip_start')))
-            va = float(repr(getattr(obj_data, 'clip_end')))
-            if va>=1000000.0:
-                    va = 0
-                    vo = 0
-            vtype = repr(getattr(obj_data, 'type')) # [‘PERSP’, ‘ORTHO’, ‘PANO’]
-            vt = 'v'
-            if vtype == 'ORTHO':
-                    vt = 'l'
-            if vtype == 'PANO':
-                    vt = 'c'
-            if vh>160.0 or vv>160.0:
-                    vt = 'a'
-                    vh = 180.0
-                    vv = 180.0
-            print(camfn, lens, vtype, vt, vp, vpx, vpy, vpz, vd, vdx, vdy, vdz, vu, vux, vuy, vuz, vh, vv, vo, va, vs, vl)
             fw = open(camfn, 'w')
-            if True:
-                #leave out/zero -va aft clipping plane to see sky at infinity
-                va = 0
-                fw.write('rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s -vh %s -vv %s -vo %s -va %s -vs %s -vl %s \n' % (vt, vpx, vpy, vpz, vdx, vdy, vdz, vux, vuy, vuz, vh, vv, vo, va, vs, vl))
-            else:
-                #simpler default window shape, no clipping, and I can see the sky
-                fw.write('rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s \n' % (vt, vpx, vpy, vpz, vdx, vdy, vdz, vux, vuy, vuz))
+            fw.write(self.make_view(obj, obj_data))
             fw.close()
+            print("written:", camfn)
+
+    def make_view(self, obj, obj_data):
+        cam = obj
+        mtx = obj.matrix_world.copy()
+        loc, rot, sca = mtx.decompose()
+        #rot = rot.to_euler()
+        vp = loc
+        vu = rot * Vector((0.0, 1.0, 0.0))
+        vd = rot * Vector((0.0, 0.0, -1.0))
+        vpx, vpy, vpz = vp
+        vux, vuy, vuz = vu
+        vdx, vdy, vdz = vd
+        vh = degrees(obj_data.angle_x)
+        vv = degrees(obj_data.angle_y)
+        vs = obj_data.shift_x
+        vl = obj_data.shift_y
+        vo = obj_data.clip_start
+        va = obj_data.clip_end
+        if va>=1000000.0:
+                va = 0
+                vo = 0
+        vtype = obj_data.type # ['PERSP', 'ORTHO', 'PANO']
+        vt = 'v'
+        if vtype == 'ORTHO':
+                # parallel views are sized in world units
+                vt = 'l'
+                vv = obj_data.ortho_scale * math.tan(obj_data.angle_y / 2.0) / math.tan(obj_data.angle_x / 2.0)
+                vh = obj_data.ortho_scale
+        if vtype == 'PANO':
+                vt = 'c'
+        if vt != 'l' and (vh>160.0 or vv>160.0):
+                vt = 'a'
+                vh = 180.0
+                vv = 180.0
+        if True:
+            #leave out/zero -va aft clipping plane to see sky at infinity
+            va = 0
+            return 'rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s -vh %s -vv %s -vo %s -va %s -vs %s -vl %s \n' % (vt, vpx, vpy, vpz, vdx, vdy, vdz, vux, vuy, vuz, vh, vv, vo, va, vs, vl)
+        else:
+            #simpler default window shape, no clipping, and I can see the sky
+            return 'rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s \n' % (vt, vpx, vpy, vpz, vdx, vdy, vdz, vux, vuy, vuz)
 
 
     def make_sun(self):
@@ -274,25 +749,28 @@ solar source sun
         # https://docs.blender.org/api/2.79/bpy.types.Lamp.html
         fn = self.folder
 
-        scene = bpy.context.scene
-
-        lighting = []
-
-        for obj in scene.objects:
-            if self.only_selected and not obj.select:
-                continue
-            if not self.is_visible(obj):
-                continue
-            if obj.type != 'LAMP':
-                continue
-
-            lighting.append((obj, obj.data))
+        lighting = self.table_objects('LAMP')
 
+        self.lighting = lighting
         lumname = os.path.join(fn,'lights.lum')
+        (lum_str,lamps) = self.make_lighting()
         f = open(lumname,'w')
+        f.write(lum_str)
+        f.close()
+        for ies in lamps:
+            fn3 = os.path.join(fn,ies);
+            f2 = open(fn3+'.rad','w+')
+            f2.write(lamps[ies])
+            f2.close()
+        print("written:", lumname)
 
+    def make_lighting(self, lamp_files=None):
+        # returns the lights.lum xforms and a dict of lamp name: lamp .rad string
+        # lamp_files optionally maps a lamp name to the file its xform references
+        lum_str = ''
+        lamps = {}
 
-        for obj, obj_data in lighting:
+        for obj, obj_data in self.lighting:
         
             if obj.type=='LAMP':
                 #name = bpy.path.clean_name(obj.name)
@@ -313,20 +791,16 @@ solar source sun
                 
                 #print(rx, ry, rz)
                 #print(dir(obj.matrix_world))
-                xform = '!xform -rx %s -ry %s -rz %s -t %s %s %s %s.rad\n' % (rx, ry, rz, x, y, z, ies)
-                print(xform)
-                f.write(xform)
-                str_lamp = self.make_lamp(ies,obj_data)
-                fn3 = os.path.join(fn,ies);
-                f2 = open(fn3+'.rad','w+')
-                f2.write(str_lamp)
-                f2.close()
+                lamp_file = ies + '.rad'
+                if lamp_files and ies in lamp_files:
+                    lamp_file = lamp_files[ies]
+                xform = '!xform -rx %s -ry %s -rz %s -t %s %s %s %s\n' % (rx, ry, rz, x, y, z, lamp_file)
+                lum_str = lum_str + xform
+                lamps[ies] = self.make_lamp(ies,obj_data)
 
             #obj.select = False
 
-       
-        f.close()
-        print("written:", lumname)
+        return (lum_str,lamps)
 
     def make_sky_mat(self):
         sky_str = """
@@ -436,149 +910,151 @@ groundglow source ground
             mat_str = mat_str + " %f\n" % (.5) #max radius?
         return mat_str
 
-    def transform_from_xyz_uv(self, xyz_list, uv_list):
+    def normalized(self, v):
+        # rows of v scaled to unit length; zero rows stay zero, as with Vector.normalized()
+        length = np.sqrt((v*v).sum(axis=1))
+        return v / np.where(length > 0.0, length, 1.0)[:,None]
+
+    def rotation_between(self, a, b):
+        # (n,3,3) shortest-arc rotations taking unit rows a onto unit rows b,
+        # like Vector.rotation_difference, via Rodrigues' formula
+        c = (a*b).sum(axis=1)
+        k = np.cross(a, b)
+        kx = np.zeros((len(a),3,3))
+        kx[:,0,1] = -k[:,2]
+        kx[:,0,2] = k[:,1]
+        kx[:,1,0] = k[:,2]
+        kx[:,1,2] = -k[:,0]
+        kx[:,2,0] = -k[:,1]
+        kx[:,2,1] = k[:,0]
+        opposite = c < -1.0 + 1e-9
+        d = np.where(opposite, 1.0, 1.0 + c)
+        rot = np.eye(3)[None,:,:] + kx + np.einsum('nij,njk->nik', kx, kx) / d[:,None,None]
+        if opposite.any():
+            # half turn about any axis perpendicular to a
+            ao = a[opposite]
+            axis = np.cross(ao, [1.0,0.0,0.0])
+            small = (axis*axis).sum(axis=1) < 1e-12
+            axis[small] = np.cross(ao[small], [0.0,1.0,0.0])
+            axis = self.normalized(axis)
+            rot[opposite] = 2.0 * np.einsum('ni,nj->nij', axis, axis) - np.eye(3)[None,:,:]
+        return rot
+
+    def transforms_from_xyz_uv(self, loop_co, loop_uv, loop_start, loop_total):
         # image textures in Blender have uv image coordinates for each mesh vertex
-        # radiance uses a transform -scale, 3 translations, 3 rotations- 
+        # radiance uses a transform -scale, 3 translations, 3 rotations-
         # to get from vertex to image texture space or vice versa
-        # xyz_list - list of 3D vertices for a single face of a mesh
-        # uv_list - list of 2D vertices for same face of a mesh
-        # using Vector, Quaternion, Matrix from:
-        # https://docs.blender.org/api/2.79/ Standalone Modules > Math Types
-
-        scale = 1.0
-        (rx,ry,rz) = (0.0,0.0,0.0)
-        (tx,ty,tz) = (0.0,0.0,0.0)
-
-        n = len(xyz_list)
-        if len(uv_list) < n:
-            print('ouch uv list different from xy list')
-            n = len(uv_list)
-        ninverse = 1.0/n
-        #convert to mathutils.Vector format
-        #https://docs.blender.org/api/2.79/mathutils.html#mathutils.Vector
-        vertices = []
-        uvs = []
-        for i in range(0,n):
-            vertices.append( Vector(xyz_list[i]) )
-            uvs.append( Vector((uv_list[i][0],uv_list[i][1],0.0)) ) #uvs are now 3D
-
-        if False:
-            for i in range(0,n):
-                print('xyz= %f %f %f ' % tuple(vertices[i].xyz))
-                print('uvs= %f %f\n' % tuple(uvs[i].xy))
-        # compute center of each
-        pcenter = Vector([0,0,0])
-        uvcenter = Vector([0,0,0])
-        for i in range(0,n):
-            pcenter = pcenter + vertices[i]
-            uvcenter = uvcenter + uvs[i]
-        pcenter = pcenter * ninverse
-        uvcenter = uvcenter * ninverse
-        # reduce to center
-        for i in range(0,n):
-            vertices[i] = vertices[i] - pcenter
-            uvs[i] = uvs[i] - uvcenter
-        quat_total = Quaternion((0,0,1),0)
-        doing_rotation = True
-        if doing_rotation:
-            # compute face normals
-            pnormal = Vector([0,0,0])
-            uvnormal = Vector([0,0,0])
-            for i in range(0,n):
-                ii = (i+1) % n #next vertex in list
-                vi = vertices[i].normalized()
-                vii = vertices[ii].normalized()
-                pnormal = pnormal + vi.cross(vii)
-                uvsi = uvs[i].normalized()
-                uvsii = uvs[ii].normalized()
-                uvnormal = uvnormal + uvsi.cross(uvsii)
-            pnormal = pnormal.normalized()
-            uvnormal = uvnormal.normalized()
-            print('pnormal='+str(pnormal))
-            print('uvnormal='+str(uvnormal))
-            # get the rotation between the 2 normals
-            #cosine = uvnave.dot(pnave)
-            #axis = uvnave.cross(pnave)
-            #quat1 = uvnormal.rotation_difference(pnormal)
-            quat1 = pnormal.rotation_difference(uvnormal)
-            (axis,angle) = quat1.to_axis_angle()
-            print('angle1 = '+str(degrees(angle))+' axis1='+str(axis))
-
-            #quat = quaternion(axis,cosine)
-            # rotate one into system of other
-            for i in range(0,n):
-                v1 = vertices[i].copy()
-                vertices[i].rotate(quat1)
-                v2 = vertices[i]
-                print('b[%f %f %f] a[%f %f %f]' % (v1.x,v1.y,v1.z,v2.x,v2.y,v2.z))
-            (axis,angle) = quat_total.to_axis_angle()
-            print('quatT_='+str(quat_total.angle)+' '+str(quat_total.axis))
-            print('quatT ='+str(angle)+' '+str(axis))
-            quat_total = quat_total * quat1
-            print('quat1='+str(quat1.angle)+' '+str(quat1.axis))
-            print('quatT='+str(quat_total.angle)+' '+str(quat_total.axis))
-            (axis,angle) = quat_total.to_axis_angle()
-            print('quatT ='+str(angle)+' '+str(axis))
-        # get the scale difference
-        scale = 1.0
-        doing_scale = True
-        if doing_scale:
-            scale = 0.0
-            for i in range(0,n):
-                scale = scale + uvs[i].length / vertices[i].length
-            scale = scale * ninverse
-            #scale one to the other
-            for i in range(0,n):
-                vertices[i] = vertices[i]*scale
-        doing_rotation2 = False
-        quat2 = Quaternion((0,0,1),0.0)
-        if doing_rotation2:
-            # find the rotation in the uv plane
-            angle = 0.0
-            axis = Vector((0,0,0))
-            for i in range(0,n):
-                #cosine = vertices[i].normalized().dot(uvs[i].normalized())
-                #sine = vertices[i].normalized().cross(uvs[i].normalized()).length
-                #angle = angle + math.atan2(sine,cosine)
-                quatb = vertices[i].normalized().rotation_difference(uvs[i].normalized())
-                angle = angle + quatb.angle
-                axis = axis + quatb.axis
-            angle = angle * ninverse
-            axis = axis * ninverse
-            print('angle2 = '+str(degrees(angle))+' axis2='+str(axis))
-            #apply planar angle to one
-            quat2 = Quaternion(uvnormal,angle)
-            for i in range(0,n):
-                vertices[i].rotate(quat2)
-            quat_total = quat_total * quat2
-        #done now they should align pretty close
-        if True:
-            for i in range(0,n):
-                close = True
-                close = close and math.isclose(vertices[i].x, uvs[i].x, abs_tol=.01)
-                close = close and math.isclose(vertices[i].y, uvs[i].y, abs_tol=.01)
-                close = close and math.isclose(vertices[i].z, 0.0, abs_tol=.01)
-                if not close:
-                    (x,y,z) = tuple(vertices[i].xyz)
-                    (u,v) = tuple(uvs[i].xy)
-                    print("Not close: %d [%f %f %f] [%f %f]" % (i,x,y,z,u,v) )
-        # combine all the transforms into one
-        M0 = Matrix.Translation(tuple((pcenter * -1.0).xyz))            
-        M1 = Matrix.Rotation(quat1.angle,4,quat1.axis)
-        M2 = Matrix.Scale(scale,4)
-        M3 = Matrix.Rotation(quat2.angle,4,quat2.axis)
-        M4 = Matrix.Translation(tuple(uvcenter.xyz))
-        M = M4*M3*M2*M1*M0
-        M.invert_safe()
-        (trans,rot,scales) = M.decompose()
-        (tx,ty,tz) = tuple(trans.xyz)
-        (rx,ry,rz) = rot.to_euler()
-        (rx,ry,rz) = (degrees(rx),degrees(ry),degrees(rz))
-        scale = scales[0]    
-        print('pcenter [%f %f %f] ' % tuple(pcenter.xyz))
-        print('uvcenter [%f %f %f]' % tuple(uvcenter.xyz) )
-        print('trans_total: [%f %f %f] ' % (tx,ty,tz))
-        return (rx,ry,rz,scale,tx,ty,tz)
+        # loop_co (n,3) and loop_uv (n,2) are the face corners, loop_start and
+        # loop_total index them per face as in Mesh.polygons
+        # all faces are solved together; returns an (nfaces,7) array of
+        # rx ry rz (degrees) scale tx ty tz, the uv -> xyz transform of each face
+        nfaces = len(loop_start)
+        first = np.cumsum(loop_total) - loop_total
+        face = np.repeat(np.arange(nfaces), loop_total)
+        idx = loop_start[face] + np.arange(len(face)) - first[face]
+        vertices = loop_co[idx].astype(np.float64)
+        uvs = np.zeros((len(idx),3)) #uvs are now 3D
+        uvs[:,0:2] = loop_uv[idx]
+        ninverse = 1.0 / loop_total
+        # compute center of each face and reduce to center
+        pcenter = np.add.reduceat(vertices, first, axis=0) * ninverse[:,None]
+        uvcenter = np.add.reduceat(uvs, first, axis=0) * ninverse[:,None]
+        vertices = vertices - pcenter[face]
+        uvs = uvs - uvcenter[face]
+        # face normals, from the cross products of consecutive corners
+        following = np.arange(len(face)) + 1
+        following[first + loop_total - 1] = first
+        vn = self.normalized(vertices)
+        uvn = self.normalized(uvs)
+        pnormal = self.normalized(np.add.reduceat(np.cross(vn, vn[following]), first, axis=0))
+        uvnormal = self.normalized(np.add.reduceat(np.cross(uvn, uvn[following]), first, axis=0))
+        # rotate one normal into the other
+        rot = self.rotation_between(pnormal, uvnormal)
+        # the scale difference, mean ratio of distances from the centers
+        plength = np.sqrt((vertices*vertices).sum(axis=1))
+        uvlength = np.sqrt((uvs*uvs).sum(axis=1))
+        used = plength > 0.0
+        ratio = np.where(used, uvlength / np.where(used, plength, 1.0), 0.0)
+        scale = np.add.reduceat(ratio, first) / np.maximum(np.add.reduceat(used.astype(np.float64), first), 1.0)
+        scale[scale == 0.0] = 1.0
+        # xyz -> uv is translate(uvcenter) * scale * rot * translate(-pcenter)
+        # radiance wants its inverse: rotation rot^T, scale 1/scale and
+        # translation pcenter - rot^T * uvcenter / scale
+        inverse = np.transpose(rot, (0,2,1))
+        trans = pcenter - np.einsum('nij,nj->ni', inverse, uvcenter) / scale[:,None]
+        # euler XYZ angles of the inverse rotation (Rz * Ry * Rx), as -rx -ry -rz apply them
+        cy = np.hypot(inverse[:,0,0], inverse[:,1,0])
+        gimbal = cy < 1e-9
+        rx = np.where(gimbal, np.arctan2(-inverse[:,1,2], inverse[:,1,1]), np.arctan2(inverse[:,2,1], inverse[:,2,2]))
+        ry = np.arctan2(-inverse[:,2,0], cy)
+        rz = np.where(gimbal, 0.0, np.arctan2(inverse[:,1,0], inverse[:,0,0]))
+        return np.column_stack((np.degrees(rx), np.degrees(ry), np.degrees(rz), 1.0 / scale, trans))
+
+    def make_textures(self, geom_name, mat_name, image_path_scene, transforms, decimals=4):
+        # one colorpict per distinct transform: faces whose transforms agree to
+        # the given decimals share a modifier instead of one *_pict per polygon
+        # returns (texture number of each face, colorpict strings, names)
+        keys = np.around(transforms, decimals) + 0.0 # + 0.0 folds -0.0 into 0.0
+        (_,inverse) = self.unique_rows(keys)
+        ntex = inverse.max() + 1 if len(inverse) else 0
+        # the transform of each texture is that of the first face using it
+        firsts = np.full(ntex, len(inverse), dtype=np.int64)
+        np.minimum.at(firsts, inverse, np.arange(len(inverse)))
+        order = np.argsort(firsts)
+        renumber = np.empty(ntex, dtype=np.int64)
+        renumber[order] = np.arange(ntex)
+        inverse = renumber[inverse]
+        tex_names = []
+        tex_strs = []
+        for (rx,ry,rz,scale,tx,ty,tz) in transforms[firsts[order]].tolist():
+            texture_name = '%s.t%d_pict' % (geom_name,len(tex_names))
+            """
+            Material colorpict Material_pict
+            13 clip_r clip_g clip_b images/test_image.hdr picture.cal pic_u pic_v  -t -.8 -.5 0.0 -s 1.25
+            0
+            0
+            """
+            # https://docs.blender.org/api/2.79/bpy.types.Image.html
+            ns = 19
+            tex_str = "%s colorpict %s\n" % (mat_name,texture_name)
+            tex_str = tex_str + "%d clip_r clip_g clip_b %s picture.cal " % (ns,image_path_scene)
+            tex_str = tex_str + "pic_u pic_v "
+            tex_str = tex_str + "-rx %f -ry %f -rz %f " % (rx,ry,rz)
+            tex_str = tex_str + "-s %f " % (scale)
+            tex_str = tex_str + "-t %f %f %f " % (tx,ty,tz)
+            tex_str = tex_str + "\n0\n0\n\n"
+            tex_names.append(texture_name)
+            tex_strs.append(tex_str)
+        return (inverse, tex_strs, tex_names)
+
+    def textured_pieces(self, geom_name, mat_name, image_path_scene, loop_co, loop_uv, loop_start, loop_total,
+                        mapped_co=None):
+        # polygons with their shared colorpict modifiers, each colorpict
+        # written just before the first polygon that uses it
+        # mapped_co, if given, replaces loop_co when solving the transforms
+        # blender solves internally for a texture coordinate based  on XYZ, UV coords
+        # radiance uses a 3D similarity transform (single scale, 3 rotations, 3 translations)
+        # - only 7 parameter transform, so can't do complete job
+        # here we compute the closest radiance similarity transform for every face
+        if mapped_co is None:
+            mapped_co = loop_co
+        transforms = self.transforms_from_xyz_uv(mapped_co,loop_uv,loop_start,loop_total)
+        (face_tex,tex_strs,tex_names) = self.make_textures(geom_name,mat_name,image_path_scene,transforms)
+        print('%s: %d faces share %d colorpict transforms' % (geom_name,len(face_tex),len(tex_strs)))
+        flat = loop_co.ravel().tolist()
+        face_tex = face_tex.tolist()
+        loop_start = loop_start.tolist()
+        loop_total = loop_total.tolist()
+        for pcount in range(0,len(loop_start)):
+            start = loop_start[pcount]
+            total = loop_total[pcount]
+            k = face_tex[pcount]
+            tex_str = tex_strs[k]
+            tex_strs[k] = ""
+            poly_str = "%s polygon %s.p%s\n0\n0\n" % (tex_names[k],geom_name,str(pcount))
+            poly_str = poly_str + "%d\n" % (total * 3)
+            poly_str = poly_str + ("  %.6f %.6f %.6f\n" * total) % tuple(flat[start*3:(start + total)*3])
+            yield tex_str + poly_str + '\n'
 
     def make_sphere(self,geom_name,radius,mat_name):
         geom_str = "%s sphere %s\n0\n0\n4 0 0 0 %f\n" % (mat_name,geom_name,radius)
@@ -596,14 +1072,41 @@ groundglow source ground
         ring_str = "%s ring %s\n0\n0\n8 %f %f %f %f %f %f %f %f\n" % (mat_name,geom_name,center[0],center[1],center[2],direction[0],direction[1],direction[2],radius1,radius2)
         return ring_str
     def make_bbox(self,vertices):
-        # make a bounding box from a list of vertices
-        bbmin = [1e17,1e17,1e17]
-        bbmax = [-1e17,-1e17,-1e17]
-        for p in vertices:
-            for i in range(0,len(p)):
-                bbmin[i] = min(p[i],bbmin[i])
-                bbmax[i] = max(p[i],bbmax[i])
-        return (bbmin,bbmax)
+        # make a bounding box from an (n,3) array of vertices
+        if len(vertices) == 0:
+            return (np.array([1e17,1e17,1e17]),np.array([-1e17,-1e17,-1e17]))
+        return (vertices.min(axis=0).astype(np.float64),vertices.max(axis=0).astype(np.float64))
+
+    def mesh_arrays(self,obj_data,uv_layer=None):
+        # bulk extraction: one foreach_get per attribute into contiguous arrays,
+        # instead of crossing the RNA layer for every vertex and loop
+        # returns (co, loop_vertex_index, loop_start, loop_total, uv)
+        # uv is per loop, or None without a uv_layer
+        nv = len(obj_data.vertices)
+        nl = len(obj_data.loops)
+        npoly = len(obj_data.polygons)
+        co = np.empty(nv*3, dtype=np.float32)
+        obj_data.vertices.foreach_get("co", co)
+        loop_vi = np.empty(nl, dtype=np.int32)
+        obj_data.loops.foreach_get("vertex_index", loop_vi)
+        loop_start = np.empty(npoly, dtype=np.int32)
+        obj_data.polygons.foreach_get("loop_start", loop_start)
+        loop_total = np.empty(npoly, dtype=np.int32)
+        obj_data.polygons.foreach_get("loop_total", loop_total)
+        uv = None
+        if uv_layer:
+            uv = np.empty(nl*2, dtype=np.float32)
+            uv_layer.foreach_get("uv", uv)
+            uv = uv.reshape(-1,2)
+        return (co.reshape(-1,3),loop_vi,loop_start,loop_total,uv)
+
+    def lazy_uvs(self,loop_co,bbmin,bbmax):
+        # no uv_layer is the 'lazy way',
+        # in blender just add a texture, type=IMAGE or MOVIE, and Image > Open
+        # Materials > Mapping leave default GENERATED (which is GLOBAL, although here we assume OBJECT)
+        # then mesh vertices xy are scaled and translated to 0 - 1 range and used as uvs
+        # OK for Plane geometry
+        return (loop_co[:,0:2] - bbmin[0:2]) / (bbmax[0:2] - bbmin[0:2])
 
     def mat_has_image(self,mat):
         image = None
@@ -630,12 +1133,7 @@ groundglow source ground
         # detect if there's an image texture
         image = self.mat_has_image(mat)
 
-        vertices = []
-        nv = len(obj_data.vertices)
-        for i in range(0,nv):
-            vertices.append(obj_data.vertices[i].co)
-        #in case we need to make uvs from vertices for lazy method (see below)
-        (bbmin,bbmax) = self.make_bbox(vertices)
+        uv_layer = None
         if image:
             (ix,iy) = image.size
             # https://floyd.lbl.gov/radiance/refer/usman2.pdf
@@ -667,82 +1165,24 @@ groundglow source ground
             if self.images_to_convert is None:
                 self.images_to_convert = {} 
             self.images_to_convert[image_path_root] = (image_path_abs,image_path_ext,image) #dict will elliminate duplicates
-                
-        geom_str = ""
-        pcount = 0
-        for poly in obj_data.polygons:
-            modifier = mat_name
-            texture_name = None
-            tex_str = ""
-            if image:
-                """
-                Material colorpict Material_pict
-                13 clip_r clip_g clip_b images/test_image.hdr picture.cal pic_u pic_v  -t -.8 -.5 0.0 -s 1.25
-                0
-                0
-                """
-                texture_name = '%s.p%s_pict' % (geom_name,str(pcount))
-                modifier = texture_name
-                tex_str = "%s colorpict %s\n" % (mat_name,texture_name)
-            poly_str = "%s polygon %s.p%s\n0\n0\n" % (modifier,geom_name,str(pcount))
-            poly_str = poly_str + "%d\n" % (poly.loop_total * 3)
-            uv_list = []
-            xyz_list = []
-            for loop_index in range(poly.loop_start, poly.loop_start + poly.loop_total):
-                vertex_index = obj_data.loops[loop_index].vertex_index
-                poly_str = poly_str + "  %.6f %.6f %.6f\n" % tuple(vertices[vertex_index])
-                if image:
-                    xyz_list.append(vertices[vertex_index])
-                    if uv_layer:
-                        # uv layer is detailed way,
-                        # in blender, Materials > Mapping > change GENERATED to UV
-                        # and Edit Mode, Mesh > uv unwrap > uv unwrap or smart uv unwrap
-                        # highlight a mesh face, and switch to UV Editor to correct
-                        uv = uv_layer[loop_index].uv
-                        uv_list.append([uv[0],uv[1]])
-                    else:
-                        # no uv_layer is the 'lazy way',
-                        # in blender just add a texture, type=IMAGE or MOVIE, and Image > Open
-                        # Materials > Mapping leave default GENERATED (which is GLOBAL, although here we assume OBJECT)
-                        # then mesh vertices xy are scaled and translated to 0 - 1 range and used as uvs
-                        # OK for Plane geometry
-                        v = vertices[vertex_index]
-                        uv = [0,0]
-                        #scale object xy to 0 to 1 blender UV range
-                        uv[0] = (v[0]-bbmin[0])/(bbmax[0]-bbmin[0]) 
-                        uv[1] = (v[1]-bbmin[1])/(bbmax[1]-bbmin[1])
-                        uv_list.append(uv)
-            if image:
-                print('before uv scaling')
-                for i in range(0,len(uv_list)):
-                    print('[%f %f %f] [%f %f]' % (xyz_list[i][0],xyz_list[i][1],xyz_list[i][2],uv_list[i][0],uv_list[i][1]))
-                print('after uv scaling')
-                for i in range(0,len(uv_list)):
-                    # rescale UVs from blender 0 to 1 range
-                    # into Radiance aspect ratio range (0 - 1 on short axis, 0 to 1+ on long axis)
-                    uv_list[i][0] = uv_list[i][0] * uvblend2uvrad_scales[0]
-                    uv_list[i][1] = uv_list[i][1] * uvblend2uvrad_scales[1]
-                    print('[%f %f %f] [%f %f]' % (xyz_list[i][0],xyz_list[i][1],xyz_list[i][2],uv_list[i][0],uv_list[i][1]))
-                # blender solves internally for a texture coordinate based  on XYZ, UV coords
-                # goiong triangle by triangle, can do barycentric to barycentric, but for full polygon
-                # I think it would be an 11 parameter, 2-point perspective transform
-                # - 3 scales, 3 rotations, 3 translations, and 2 perspectives, or
-                # radiance uses a 3D similarity transform (single an-isotropic scale, 3 rotations, 3 translations)
-                #- only 7 parameter transform, so can't do complete job
-                # here we attempt to compute the closest radiance similarity transform to replace XYZ,UV mapping:
-                (rx,ry,rz,scale,tx,ty,tz) = self.transform_from_xyz_uv(xyz_list,uv_list)
-                # https://docs.blender.org/api/2.79/bpy.types.Image.html
-                ns = 19
-                tex_str = tex_str + "%d clip_r clip_g clip_b %s picture.cal " % (ns,image_path_scene)
-                tex_str = tex_str + "pic_u pic_v "
-                tex_str = tex_str + "-rx %f -ry %f -rz %f " % (rx,ry,rz)
-                tex_str = tex_str + "-s %f " % (scale)
-                tex_str = tex_str + "-t %f %f %f " % (tx,ty,tz)
-                tex_str = tex_str + "\n0\n0\n\n"
-                    
-            pcount = pcount + 1
-            geom_str = geom_str + tex_str + poly_str + '\n'
-        return geom_str
+
+        (co,loop_vi,loop_start,loop_total,uvs) = self.mesh_arrays(obj_data,uv_layer)
+        loop_co = co[loop_vi]
+        if not image:
+            yield from polygon_pieces(mat_name,geom_name,loop_co,loop_start,loop_total)
+            return
+        # uv layer is detailed way,
+        # in blender, Materials > Mapping > change GENERATED to UV
+        # and Edit Mode, Mesh > uv unwrap > uv unwrap or smart uv unwrap
+        # highlight a mesh face, and switch to UV Editor to correct
+        # without one, uvs are made from the bounding box (lazy method)
+        if uvs is None:
+            (bbmin,bbmax) = self.make_bbox(co)
+            uvs = self.lazy_uvs(loop_co,bbmin,bbmax)
+        # rescale UVs from blender 0 to 1 range
+        # into Radiance aspect ratio range (0 - 1 on short axis, 0 to 1+ on long axis)
+        uvs = uvs * uvblend2uvrad_scales
+        yield from self.textured_pieces(geom_name,mat_name,image_path_scene,loop_co,uvs,loop_start,loop_total)
 
     def make_grid(self,obj_data,geom_name,mat,mat_name):
         #Quad faces are non-planar, so need to be split into 2 triangles
@@ -750,12 +1190,7 @@ groundglow source ground
         # detect if there's an image texture
         image = self.mat_has_image(mat)
 
-        vertices = []
-        nv = len(obj_data.vertices)
-        for i in range(0,nv):
-            vertices.append(obj_data.vertices[i].co)
-        #in case we need to make uvs from vertices for lazy method (see below)
-        (bbmin,bbmax) = self.make_bbox(vertices)
+        uv_layer = None
         if image:
             (ix,iy) = image.size
             # https://floyd.lbl.gov/radiance/refer/usman2.pdf
@@ -788,97 +1223,111 @@ groundglow source ground
                 self.images_to_convert = {} 
             self.images_to_convert[image_path_root] = (image_path_abs,image_path_ext,image) #dict will elliminate duplicates
 
-        geom_str = ""
-        pcount = 0
-        for poly in obj_data.polygons:
-            verts = []
-            for loop_index in range(poly.loop_start, poly.loop_start + poly.loop_total):
-                vertex_index = obj_data.loops[loop_index].vertex_index
-                verts.append(obj_data.vertices[vertex_index].co)
-            # IDEA: split quad into triangles along the biggest height difference if there is one
-            ii = 0
-            if math.fabs(verts[0][2] - verts[2][2]) < math.fabs(verts[1][2] - verts[3][2]):
-                ii = 1
-            for itri in range(0,2):
-                modifier = mat_name
-                texture_name = None
-                tex_str = ""
-                if image:
-                    """
-                    Material colorpict Material_pict
-                    13 clip_r clip_g clip_b images/test_image.hdr picture.cal pic_u pic_v  -t -.8 -.5 0.0 -s 1.25
-                    0
-                    0
-                    """
-                    texture_name = '%s.p%s_pict' % (geom_name,str(pcount))
-                    modifier = texture_name
-                    tex_str = "%s colorpict %s\n" % (mat_name,texture_name)
-                
-                poly_str = "%s polygon %s.p%s\n0\n0\n" % (modifier,geom_name,str(pcount))
-                poly_str = poly_str + "%d\n" % (3 * 3)
-                uv_list = []
-                xyz_list = []
-                iv0 = itri *2   #(0 or 2) for first vertex
-                iv1 = iv0 + 1   #(1 or 3) for 2nd vertex
-                iv2 = (iv1 + 1 + ii) % 4  # (2 or 0), or (3 or 1) for 3rd vertex depending on which way we split
-                #print('iv0,iv1,iv2='+str(iv0)+' '+str(iv1)+' '+str(iv2)+' ii='+str(ii))
-                iv = [iv0, iv1, iv2]
-                for ip in range(0,3):
-                    vert = verts[iv[ip]]
-                    poly_str = poly_str + "  %.6f %.6f %.6f\n" % (vert[0],vert[1],vert[2])
-
-                    if image:
-                        xyz_list.append([vert[0],vert[1],0.0])
-                        if uv_layer:
-                            # uv layer is detailed way,
-                            # in blender, Materials > Mapping > change GENERATED to UV
-                            # and Edit Mode, Mesh > uv unwrap > uv unwrap or smart uv unwrap
-                            # highlight a mesh face, and switch to UV Editor to correct
-                            uv = uv_layer[loop_index].uv
-                            uv_list.append([uv[0],uv[1]])
-                        else:
-                            # no uv_layer is the 'lazy way',
-                            # in blender just add a texture, type=IMAGE or MOVIE, and Image > Open
-                            # Materials > Mapping leave default GENERATED (which is GLOBAL, although here we assume OBJECT)
-                            # then mesh vertices xy are scaled and translated to 0 - 1 range and used as uvs
-                            # OK for Plane geometry
-                            v = xyz_list[ip]
-                            uv = [0,0]
-                            #scale object xy to 0 to 1 blender UV range
-                            uv[0] = (v[0]-bbmin[0])/(bbmax[0]-bbmin[0]) 
-                            uv[1] = (v[1]-bbmin[1])/(bbmax[1]-bbmin[1])
-                            uv_list.append(uv)
-                if image:
-                    print('before uv scaling')
-                    for i in range(0,len(uv_list)):
-                        print('[%f %f %f] [%f %f]' % (xyz_list[i][0],xyz_list[i][1],xyz_list[i][2],uv_list[i][0],uv_list[i][1]))
-                    print('after uv scaling')
-                    for i in range(0,len(uv_list)):
-                        # rescale UVs from blender 0 to 1 range
-                        # into Radiance aspect ratio range (0 - 1 on short axis, 0 to 1+ on long axis)
-                        uv_list[i][0] = uv_list[i][0] * uvblend2uvrad_scales[0]
-                        uv_list[i][1] = uv_list[i][1] * uvblend2uvrad_scales[1]
-                        print('[%f %f %f] [%f %f]' % (xyz_list[i][0],xyz_list[i][1],xyz_list[i][2],uv_list[i][0],uv_list[i][1]))
-                    # blender solves internally for a texture coordinate based  on XYZ, UV coords
-                    # goiong triangle by triangle, can do barycentric to barycentric, but for full polygon
-                    # I think it would be an 11 parameter, 2-point perspective transform
-                    # - 3 scales, 3 rotations, 3 translations, and 2 perspectives, or
-                    # radiance uses a 3D similarity transform (single an-isotropic scale, 3 rotations, 3 translations)
-                    #- only 7 parameter transform, so can't do complete job
-                    # here we attempt to compute the closest radiance similarity transform to replace XYZ,UV mapping:
-                    (rx,ry,rz,scale,tx,ty,tz) = self.transform_from_xyz_uv(xyz_list,uv_list)
-                    # https://docs.blender.org/api/2.79/bpy.types.Image.html
-                    ns = 19
-                    tex_str = tex_str + "%d clip_r clip_g clip_b %s picture.cal " % (ns,image_path_scene)
-                    tex_str = tex_str + "pic_u pic_v "
-                    tex_str = tex_str + "-rx %f -ry %f -rz %f " % (rx,ry,rz)
-                    tex_str = tex_str + "-s %f " % (scale)
-                    tex_str = tex_str + "-t %f %f %f " % (tx,ty,tz)
-                    tex_str = tex_str + "\n0\n0\n\n"
-                pcount = pcount + 1
-                geom_str = geom_str + tex_str + poly_str + '\n'
-                
-        return geom_str
+        (co,loop_vi,loop_start,loop_total,uvs) = self.mesh_arrays(obj_data,uv_layer)
+        #in case we need to make uvs from vertices for lazy method (see below)
+        (bbmin,bbmax) = self.make_bbox(co)
+        loop_co = co[loop_vi]
+        # corners 0 1 2 3 of each quad
+        quads = loop_start[:,None] + np.arange(4)[None,:]
+        z = loop_co[quads,2]
+        # IDEA: split quad into triangles along the biggest height difference if there is one
+        ii = (np.fabs(z[:,0] - z[:,2]) < np.fabs(z[:,1] - z[:,3])).astype(np.int32)
+        # triangles (0, 1, 2 or 3) and (2, 3, 0 or 1)
+        tris = np.empty((len(quads),2,3), dtype=np.int32)
+        tris[:,0,0] = quads[:,0]
+        tris[:,0,1] = quads[:,1]
+        tris[:,0,2] = loop_start + 2 + ii
+        tris[:,1,0] = quads[:,2]
+        tris[:,1,1] = quads[:,3]
+        tris[:,1,2] = loop_start + ii
+        tris = tris.reshape(-1)
+        tri_co = loop_co[tris]
+        tri_start = np.arange(0,len(tris),3,dtype=np.int32)
+        tri_total = np.full(len(tri_start),3,dtype=np.int32)
+        if not image:
+            yield from polygon_pieces(mat_name,geom_name,tri_co,tri_start,tri_total)
+            return
+        # textures are mapped on the xy plane of the grid
+        tri_xy = tri_co.copy()
+        tri_xy[:,2] = 0.0
+        if uvs is not None:
+            # uv layer is detailed way,
+            # in blender, Materials > Mapping > change GENERATED to UV
+            # and Edit Mode, Mesh > uv unwrap > uv unwrap or smart uv unwrap
+            tri_uvs = uvs[tris]
+        else:
+            # no uv_layer is the 'lazy way',
+            # in blender just add a texture, type=IMAGE or MOVIE, and Image > Open
+            # Materials > Mapping leave default GENERATED (which is GLOBAL, although here we assume OBJECT)
+            # then mesh vertices xy are scaled and translated to 0 - 1 range and used as uvs
+            tri_uvs = self.lazy_uvs(tri_xy,bbmin,bbmax)
+        # rescale UVs from blender 0 to 1 range
+        # into Radiance aspect ratio range (0 - 1 on short axis, 0 to 1+ on long axis)
+        tri_uvs = tri_uvs * uvblend2uvrad_scales
+        yield from self.textured_pieces(geom_name,mat_name,image_path_scene,tri_co,tri_uvs,tri_start,tri_total,tri_xy)
+
+    def unique_rows(self,a):
+        # unique rows of a 2d array and the inverse index, without np.unique(axis=0)
+        a = np.ascontiguousarray(a)
+        rows = a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1]))).ravel()
+        (_,index,inverse) = np.unique(rows, return_index=True, return_inverse=True)
+        return (a[index],inverse)
+
+    def format_rows(self,fmt,rows,chunk=65536):
+        # format an (n,k) array with one %-operation per block of rows
+        for i in range(0,len(rows),chunk):
+            block = rows[i:i+chunk]
+            yield (fmt * len(block)) % tuple(block.ravel().tolist())
+
+    def make_obj_mesh(self,obj_data):
+        # Wavefront OBJ on shared tables, the input obj2mesh compiles to a radiance .rtm
+        # v one per mesh vertex, vn one per vertex for smooth faces, vt one per distinct uv
+        uv_layer = None
+        if obj_data.uv_layers.active:
+            uv_layer = obj_data.uv_layers.active.data
+        (co,loop_vi,loop_start,loop_total,uvs) = self.mesh_arrays(obj_data,uv_layer)
+        normals = np.empty(len(obj_data.vertices)*3, dtype=np.float32)
+        obj_data.vertices.foreach_get("normal", normals)
+        smooth = np.empty(len(obj_data.polygons), dtype=np.bool_)
+        obj_data.polygons.foreach_get("use_smooth", smooth)
+        yield from self.format_rows("v %.6f %.6f %.6f\n",co)
+        if uvs is not None:
+            (uv_table,loop_vt) = self.unique_rows(uvs)
+            yield from self.format_rows("vt %.6f %.6f\n",uv_table)
+            loop_vt = (loop_vt + 1).tolist()
+        if smooth.any():
+            yield from self.format_rows("vn %.6f %.6f %.6f\n",normals.reshape(-1,3))
+        smooth = smooth.tolist()
+        loop_v = (loop_vi + 1).tolist()
+        loop_start = loop_start.tolist()
+        loop_total = loop_total.tolist()
+        for i in range(0,len(loop_start)):
+            start = loop_start[i]
+            v = loop_v[start:start + loop_total[i]]
+            if uvs is not None:
+                vt = loop_vt[start:start + loop_total[i]]
+                if smooth[i]:
+                    tokens = ["%d/%d/%d" % (v[j],vt[j],v[j]) for j in range(0,len(v))]
+                else:
+                    tokens = ["%d/%d" % (v[j],vt[j]) for j in range(0,len(v))]
+            elif smooth[i]:
+                tokens = ["%d//%d" % (vi,vi) for vi in v]
+            else:
+                tokens = ["%d" % vi for vi in v]
+            yield "f " + " ".join(tokens) + "\n"
+
+    def make_mesh_primitive(self,obj_data,geom_name,mat_name):
+        # radiance mesh primitive instead of one polygon per face:
+        # geom/<name>.obj holds the shared vertex/normal/uv tables,
+        # run1 compiles it with obj2mesh into geom/<name>.rtm before oconv
+        geom_name_clean = bpy.path.clean_name(geom_name)
+        obj_rep_name = os.path.join(self.folder,"geom",geom_name_clean + '.obj')
+        ofn = open(obj_rep_name,"w+")
+        self.write_chunked(ofn,self.make_obj_mesh(obj_data))
+        ofn.close()
+        self.mesh_compiles.append("obj2mesh geom/%s.obj geom/%s.rtm" % (geom_name_clean,geom_name_clean))
+        mesh_str = "%s mesh %s\n1 geom/%s.rtm\n0\n0\n" % (mat_name,geom_name_clean,geom_name_clean)
+        return mesh_str
 
     def make_text(self,obj_data,geom_name,mat_name):
         # https://docs.blender.org/api/2.79/
@@ -930,7 +1379,22 @@ groundglow source ground
         return text_str
 
     
-    def make_geometry(self, obj_data, geom_name, mat, mat_name):
+    def geometry_kind(self, obj_data, mat):
+        # how make_geometry writes a datablock, decided in one place for the
+        # serial and the pool path: 'sphere', 'cylinder', 'cone', 'grid' and
+        # 'text' by keyword in the datablock name, then 'primitive' (mesh mode),
+        # 'textured' (a colorpict per face) or plain 'polygons'
+        raw_name = obj_data.name.lower()
+        for keyword in ('sphere','cylinder','cone','grid','text'):
+            if keyword in raw_name:
+                return keyword
+        if self.mat_has_image(mat):
+            return 'textured'
+        if self.geometry_mode == 'MESH':
+            return 'primitive'
+        return 'polygons'
+
+    def make_geometry(self, obj_data, geom_name, mat, mat_name, kind=None):
         """
         1) for sphere and icosphere, cylinder, cone, including endcap permutations and depth/radius permutations
         goal: export as radiance analytical surfaces if possible
@@ -946,17 +1410,20 @@ groundglow source ground
                 (obj name can contain those keywords)
                 this renaming will cause it to export as general mesh
         for general mesh: export as polgyons
+        returns an iterable of primitive strings, so meshes can be
+        streamed to disk polygon by polygon (see write_chunked)
         """
         geom_str = ""
-        raw_name = obj_data.name.lower()
-        if 'sphere' in raw_name:
+        if kind is None:
+            kind = self.geometry_kind(obj_data, mat)
+        if kind == 'sphere':
             vertices = obj_data.vertices
             faces = obj_data.polygons
             # icosphere first vertex z is radius
             # sphere first vertex 0,y,z is at radius, but need distance via root
             radius = math.sqrt(vertices[0].co[1]*vertices[0].co[1] + vertices[0].co[2]*vertices[0].co[2])
             geom_str = self.make_sphere(geom_name,radius,mat_name)
-        elif 'cylinder' in raw_name:
+        elif kind == 'cylinder':
             vertices = obj_data.vertices
             faces = obj_data.polygons
             lastface = len(faces) -1
@@ -980,7 +1447,7 @@ groundglow source ground
                 direction = [0.0,0.0,1.0]
                 geom_str = geom_str + self.make_ring(geom_name+"_cap2",center,direction,radius,0.0,mat_name)
                 
-        elif 'cone' in raw_name:
+        elif kind == 'cone':
             vertices = obj_data.vertices
             faces = obj_data.polygons
             lastface = len(faces) -1
@@ -1016,13 +1483,54 @@ groundglow source ground
                     direction = [0.0,0.0,1.0]
                     geom_str = geom_str + self.make_ring(geom_name+"_cap2",center,direction,radius2,0.0,mat_name)
             
-        elif 'grid' in raw_name:
-            geom_str = self.make_grid(obj_data,geom_name,mat,mat_name)
-        elif 'text' in raw_name:
+        elif kind == 'grid':
+            return self.make_grid(obj_data,geom_name,mat,mat_name)
+        elif kind == 'text':
             geom_str = self.make_text(obj_data,geom_name,mat_name)
+        elif kind == 'primitive':
+            # image textures need a colorpict per face, so those meshes stay polygons
+            geom_str = self.make_mesh_primitive(obj_data,geom_name,mat_name)
         else:
-            geom_str = self.make_mesh(obj_data,geom_name,mat,mat_name)
-        return geom_str
+            return self.make_mesh(obj_data,geom_name,mat,mat_name)
+        return [geom_str]
+
+    def write_chunked(self, f, pieces):
+        # gather generated primitives into chunks of about write_buffer_kb
+        # so memory stays bounded no matter how big the mesh is
+        # returns (number of pieces, characters written)
+        return write_pieces(f,pieces,self.write_buffer_kb * 1024)
+
+    def polygon_job(self, obj_data, geom_name, mat, mat_name, path, kind, arrays=None):
+        # snapshot of a mesh make_geometry would write as plain polygons
+        # (kind from geometry_kind), or None; arrays are its mesh_arrays,
+        # when they are already extracted
+        if not isinstance(obj_data, bpy.types.Mesh) or kind != 'polygons':
+            return None
+        if arrays is None:
+            arrays = self.mesh_arrays(obj_data)
+        (co,loop_vi,loop_start,loop_total,uvs) = arrays
+        return (path, mat_name, geom_name, co[loop_vi], loop_start, loop_total, self.write_buffer_kb * 1024)
+
+    def format_batch(self, jobs):
+        # format polygon jobs in a pool of forked workers; each job owns its
+        # file, so the output is the same whatever order they finish in
+        global _format_jobs
+        processes = self.workers or os.cpu_count() or 1
+        processes = min(processes, len(jobs))
+        ctx = fork_context()
+        if processes < 2 or ctx is None:
+            return [format_polygons(job) for job in jobs]
+        _format_jobs = jobs
+        # biggest meshes first, so one large mesh does not start last
+        order = sorted(range(len(jobs)), key=lambda i: -len(jobs[i][3]))
+        pool = ctx.Pool(processes)
+        try:
+            results = dict(zip(order, pool.map(_format_job, order, chunksize=1)))
+        finally:
+            pool.close()
+            pool.join()
+            _format_jobs = []
+        return [results[i] for i in range(len(jobs))]
 
         
     def write_radiance(self):
@@ -1033,20 +1541,12 @@ groundglow source ground
         """
         fn = self.folder
 
-        scene = bpy.context.scene
-
         objs = []
         geoms = []
         texts = []
         materials = []
 
-        for obj in scene.objects:
-            if self.only_selected and not obj.select:
-                continue
-            if not self.is_visible(obj):
-                continue
-            if obj.type != 'MESH' and obj.type != 'FONT':
-                continue
+        for obj in self.scene_table["geometry"]:
             geom_name = obj.data.name
             if obj.active_material is None:
                 mat_name = "void"
@@ -1060,64 +1560,257 @@ groundglow source ground
         #remove duplicates from materials
         materials = list(dict.fromkeys(materials).keys())
         mat_rep_name = os.path.join(fn,'materials.mat')
-        mfn = open(mat_rep_name,"w+")
-        for mat_name in materials:
-            mat = bpy.data.materials[mat_name]
-            mat_str = self.make_material(mat,mat_name)
+        mat_str = ''.join([self.make_material(bpy.data.materials[mat_name],mat_name) for mat_name in materials])
+        mat_hash = hashlib.sha1(mat_str.encode('utf-8')).hexdigest()
+        self.manifest["materials"] = mat_hash
+        if self.is_unchanged(mat_rep_name,self.old_manifest["materials"],mat_hash):
+            print("skipped: %s (unchanged)" % mat_rep_name)
+        else:
+            mfn = open(mat_rep_name,"w+")
             mfn.write(mat_str)
-        mfn.close()
+            mfn.close()
         
         # GEOMS
         #remove duplicates from geoms (obj_data)
         geoms = list(dict.fromkeys(geoms).keys())
-        os.mkdir(os.path.join(fn,"geom"))
+        os.makedirs(os.path.join(fn,"geom"), exist_ok=True)
+        t0 = time.time()
+        nprims = 0
+        nchars = 0
+        nskipped = 0
+        jobs = []
         for (geom_name,obj_type,mat_name) in geoms:
             mat = bpy.data.materials[mat_name]
             if obj_type == 'MESH':
                 obj_data = bpy.data.meshes[geom_name]
             elif obj_type == 'FONT':
                 obj_data = bpy.data.curves[geom_name]
-            geom_str = self.make_geometry(obj_data,geom_name,mat,mat_name)
             geom_name_clean = bpy.path.clean_name(geom_name)
             geom_rep_name = os.path.join(fn,"geom",geom_name_clean + '.rad')
+            # the mesh arrays are pulled once, for the hash and the pool job,
+            # and the hash is only worked out for an incremental export
+            kind = self.geometry_kind(obj_data,mat)
+            arrays = None
+            if obj_type == 'MESH' and (self.incremental or self.workers != 1 and kind == 'polygons'):
+                arrays = self.mesh_arrays(obj_data)
+            geom_hash = None
+            if self.incremental:
+                geom_hash = self.geom_hash(obj_type,obj_data,mat,mat_name,arrays)
+            old_entry = self.old_manifest["geoms"].get(geom_name_clean,{})
+            if self.is_unchanged(geom_rep_name,old_entry.get("hash"),geom_hash):
+                # keep the file, but still compile its mesh and convert its images
+                self.manifest["geoms"][geom_name_clean] = old_entry
+                if old_entry.get("compile"):
+                    self.mesh_compiles.append(old_entry["compile"])
+                for (key,(path_abs,path_ext,image_name)) in old_entry.get("images",{}).items():
+                    if self.images_to_convert is None:
+                        self.images_to_convert = {}
+                    self.images_to_convert[key] = (path_abs,path_ext,bpy.data.images[image_name])
+                nskipped = nskipped + 1
+                print("skipped: %s (unchanged)" % geom_rep_name)
+                continue
+            job = None
+            if self.workers != 1:
+                job = self.polygon_job(obj_data,geom_name,mat,mat_name,geom_rep_name,kind,arrays)
+            if job:
+                jobs.append(job)
+                self.manifest["geoms"][geom_name_clean] = {"hash": geom_hash, "compile": None, "images": {}}
+                continue
+            ncompiles = len(self.mesh_compiles)
+            images_before = set((self.images_to_convert or {}).keys())
             gfn =  open(geom_rep_name,"w+")
-            gfn.write(geom_str)
+            (n,size) = self.write_chunked(gfn,self.make_geometry(obj_data,geom_name,mat,mat_name,kind))
             gfn.close()
+            images = {}
+            for (key,(path_abs,path_ext,image)) in (self.images_to_convert or {}).items():
+                if key not in images_before:
+                    images[key] = (path_abs,path_ext,image.name)
+            compile_str = None
+            if len(self.mesh_compiles) > ncompiles:
+                compile_str = self.mesh_compiles[-1]
+            self.manifest["geoms"][geom_name_clean] = {"hash": geom_hash, "compile": compile_str, "images": images}
+            nprims = nprims + n
+            nchars = nchars + size
+        for (n,size) in self.format_batch(jobs):
+            nprims = nprims + n
+            nchars = nchars + size
+        dt = max(time.time() - t0, 1e-6)
+        print("geom: %d files, %d skipped, %d primitives, %.1f MB in %.2fs (%.1f MB/s, %.0f primitives/s)" %
+              (len(geoms) - nskipped, nskipped, nprims, nchars/1e6, dt, nchars/1e6/dt, nprims/dt))
 
         # OBJECTS
-        scene_rep_name = os.path.join(fn,'scene.rad')
-        sfn = open(scene_rep_name,"w+")
+        # with use_instances, datablocks shared by several objects are
+        # frozen into geom/<name>.oct once (see write_runs) and placed
+        # with instance primitives, so the scene octree only holds
+        # their bounding cubes rather than every copy of every polygon
+        users = {}
         for obj, geom_name, mat_name in objs:
-            mat = bpy.data.materials[mat_name]
+            users[geom_name] = users.get(geom_name,0) + 1
+        instanced = set()
+        if self.use_instances:
+            instanced = set([geom_name for geom_name in users if users[geom_name] > 1])
+        for geom_name in sorted(instanced):
             geom_name_clean = "geom/" + bpy.path.clean_name(geom_name)
-            pre_name = obj.name + '_'
-            mtx = obj.matrix_world.copy()
-            loc, rot, sca = mtx.decompose()
-            (rx,ry,rz) = rot.to_euler()
-            (x,y,z) = loc
-            
-            #print(rx, ry, rz)
-            rx = degrees(rx)
-            ry = degrees(ry)
-            rz = degrees(rz)
-            (sx,sy,sz) = sca
-            sx1 = math.isclose(sx, 1.0, rel_tol=1e-5)
-            sy1 = math.isclose(sy, 1.0, rel_tol=1e-5)
-            sz1 = math.isclose(sz, 1.0, rel_tol=1e-5)
-            xform = '!xform -n %s ' % (pre_name)
-            have_scale = not sx1 or not sy1 or not sz1
-            if have_scale:
-                have_isotropic = math.isclose(sx,sy, rel_tol=1e-5) and math.isclose(sx,sz, rel_tol=1e-5)
-                if not have_isotropic:
-                    # an-isotropic scales don't make sense/hard to do for analytical surfaces ie sphere
-                    print('ouch - an-isotropic scale not handled by xform, using SX\n')
-                xform = xform + '-s %s ' % (sx)
-            xform = xform + '-rx %s -ry %s -rz %s -t %s %s %s %s.rad\n' % (rx, ry, rz, x, y, z, geom_name_clean)
-            sfn.write(xform)
+            self.octree_compiles.append("oconv -f materials.mat %s.rad > %s.oct" % (geom_name_clean,geom_name_clean))
+        self.scene_objs = objs
+        self.instanced = instanced
+        scene_rep_name = os.path.join(fn,'scene.rad')
+        sfn = open(scene_rep_name,"w+")
+        sfn.write(self.make_scene())
         sfn.close()
+        if self.use_instances:
+            ninstances = len([geom_name for obj, geom_name, mat_name in objs if geom_name in instanced])
+            print("scene: %d objects, %d instances of %d instanced datablocks" % (len(objs),ninstances,len(instanced)))
 
         return
 
+    def make_scene(self):
+        # scene.rad: one !xform or instance per object, at the current frame
+        scene_str = ''
+        for obj, geom_name, mat_name in self.scene_objs:
+            geom_name_clean = "geom/" + bpy.path.clean_name(geom_name)
+            pre_name = obj.name + '_'
+            xform_args = self.xform_args(obj)
+            if geom_name in self.instanced:
+                nargs = len(xform_args.split()) + 1
+                scene_str = scene_str + 'void instance %s\n%d %s.oct %s\n0\n0\n\n' % (pre_name,nargs,geom_name_clean,xform_args)
+            else:
+                scene_str = scene_str + '!xform -n %s %s %s.rad\n' % (pre_name,xform_args,geom_name_clean)
+        return scene_str
+
+    def xform_args(self,obj):
+        # xform style transform arguments for an object's world matrix
+        mtx = obj.matrix_world.copy()
+        loc, rot, sca = mtx.decompose()
+        (rx,ry,rz) = rot.to_euler()
+        (x,y,z) = loc
+        
+        #print(rx, ry, rz)
+        rx = degrees(rx)
+        ry = degrees(ry)
+        rz = degrees(rz)
+        (sx,sy,sz) = sca
+        sx1 = math.isclose(sx, 1.0, rel_tol=1e-5)
+        sy1 = math.isclose(sy, 1.0, rel_tol=1e-5)
+        sz1 = math.isclose(sz, 1.0, rel_tol=1e-5)
+        xform = ''
+        have_scale = not sx1 or not sy1 or not sz1
+        if have_scale:
+            have_isotropic = math.isclose(sx,sy, rel_tol=1e-5) and math.isclose(sx,sz, rel_tol=1e-5)
+            if not have_isotropic:
+                # an-isotropic scales don't make sense/hard to do for analytical surfaces ie sphere
+                print('ouch - an-isotropic scale not handled by xform, using SX\n')
+            xform = xform + '-s %s ' % (sx)
+        xform = xform + '-rx %s -ry %s -rz %s -t %s %s %s' % (rx, ry, rz, x, y, z)
+        return xform
+
+    def write_sequence(self):
+        # frame sequence on top of the export at frame_start:
+        # geometry is static and already in geom/, so for every frame we
+        # only compare scene.rad, lights and views with the previous frame
+        # and write the ones that changed as frames/<name>_<frame>.
+        # run_frames then rebuilds the octree only when the scene or
+        # lights changed, and renders every frame. Every frame's view of
+        # the render camera also goes to frames/<camera>.vfs; when only
+        # the camera moves, run_frames is a single rpict -S reading it
+        # (mesh deformation and animated materials are not followed)
+        fn = self.folder
+        os.makedirs(os.path.join(fn,"frames"), exist_ok=True)
+        scene = bpy.context.scene
+
+        static_list = ["materials.mat"]
+        if self.add_sky:
+            static_list.append("sky.mat")
+            static_list.append("sky.rad")
+        scene_file = "scene.rad"
+        scene_str = self.make_scene()
+        rpict = ("rpict %s" % tuned_options(scene)).strip()
+        lamp_files = {}
+        (lum_str,lamps) = self.make_lighting()
+        lum_file = "lights.lum"
+        view_files = {}
+        views = {}
+        for obj, obj_data in self.cameras:
+            cname = bpy.path.clean_name(obj.name)
+            view_files[cname] = cname + '.vf'
+            views[cname] = self.make_view(obj, obj_data)
+
+        def write_frame_file(name, content):
+            wfn = open(os.path.join(fn,name),"w+")
+            wfn.write(content)
+            wfn.close()
+
+        steps = []
+        path = []
+        nfiles = 0
+        noctrees = 0
+        octree = None
+        for frame in range(self.frame_start, self.frame_end + 1):
+            scene.frame_set(frame)
+            tag = "%04d" % frame
+            rebuild = octree is None
+            new_scene_str = self.make_scene()
+            if new_scene_str != scene_str:
+                scene_str = new_scene_str
+                scene_file = "frames/scene_%s.rad" % tag
+                write_frame_file(scene_file, scene_str)
+                nfiles = nfiles + 1
+                rebuild = True
+            (new_lum_str,new_lamps) = self.make_lighting(lamp_files)
+            changed = [ies for ies in new_lamps if new_lamps[ies] != lamps.get(ies)]
+            for ies in changed:
+                lamp_files[ies] = "frames/%s_%s.rad" % (ies,tag)
+                write_frame_file(lamp_files[ies], new_lamps[ies])
+                nfiles = nfiles + 1
+            lamps = new_lamps
+            if changed:
+                (new_lum_str,new_lamps) = self.make_lighting(lamp_files)
+            if new_lum_str != lum_str:
+                lum_str = new_lum_str
+                lum_file = "frames/lights_%s.lum" % tag
+                write_frame_file(lum_file, lum_str)
+                nfiles = nfiles + 1
+                rebuild = True
+            for obj, obj_data in self.cameras:
+                cname = bpy.path.clean_name(obj.name)
+                view_str = self.make_view(obj, obj_data)
+                if view_str != views[cname]:
+                    views[cname] = view_str
+                    view_files[cname] = "frames/%s_%s.vf" % (cname,tag)
+                    write_frame_file(view_files[cname], view_str)
+                    nfiles = nfiles + 1
+                if cname == self.camname:
+                    path.append(view_str)
+            step = []
+            if rebuild:
+                octree = "frames/scene_%s.oct" % tag
+                rad_str = ' '.join(static_list[0:1] + [lum_file, scene_file] + static_list[1:])
+                step.append("oconv %s > %s" % (rad_str,octree))
+                noctrees = noctrees + 1
+            if self.camname is not None:
+                step.append("%s -vf %s %s > frames/%s_%s.hdr" % (rpict,view_files[self.camname],octree,self.camname,tag))
+            steps.append(step)
+
+        if self.camname is not None:
+            path_file = "frames/%s.vfs" % self.camname
+            write_frame_file(path_file, ''.join(path))
+            if noctrees == 1:
+                # static scene: one rpict for the whole camera path
+                steps = [steps[0][:1] + ["%s -S %d -o frames/%s_%%04d.hdr %s < %s" %
+                                         (rpict,self.frame_start,self.camname,octree,path_file)]]
+
+        for suffix in ['.sh','.bat']:
+            rfn = open(os.path.join(fn,"run_frames"+suffix),"w+")
+            for compile_str in self.mesh_compiles + self.octree_compiles:
+                rfn.write(compile_str + "\n")
+            for step in steps:
+                for cmd in step:
+                    if suffix == '.bat': cmd = cmd.replace('%', '%%')
+                    rfn.write(cmd + "\n")
+            if suffix == '.bat': rfn.write("pause\n")
+            rfn.close()
+        print("sequence: %d frames, %d changed files, %d octrees" % (self.frame_end - self.frame_start + 1,nfiles,noctrees))
+
     def write_picture_cal(self):
         # my windows system rvu can't find picture.cal
         # so we'll write it out.
@@ -1188,7 +1881,7 @@ fadegrey(r,g,b) = fade(grey(r,g,b), A2, T*.1);
         
         if self.images_to_convert:
             fn = self.folder
-            os.makedirs(os.path.join(fn,'images'))
+            os.makedirs(os.path.join(fn,'images'), exist_ok=True)
             scene = bpy.context.scene
             image_settings = scene.render.image_settings
             save_rff = image_settings.file_format
@@ -1197,7 +1890,13 @@ fadegrey(r,g,b) = fade(grey(r,g,b), A2, T*.1);
             image_settings.color_mode = 'RGB'
             for key in self.images_to_convert.keys():
                 (path_abs,path_ext,image) = self.images_to_convert[key]
-                image.save_render(os.path.join(fn,'images/'+key+'.hdr'))
+                image_rep_name = os.path.join(fn,'images/'+key+'.hdr')
+                image_hash = self.image_hash(path_abs,image)
+                self.manifest["images"][key] = image_hash
+                if self.is_unchanged(image_rep_name,self.old_manifest["images"].get(key),image_hash):
+                    print("skipped: %s (unchanged)" % image_rep_name)
+                    continue
+                image.save_render(image_rep_name)
             # as a courtesy we restore settings we changed
             image_settings.file_format = save_rff
             image_settings.color_mode = save_rcm
@@ -1237,6 +1936,7 @@ view= nice -vf Camera.vf
         # run2 - rvu
         # run3 - pview
         # run4 - ra_bmp
+        # run3_tiles, run3_rpiece - run3 on every core
         fn = self.folder
 ##        suffix = '.sh'
 ##        import platform
@@ -1249,8 +1949,25 @@ view= nice -vf Camera.vf
             rad_list.append("sky.mat")
             rad_list.append("sky.rad")
         rad_str = ' '.join(rad_list)
+        scene = bpy.context.scene
+        opts = tuned_options(scene)
+        xres = scene.render.resolution_x * scene.render.resolution_percentage // 100
+        yres = scene.render.resolution_y * scene.render.resolution_percentage // 100
+        # the run scripts run outside Blender, so they use every core unless told otherwise
+        cores = self.workers if self.workers > 1 else multiprocessing.cpu_count()
+        tile_args = "-x %d -y %d" % (xres,yres)
+        if self.workers > 1:
+            tile_args += " -n %d" % self.workers
+        if opts:
+            tile_args += " -- %s" % opts
+        rfn = open(os.path.join(fn,"run3_tiles.py"),"w+")
+        rfn.write(TILES_DRIVER)
+        rfn.close()
         for suffix in plats:
             rfn = open(os.path.join(fn,"run1"+suffix),"w+")
+            # meshes first, instanced octrees may contain them
+            for compile_str in self.mesh_compiles + self.octree_compiles:
+                rfn.write(compile_str + "\n")
             rfn.write("oconv {} > scene.oct\n".format(rad_str))
             if suffix == '.bat': rfn.write("pause\n")
             rfn.close()
@@ -1266,10 +1983,34 @@ view= nice -vf Camera.vf
 
 
             rfn = open(os.path.join(fn,"run3"+suffix),"w+")
-            rfn.write("rpict -vf %s.vf scene.oct > scene.hdr\n" % cam_name) 
+            rfn.write("rpict %s-vf %s.vf scene.oct > scene.hdr\n" % (opts + " " if opts else "",cam_name))
             if suffix == '.bat': rfn.write("pause\n")
             rfn.close()
 
+            # run3 on every core: tiles rendered in parallel and put together by pcompos
+            rfn = open(os.path.join(fn,"run3_tiles"+suffix),"w+")
+            # the driver needs Python 3: python3 on unix, python on Windows
+            python = "python3" if suffix == '.sh' else "python"
+            rfn.write("%s run3_tiles.py %s.vf scene.oct scene.hdr %s\n" % (python,cam_name,tile_args))
+            if suffix == '.bat': rfn.write("pause\n")
+            rfn.close()
+
+            if suffix == '.sh':
+                # the same with rpiece, which shares the tiles out through a
+                # locked sync file (not on Windows); the first rpiece creates
+                # the picture, so the others start once it is there
+                ny = max(1,int(round(math.sqrt(2 * cores * yres / float(xres)))))
+                nx = max(1,int(math.ceil(2.0 * cores / ny)))
+                rfn = open(os.path.join(fn,"run3_rpiece.sh"),"w+")
+                rfn.write("rm -f scene_rpiece.hdr scene.sync\n")
+                rfn.write("echo %d %d > scene.sync\n" % (nx,ny))
+                rpiece = "rpiece %s-F scene.sync -x %d -y %d -vf %s.vf -o scene_rpiece.hdr scene.oct" % (opts + " " if opts else "",xres,yres,cam_name)
+                rfn.write("%s &\nsleep 2\n" % rpiece)
+                for i in range(cores - 1):
+                    rfn.write("%s &\n" % rpiece)
+                rfn.write("wait\n")
+                rfn.close()
+
             rfn = open(os.path.join(fn,"run4"+suffix),"w+")
             rfn.write("ra_bmp -e auto scene.hdr > scene.bmp\n")
             if suffix == '.bat': rfn.write("pause\n")
@@ -33,26 +33,15 @@ bl_info = {
 
 
 import bpy
-from mathutils import Vector
+import numpy as np
 from os.path import splitext
-from math import degrees
-
-def write_cameras(context, filepath, frame_start, frame_end, only_selected=False):
-
-    data_attrs = (
-        'lens',
-        'shift_x',
-        'shift_y',
-        'dof_distance',
-        'clip_start',
-        'clip_end',
-        'draw_size',
-        )
-
-    obj_attrs = (
-        'hide_render',
-        )
-    
+
+# per frame camera data sampled for view_arrays, in this column order
+CAMERA_DATA = ('angle_x', 'angle_y', 'shift_x', 'shift_y', 'clip_start', 'clip_end', 'ortho_scale')
+VIEW_TYPES = {'PERSP': 'v', 'ORTHO': 'l', 'PANO': 'c'}
+
+def write_cameras(context, filepath, frame_start, frame_end, only_selected=False, camera_path=False):
+
     fn = splitext(filepath)[0]
 
     scene = bpy.context.scene
@@ -68,41 +57,109 @@ def write_cameras(context, filepath, frame_start, frame_end, only_selected=False
         cameras.append((obj, obj.data))
 
     frame_range = range(frame_start, frame_end + 1)
-
-
-    for obj, obj_data in cameras:
-        camfn = '%s_%s.vf' % (fn,obj.name)
-        cam = obj
-        vp = obj.location
-        vu = cam.matrix_world.to_quaternion() * Vector((0.0, 1.0, 0.0))
-        vd = cam.matrix_world.to_quaternion() * Vector((0.0, 0.0, -1.0))
-        vpx, vpy, vpz = vp
-        vux, vuy, vuz = vu
-        vdx, vdy, vdz = vd
-        lens = repr(getattr(obj_data, 'lens'))
-        vh = degrees(float(repr(getattr(obj_data, 'angle_x'))))
-        vv = degrees(float(repr(getattr(obj_data, 'angle_y'))))
-        vs = float(repr(getattr(obj_data, 'shift_x')))
-        vl = float(repr(getattr(obj_data, 'shift_y')))
-        vo = float(repr(getattr(obj_data, 'clip_start')))
-        va = float(repr(getattr(obj_data, 'clip_end')))
-        if va>=1000000.0:
-        	va = 0
-        	vo = 0
-        vtype = repr(getattr(obj_data, 'type')) # [‘PERSP’, ‘ORTHO’, ‘PANO’]
-        vt = 'v'
-        if vtype == 'ORTHO':
-        	vt = 'l'
-        if vtype == 'PANO':
-        	vt = 'c'
-        if vh>160.0 or vv>160.0:
-        	vt = 'a'
-        	vh = 180.0
-        	vv = 180.0
-        print(camfn, lens, vtype, vt, vp, vpx, vpy, vpz, vd, vdx, vdy, vdz, vu, vux, vuy, vuz, vh, vv, vo, va, vs, vl)
-        fw = open(camfn, 'w').write
-        fw('rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s -vh %s -vv %s -vo %s -va %s -vs %s -vl %s \n' % (vt, vpx, vpy, vpz, vdx, vdy, vdz, vux, vuy, vuz, vh, vv, vo, va, vs, vl))
-        
+    matrices, data, types = sample_cameras(scene, cameras, frame_range)
+
+    if camera_path:
+        # one view per frame and camera, in one <name>_<camera>.vfs for
+        # rpict -S, which reads a view per frame from its standard input
+        for i, (obj, obj_data) in enumerate(cameras):
+            camfn = '%s_%s.vfs' % (fn,obj.name)
+            f = open(camfn, 'w')
+            f.writelines(format_views(matrices[:, i], data[:, i], types[:, i]))
+            f.close()
+            print("camera path written: %s, %d views" % (camfn, len(frame_range)))
+            print("render with: rpict -S %d -o %s_%%04d.hdr [options] scene.oct < %s" %
+                  (frame_start, obj.name, camfn))
+        return
+
+    # the first frame goes to <name>_<camera>.vf, later frames only when
+    # the view changed, as <name>_<camera>_<frame>.vf
+    for i, (obj, obj_data) in enumerate(cameras):
+        last = None
+        for frame, view_str in zip(frame_range, format_views(matrices[:, i], data[:, i], types[:, i])):
+            if view_str == last:
+                continue
+            camfn = '%s_%s.vf' % (fn,obj.name)
+            if last is not None:
+                camfn = '%s_%s_%04d.vf' % (fn,obj.name,frame)
+            last = view_str
+            f = open(camfn, 'w')
+            f.write(view_str)
+            f.close()
+            print("view written:", camfn)
+
+
+def sample_cameras(scene, cameras, frame_range):
+    """
+    Evaluate every camera over the frame range in one pass through the
+    frames: (frames, cameras, 4, 4) world matrices, (frames, cameras, 7)
+    CAMERA_DATA values and (frames, cameras) Blender camera types.
+    The current frame is restored afterwards.
+    """
+    nframes = len(frame_range)
+    matrices = np.empty((nframes, len(cameras), 4, 4))
+    data = np.empty((nframes, len(cameras), len(CAMERA_DATA)))
+    types = np.empty((nframes, len(cameras)), dtype=object)
+    frame_current = scene.frame_current
+    for j, frame in enumerate(frame_range):
+        if frame != scene.frame_current:
+            scene.frame_set(frame)
+        for i, (obj, obj_data) in enumerate(cameras):
+            matrices[j, i] = obj.matrix_world
+            data[j, i] = [getattr(obj_data, attr) for attr in CAMERA_DATA]
+            types[j, i] = obj_data.type
+    if scene.frame_current != frame_current:
+        scene.frame_set(frame_current)
+    return matrices, data, types
+
+
+def view_arrays(matrices, data, types):
+    """
+    Radiance view parameters of n camera samples at once, from (n, 4, 4)
+    world matrices: the position, the -Z axis as view direction and the
+    Y axis as up, scale removed. Returns (vt, vp, vd, vu, vh, vv, vo, va, vs, vl).
+    """
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    data = np.asarray(data, dtype=np.float64).reshape(-1, len(CAMERA_DATA))
+    types = np.asarray(types, dtype=object).ravel()
+    vp = matrices[:, 0:3, 3]
+    vd = -matrices[:, 0:3, 2]
+    vd /= np.sqrt((vd * vd).sum(axis=1))[:, None]
+    vu = matrices[:, 0:3, 1]
+    vu /= np.sqrt((vu * vu).sum(axis=1))[:, None]
+    angle_x, angle_y, vs, vl, vo, va, ortho_scale = data.T
+    vh = np.degrees(angle_x)
+    vv = np.degrees(angle_y)
+    vt = np.array([VIEW_TYPES.get(t, 'v') for t in types])
+    # parallel views are sized in world units, the scale spanning the sensor width
+    ortho = vt == 'l'
+    vh = np.where(ortho, ortho_scale, vh)
+    vv = np.where(ortho, ortho_scale * np.tan(angle_y / 2.0) / np.tan(angle_x / 2.0), vv)
+    # wide views as a hemispherical fisheye
+    fisheye = ~ortho & ((vh > 160.0) | (vv > 160.0))
+    vt[fisheye] = 'a'
+    vh = np.where(fisheye, 180.0, vh)
+    vv = np.where(fisheye, 180.0, vv)
+    # no clipping for a far clip at "infinity"
+    infinite = va >= 1000000.0
+    vo = np.where(infinite, 0.0, vo)
+    va = np.where(infinite, 0.0, va)
+    return vt, vp, vd, vu, vh, vv, vo, va, vs, vl
+
+
+def format_views(matrices, data, types):
+    # one rvu view line per camera sample, as a .vf holds it
+    vt, vp, vd, vu, vh, vv, vo, va, vs, vl = view_arrays(matrices, data, types)
+    rows = np.column_stack((vp, vd, vu, vh, vv, vo, va, vs, vl)).tolist()
+    fmt = 'rvu -vt%s -vp %s %s %s -vd %s %s %s -vu %s %s %s -vh %s -vv %s -vo %s -va %s -vs %s -vl %s \n'
+    return [fmt % tuple([t] + row) for t, row in zip(vt.tolist(), rows)]
+
+
+def make_view(obj, obj_data):
+    # the view of one camera at the current frame
+    data = [getattr(obj_data, attr) for attr in CAMERA_DATA]
+    return format_views(np.array(obj.matrix_world), data, [obj_data.type])[0]
+    
 from bpy.props import StringProperty, IntProperty, BoolProperty
 from bpy_extras.io_utils import ExportHelper
 
@@ -125,10 +182,15 @@ class CameraExporter(bpy.types.Operator, ExportHelper):
             default=1, min=1, max=300000)
     only_selected = BoolProperty(name="Only Selected",
             default=True)
+    camera_path = BoolProperty(name="Camera Path",
+            description="Write every frame's view into one .vfs per camera, for rpict -S, "
+                        "instead of a .vf per changed view",
+            default=False)
             
 
     def execute(self, context):
-        write_cameras(context, self.filepath, self.frame_start, self.frame_start, self.only_selected)
+        write_cameras(context, self.filepath, self.frame_start, self.frame_end, self.only_selected,
+                      self.camera_path)
         return {'FINISHED'}
 
     def invoke(self, context, event):
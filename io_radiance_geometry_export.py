@@ -34,13 +34,233 @@ bl_info = {
 
 import bpy
 import os
+import time
+import subprocess
+import multiprocessing
 import bmesh
+import numpy as np
 from mathutils import Vector
 from os.path import splitext
 from math import degrees
 
 
-def write_radiance(context, filepath, frame_start, frame_end, only_selected=False):
+try:
+    from .radiance_polygons import DEFAULT_MATERIAL, polygon_records
+except (ImportError, SystemError):
+    # installed as a single file add-on, next to radiance_polygons.py
+    from radiance_polygons import DEFAULT_MATERIAL, polygon_records
+
+
+def name_compat(name):
+    # same substitution the OBJ exporter applies to usemtl and group names
+    if name is None:
+        return 'None'
+    else:
+        return name.replace(' ', '_')
+
+
+def mesh_arrays(me):
+    # bulk copy of vertex coordinates and face topology, one RNA call per attribute
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    loop_vi = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loop_vi)
+    loop_start = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_total", loop_total)
+    material_index = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("material_index", material_index)
+    return co.reshape(-1, 3), loop_vi, loop_start, loop_total, material_index
+
+
+def mesh_snapshot(scene, obj, filepath):
+    # evaluate modifiers and bring the mesh to world coordinates, as the OBJ exporter does;
+    # the returned job holds plain arrays only, so it can be formatted without Blender
+    me = obj.to_mesh(scene, True, 'PREVIEW')
+    me.transform(obj.matrix_world)
+    co, loop_vi, loop_start, loop_total, material_index = mesh_arrays(me)
+    modifiers = [name_compat(mat.name) if mat else DEFAULT_MATERIAL for mat in me.materials]
+    bpy.data.meshes.remove(me)
+    return (filepath, obj.name, name_compat(obj.name), co, loop_vi, loop_start, loop_total, modifiers,
+            material_index)
+
+
+def format_mesh_radiance(job):
+    filepath, title, name, co, loop_vi, loop_start, loop_total, modifiers, material_index = job
+    f = open(filepath, 'w')
+    f.write("# written by %s from %s\n" % (__name__, title))
+    npolys = 0
+    for record in polygon_records(name, co, loop_vi, loop_start, loop_total, modifiers, material_index):
+        # non-planar faces come as several triangles
+        npolys += record.count(" polygon ")
+        f.write(record)
+    f.close()
+    return npolys
+
+
+def write_mesh_radiance(scene, obj, filepath):
+    return format_mesh_radiance(mesh_snapshot(scene, obj, filepath))
+
+
+# snapshots handed to forked workers; children inherit them copy-on-write
+# instead of receiving a pickled copy of every array
+_format_jobs = []
+
+
+def _format_job(i):
+    return format_mesh_radiance(_format_jobs[i])
+
+
+def fork_context():
+    # None where fork is unavailable (Windows), callers then format serially
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+
+def format_batch(jobs, processes=None):
+    """
+    Format mesh snapshots into their .rad files, several processes at a time.
+
+    Each job writes its own file, so the output does not depend on the
+    order the workers finish in. Returns the polygon count of each job.
+    """
+    global _format_jobs
+    if processes is None or processes < 1:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(jobs))
+    ctx = fork_context()
+    if processes < 2 or ctx is None:
+        return [format_mesh_radiance(job) for job in jobs]
+    _format_jobs = jobs
+    # biggest meshes first, so one large mesh does not start last
+    order = sorted(range(len(jobs)), key=lambda i: -len(jobs[i][4]))
+    pool = ctx.Pool(processes)
+    try:
+        counts = dict(zip(order, pool.map(_format_job, order, chunksize=1)))
+    finally:
+        pool.close()
+        pool.join()
+        _format_jobs = []
+    return [counts[i] for i in range(len(jobs))]
+
+
+def unique_rows(a):
+    # unique rows of a 2d array and the inverse index, without np.unique(axis=0)
+    a = np.ascontiguousarray(a)
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1]))).ravel()
+    _, index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return a[index], inverse
+
+
+def format_rows(fmt, rows, chunk=65536):
+    # format an (n, k) array with one %-operation per block of rows
+    for i in range(0, len(rows), chunk):
+        block = rows[i:i + chunk]
+        yield (fmt * len(block)) % tuple(block.ravel().tolist())
+
+
+def obj_mesh_records(co, loop_vi, loop_start, loop_total, normals=None, smooth=None, uv=None,
+                     modifiers=None, material_index=None):
+    """
+    Generate a Wavefront OBJ built on shared tables, the input obj2mesh
+    compiles into a Radiance triangle mesh (.rtm):
+
+    v   one per mesh vertex
+    vt  one per distinct uv, if uv (per loop) is given
+    vn  one per mesh vertex, used by smooth faces only
+    f   v/vt/vn indices, with usemtl whenever the material changes
+    """
+    yield from format_rows("v %.9g %.9g %.9g\n", co)
+    if uv is not None:
+        uv_table, loop_vt = unique_rows(uv)
+        yield from format_rows("vt %.9g %.9g\n", uv_table)
+        loop_vt = (loop_vt + 1).tolist()
+    if normals is not None and smooth is not None and smooth.any():
+        yield from format_rows("vn %.6g %.6g %.6g\n", normals)
+        smooth = smooth.tolist()
+    else:
+        smooth = None
+    loop_v = (loop_vi + 1).tolist()
+    material = None
+    for i in range(len(loop_start)):
+        if modifiers is not None:
+            index = material_index[i]
+            mod = modifiers[index] if index < len(modifiers) else DEFAULT_MATERIAL
+            if mod != material:
+                material = mod
+                yield "usemtl %s\n" % material
+        start = loop_start[i]
+        total = loop_total[i]
+        v = loop_v[start:start + total]
+        if uv is not None and smooth is not None and smooth[i]:
+            tokens = ["%d/%d/%d" % (vi, vt, vi) for vi, vt in zip(v, loop_vt[start:start + total])]
+        elif uv is not None:
+            tokens = ["%d/%d" % (vi, vt) for vi, vt in zip(v, loop_vt[start:start + total])]
+        elif smooth is not None and smooth[i]:
+            tokens = ["%d//%d" % (vi, vi) for vi in v]
+        else:
+            tokens = ["%d" % vi for vi in v]
+        yield "f " + " ".join(tokens) + "\n"
+
+
+def write_mesh_obj(scene, obj, filepath):
+    # shared-table OBJ of the evaluated world space mesh, for obj2mesh
+    me = obj.to_mesh(scene, True, 'PREVIEW')
+    me.transform(obj.matrix_world)
+    co, loop_vi, loop_start, loop_total, material_index = mesh_arrays(me)
+    normals = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("normal", normals)
+    smooth = np.empty(len(me.polygons), dtype=np.bool_)
+    me.polygons.foreach_get("use_smooth", smooth)
+    uv = None
+    if me.uv_layers.active:
+        uv = np.empty(len(me.loops) * 2, dtype=np.float32)
+        me.uv_layers.active.data.foreach_get("uv", uv)
+        uv = uv.reshape(-1, 2)
+    modifiers = [name_compat(mat.name) if mat else DEFAULT_MATERIAL for mat in me.materials]
+    f = open(filepath, 'w')
+    f.write("# written by %s from %s\n" % (__name__, obj.name))
+    f.writelines(obj_mesh_records(co, loop_vi, loop_start, loop_total, normals.reshape(-1, 3), smooth, uv,
+                                  modifiers, material_index))
+    f.close()
+    npolys = len(loop_start)
+    bpy.data.meshes.remove(me)
+    return npolys
+
+
+def run_batch(jobs, processes=None):
+    # run (args, stdout file or None) jobs, several processes at a time
+    if processes is None:
+        processes = os.cpu_count() or 1
+    pending = list(jobs)
+    running = []
+    while pending or running:
+        while pending and len(running) < processes:
+            args, outfn = pending.pop(0)
+            out = open(outfn, 'w') if outfn else None
+            running.append((subprocess.Popen(args, stdout=out), out, args))
+        p, out, args = running.pop(0)
+        p.wait()
+        if out:
+            out.close()
+        print("done: %s" % " ".join(args))
+
+
+def obj2rad_batch(jobs, processes=None):
+    # convert (obj, rad) file pairs with obj2rad, several processes at a time
+    run_batch([(['obj2rad', objfn], radfn) for objfn, radfn in jobs], processes)
+
+
+def obj2mesh_batch(jobs, processes=None):
+    # compile (obj, rtm) file pairs with obj2mesh, several processes at a time
+    run_batch([(['obj2mesh', objfn, rtmfn], None) for objfn, rtmfn in jobs], processes)
+
+
+def write_radiance(context, filepath, frame_start, frame_end, only_selected=False, use_obj2rad=False,
+                   geometry_mode='POLYGON', workers=1):
 
     fn = splitext(filepath)[0]
 
@@ -55,29 +275,59 @@ def write_radiance(context, filepath, frame_start, frame_end, only_selected=Fals
             continue
 
         geometry.append((obj, obj.data))
-        obj.select = False
+        if use_obj2rad:
+            obj.select = False
 
     frame_range = range(frame_start, frame_end + 1)
 
-    for obj, obj_data in geometry:
+    t0 = time.time()
+    npolys = 0
+    jobs = []
+    snapshots = []
 
-        obj.select = True
+    for obj, obj_data in geometry:
 
         name = bpy.path.clean_name(obj.name)
         gfn = "%s_%s" % (fn, name)
 
-        bpy.ops.export_scene.obj(filepath=gfn + ".obj", use_selection=True, axis_forward='Y', axis_up='Z')
-
-        obj.select = False
-        print("written: %s.obj" % gfn)
-        
-        os.system("obj2rad %s.obj > %s.rad" % (gfn,gfn))
-        print("written: %s.rad" % gfn)
-
-    for obj, obj_data in geometry:
-        obj.select = True
-        
-from bpy.props import StringProperty, IntProperty, BoolProperty
+        if geometry_mode == 'MESH':
+            # a single mesh primitive referencing the compiled triangle mesh;
+            # void lets the usemtl materials inside the mesh apply
+            npolys += write_mesh_obj(scene, obj, gfn + ".obj")
+            print("written: %s.obj" % gfn)
+            jobs.append((gfn + ".obj", gfn + ".rtm"))
+            f = open(gfn + ".rad", 'w')
+            f.write("void mesh %s\n1 %s.rtm\n0\n0\n" % (name_compat(obj.name), os.path.basename(gfn)))
+            f.close()
+            print("written: %s.rad" % gfn)
+        elif use_obj2rad:
+            obj.select = True
+            # no normals or uvs, so that obj2rad writes plain polygons
+            bpy.ops.export_scene.obj(filepath=gfn + ".obj", use_selection=True, axis_forward='Y', axis_up='Z',
+                                     use_normals=False, use_uvs=False)
+            obj.select = False
+            print("written: %s.obj" % gfn)
+            jobs.append((gfn + ".obj", gfn + ".rad"))
+        else:
+            snapshots.append(mesh_snapshot(scene, obj, gfn + ".rad"))
+
+    if snapshots:
+        npolys += sum(format_batch(snapshots, workers))
+        for job in snapshots:
+            print("written: %s" % job[0])
+
+    if geometry_mode == 'MESH':
+        obj2mesh_batch(jobs)
+        print("geometry: %d meshes, %d faces in %.2fs" % (len(geometry), npolys, time.time() - t0))
+    elif use_obj2rad:
+        obj2rad_batch(jobs)
+        for obj, obj_data in geometry:
+            obj.select = True
+        print("geometry: %d objects via obj2rad in %.2fs" % (len(geometry), time.time() - t0))
+    else:
+        print("geometry: %d objects, %d polygons in %.2fs" % (len(geometry), npolys, time.time() - t0))
+
+from bpy.props import StringProperty, IntProperty, BoolProperty, EnumProperty
 from bpy_extras.io_utils import ExportHelper
 
 
@@ -99,10 +349,23 @@ class RadianceExporter(bpy.types.Operator, ExportHelper):
             default=1, min=1, max=300000)
     only_selected = BoolProperty(name="Only Selected",
             default=True)
+    use_obj2rad = BoolProperty(name="Use obj2rad",
+            description="Export OBJ files and convert them with obj2rad instead of writing polygons directly",
+            default=False)
+    geometry_mode = EnumProperty(name="Geometry",
+            description="Radiance primitives to write meshes as",
+            items=(('POLYGON', "Polygons", "One polygon primitive per face"),
+                   ('MESH', "Mesh", "One mesh primitive per object, compiled by obj2mesh from a shared-table OBJ")),
+            default='POLYGON')
+    workers = IntProperty(name="Workers",
+            description="Processes formatting polygon files in parallel (1 writes serially, 0 uses every core). "
+                        "Workers are forked from Blender, which is not safe with every add-on or platform",
+            default=1, min=0, max=256)
             
 
     def execute(self, context):
-        write_radiance(context, self.filepath, self.frame_start, self.frame_start, self.only_selected)
+        write_radiance(context, self.filepath, self.frame_start, self.frame_end, self.only_selected,
+                       self.use_obj2rad, self.geometry_mode, self.workers)
         return {'FINISHED'}
 
     def invoke(self, context, event):
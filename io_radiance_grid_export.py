@@ -34,11 +34,27 @@ bl_info = {
 
 import bpy
 import os
+import time
 import bmesh
+import concurrent.futures
+import numpy as np
+from collections import OrderedDict
 from mathutils import Vector
 from os.path import splitext
 from math import degrees
 
+try:
+    from .radiance_vtk import polygon_cells, write_vtk_legacy, write_vtk_xml
+    from .radiance_grid_tools import generate_grid, write_pnt, write_chunks, write_ordered, \
+                                      read_results, illuminance, result_stats, false_colour, \
+                                      face_sensors, deduplicate, Throughput
+except (ImportError, SystemError):
+    # installed as a single file add-on, next to radiance_vtk.py and radiance_grid_tools.py
+    from radiance_vtk import polygon_cells, write_vtk_legacy, write_vtk_xml
+    from radiance_grid_tools import generate_grid, write_pnt, write_chunks, write_ordered, \
+                                     read_results, illuminance, result_stats, false_colour, \
+                                     face_sensors, deduplicate, Throughput
+
 def writeVtkPolydata(filename, verts, faces):
     #print verts[1]
     #print faces[1]
@@ -81,7 +97,216 @@ def writeVtkPolydata(filename, verts, faces):
         vtkfile.write(line + "\n")
     vtkfile.close()
 
-def write_grids(context, filepath, frame_start, frame_end, only_selected=False):
+def grid_arrays(me):
+    # points, normals and polygons of a mesh as arrays, one RNA call per attribute
+    co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("co", co)
+    normals = np.empty(len(me.vertices) * 3, dtype=np.float32)
+    me.vertices.foreach_get("normal", normals)
+    loop_vi = np.empty(len(me.loops), dtype=np.int32)
+    me.loops.foreach_get("vertex_index", loop_vi)
+    loop_start = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_start", loop_start)
+    loop_total = np.empty(len(me.polygons), dtype=np.int32)
+    me.polygons.foreach_get("loop_total", loop_total)
+    return co.reshape(-1, 3), normals.reshape(-1, 3), polygon_cells(loop_vi, loop_start, loop_total), loop_total
+
+
+def write_vtk(filename, me, vtk_format='ASCII', point_data=None):
+    """
+    Write the grid mesh for VTK viewers:
+    ASCII   legacy ASCII .vtk (writeVtkPolydata)
+    BINARY  legacy binary .vtk
+    VTP     XML PolyData .vtp, arrays appended as raw binary
+    point_data, a list of (name, per vertex array), attaches results
+    to the binary formats. Returns the file name written.
+    """
+    if vtk_format == 'ASCII' and not point_data:
+        writeVtkPolydata(filename, me.vertices, me.polygons)
+        return filename
+    co, normals, connectivity, counts = grid_arrays(me)
+    return write_mesh_vtk(filename, co, normals, connectivity, counts, vtk_format, point_data)
+
+
+def write_mesh_vtk(filename, co, normals, connectivity, counts, vtk_format='BINARY', point_data=None):
+    # write_vtk from the arrays of grid_arrays; ASCII is a legacy ASCII file with normals
+    point_data = [("normals", normals)] + list(point_data or [])
+    if vtk_format == 'VTP':
+        filename = splitext(filename)[0] + ".vtp"
+        write_vtk_xml(filename, co, connectivity, counts, point_data)
+    else:
+        write_vtk_legacy(filename, co, connectivity, counts, point_data, binary=(vtk_format == 'BINARY'))
+    return filename
+
+
+def write_points_vtk(filename, points, normals, vtk_format='ASCII', point_data=None):
+    # generated grids have no mesh, so they are written as point clouds
+    point_data = [("normals", normals)] + list(point_data or [])
+    if vtk_format == 'VTP':
+        filename = splitext(filename)[0] + ".vtp"
+        write_vtk_xml(filename, points, point_data=point_data)
+    else:
+        write_vtk_legacy(filename, points, point_data=point_data, binary=(vtk_format == 'BINARY'))
+    return filename
+
+
+def write_grid_files(gfn, points, normals, vtk_format='ASCII', chunks=1, chunk_mode='SPATIAL', ordering='NONE',
+                     polygons=None, progress=None, with_vtk=True):
+    """
+    Write one grid from its arrays: gfn.pnt (in curve order with its
+    gfn.order.idx, unless ordering is NONE), the VTK file and the chunks.
+    polygons, (connectivity, counts), writes the VTK file as a mesh rather
+    than a point cloud; with_vtk False leaves the VTK file to the caller,
+    as writeVtkPolydata needs the Blender mesh. No bpy here, so grids are written on a
+    writer thread while the next one is evaluated.
+    """
+    t0 = time.time()
+    order = None
+    if ordering == 'NONE':
+        write_pnt(gfn + ".pnt", points, normals, progress)
+    else:
+        # rewrite the points along a space filling curve, keeping the permutation
+        order = write_ordered(gfn, points, normals, ordering, progress)
+    messages = ["grid file written: %s.pnt, %d points in %.2fs" % (gfn, len(points), time.time() - t0)]
+    if order is not None:
+        messages.append("points ordered along a %s curve, permutation in %s.order.idx" % (ordering.lower(), gfn))
+    if not with_vtk:
+        pass
+    elif polygons is None:
+        messages.append("vtk file written: %s" % write_points_vtk(gfn + ".vtk", points, normals, vtk_format))
+    else:
+        messages.append("vtk file written: %s" % write_mesh_vtk(gfn + ".vtk", points, normals, polygons[0],
+                                                                polygons[1], vtk_format))
+    if chunks > 1:
+        messages.append("chunk manifest written: %s" % write_chunks(gfn, points, normals, chunks, chunk_mode, order))
+    return "\n".join(messages)
+
+
+def generate_grid_files(gfn, co, loop_vi, loop_start, loop_total, spacing, offset, clearance, vtk_format,
+                        chunks, chunk_mode, ordering, progress=None):
+    t0 = time.time()
+    points, normals, faces = generate_grid(co, loop_vi, loop_start, loop_total, spacing, offset, clearance)
+    message = "%d points generated on %d faces in %.2fs" % (len(points), len(loop_start), time.time() - t0)
+    # the faces and settings, for adaptive refinement: radiance_adaptive.py scene.oct gfn.grid.npz
+    np.savez(gfn + ".grid.npz", co=co, loop_vi=loop_vi, loop_start=loop_start, loop_total=loop_total,
+             spacing=spacing, offset=offset, clearance=clearance)
+    message += "\nfaces written for adaptive refinement: %s.grid.npz" % gfn
+    return message + "\n" + write_grid_files(gfn, points, normals, vtk_format, chunks, chunk_mode, ordering,
+                                             progress=progress)
+
+
+def writer_pool(threads):
+    # writers run beside the main thread, which alone may call bpy
+    return concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1))
+
+
+def finish_writes(jobs, progress):
+    # wait for every writer in submission order, so errors reach the operator
+    for job in jobs:
+        print(job.result())
+    if progress:
+        print(progress.line())
+
+
+def generate_grids(grids, fn, spacing, offset, clearance, vtk_format='ASCII', chunks=1, chunk_mode='SPATIAL',
+                   ordering='NONE', threads=2, progress=None):
+    """
+    Rasterise sensor points over the selected faces of each mesh (all of its
+    faces if none are selected), so grids need not be modelled as dense meshes.
+    Meshes are evaluated one by one on the main thread; rasterising and
+    writing run on writer threads meanwhile.
+    """
+    jobs = []
+    with writer_pool(threads) as pool:
+        for obj, obj_data in grids:
+            gfn = '%s_%s' % (fn, obj.name)
+            me = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
+            me.transform(obj.matrix_world)
+            co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+            me.vertices.foreach_get("co", co)
+            loop_vi = np.empty(len(me.loops), dtype=np.int32)
+            me.loops.foreach_get("vertex_index", loop_vi)
+            loop_start = np.empty(len(me.polygons), dtype=np.int32)
+            me.polygons.foreach_get("loop_start", loop_start)
+            loop_total = np.empty(len(me.polygons), dtype=np.int32)
+            me.polygons.foreach_get("loop_total", loop_total)
+            selected = np.zeros(len(me.polygons), dtype=bool)
+            me.polygons.foreach_get("select", selected)
+            bpy.data.meshes.remove(me)
+            if selected.any():
+                loop_start = loop_start[selected]
+                loop_total = loop_total[selected]
+            jobs.append(pool.submit(generate_grid_files, gfn, co.reshape(-1, 3), loop_vi, loop_start, loop_total,
+                                    spacing, offset, clearance, vtk_format, chunks, chunk_mode, ordering, progress))
+        finish_writes(jobs, progress)
+
+
+def is_grid(name):
+    return name[:len("Grid")] == "Grid" or name[:len("Grid")] == "grid"
+
+
+def dupli_grids(scene, duplicators):
+    """
+    The Grid meshes instanced by duplicators (dupli verts, faces, frames
+    and groups, and particle systems), as (duplicator, instanced object,
+    (k, 4, 4) world matrices) in scene order. Only the matrices are read
+    per instance; the instances are never made real.
+    """
+    found = OrderedDict()
+    for obj in duplicators:
+        obj.dupli_list_create(scene, 'RENDER')
+        for dob in obj.dupli_list:
+            if dob.object.type == 'MESH' and is_grid(dob.object.name):
+                entry = found.setdefault((obj.name, dob.object.name), (obj, dob.object, []))
+                entry[2].append(np.array(dob.matrix, dtype=np.float64))
+        obj.dupli_list_clear()
+    return [(obj, source, np.array(matrices)) for obj, source, matrices in found.values()]
+
+
+def instance_arrays(arrays, matrices):
+    """
+    grid_arrays of a mesh in its local coordinates repeated at k world
+    matrices, with one batched transform for all the instances. Normals
+    go through the inverse transpose, so scaled instances keep them
+    perpendicular to their faces.
+    """
+    co, normals, connectivity, counts = arrays
+    matrices = np.asarray(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    k = len(matrices)
+    linear = matrices[:, 0:3, 0:3]
+    points = np.einsum('kij,nj->kni', linear, co) + matrices[:, None, 0:3, 3]
+    normal_matrices = np.linalg.inv(linear).transpose(0, 2, 1)
+    world_normals = np.einsum('kij,nj->kni', normal_matrices, normals)
+    length = np.sqrt((world_normals * world_normals).sum(axis=2, keepdims=True))
+    world_normals /= np.where(length > 0.0, length, 1.0)
+    connectivity = (connectivity[None, :] + (np.arange(k) * len(co))[:, None]).ravel()
+    return points.reshape(-1, 3), world_normals.reshape(-1, 3), connectivity, np.tile(counts, k)
+
+
+def write_unique_sensors(fn, sensors, tolerance):
+    """
+    Collapse coincident sensors across all grids into fn_sensors.pnt, with
+    a gfn.map.idx per grid (int32 little endian, the line of
+    fn_sensors.pnt for every sensor of the grid) to expand the results:
+    radiance_grid_tools.py expand gfn.map.idx fn_sensors.dat
+    """
+    points = np.concatenate([co for gfn, co, normals in sensors])
+    normals = np.concatenate([normals for gfn, co, normals in sensors])
+    unique_points, unique_normals, mapping = deduplicate(points, normals, tolerance)
+    write_pnt(fn + "_sensors.pnt", unique_points, unique_normals)
+    start = 0
+    for gfn, co, grid_normals in sensors:
+        mapping[start:start + len(co)].astype('<i4').tofile(gfn + ".map.idx")
+        start += len(co)
+    saved = 100.0 * (1.0 - len(unique_points) / max(len(points), 1))
+    print("sensor file written: %s_sensors.pnt, %d unique of %d sensors (%.1f%% fewer rays)" %
+          (fn, len(unique_points), len(points), saved))
+
+
+def write_grids(context, filepath, frame_start, frame_end, only_selected=False, vtk_format='ASCII',
+                generate=False, spacing=0.5, offset=0.8, clearance=0.0, chunks=1, chunk_mode='SPATIAL',
+                ordering='NONE', sensor_mode='VERTEX', dedupe=False, tolerance=0.001, threads=2,
+                show_progress=False):
 
     data_attrs = (
         'lens',
@@ -102,49 +327,153 @@ def write_grids(context, filepath, frame_start, frame_end, only_selected=False):
     scene = bpy.context.scene
 
     grids = []
+    duplicators = []
 
     for obj in scene.objects:
         if only_selected and not obj.select:
             continue
+        if obj.is_duplicator:
+            duplicators.append(obj)
         if obj.type != 'MESH':
             continue
+        # the source of dupli verts/faces is exported through its parent's instances
+        if obj.parent and obj.parent.dupli_type in {'VERTS', 'FACES'}:
+            continue
 
         grids.append((obj, obj.data))
 
     frame_range = range(frame_start, frame_end + 1)
 
-
-    for obj, obj_data in grids:
-        gfn = '%s_%s' % (fn,obj.name)
-        grid = obj
-        name = obj.name
-
-        if name[:len("Grid")] == "Grid" or name[:len("Grid")] == "grid":
-            fn = gfn # file name
-            fnpnt = fn+".pnt"
-            fnvtk = fn+".vtk"
-            f = open(fnpnt,'w') # open file
-            if obj.type=='MESH':
-                od = obj.data # get object data if it is a mesh
-                # export vertices and normals
-                me = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
-                #me = od
-                me.transform(obj.matrix_world) # use world coordinates rather than local coordinate
-                for v in me.vertices:
-                    x,y,z = v.co
-                    nx, ny, nz = v.normal
-                    print(x,y,z,nx,ny,nz)
-                    f.write('%s %s %s %s %s %s\n' % (x,y,z,nx,ny,nz))
-                f.close()    
-                #bpy.ops.export_scene.obj(filepath=fn + ".obj", use_selection=True, axis_forward='Y', axis_up='Z')
-                ## Can be used for multiple formats
-                # bpy.ops.export_scene.x3d(filepath=fn + ".x3d", use_selection=True)
-                #obj.select = False
-                print("grid file written:", fn)
-                writeVtkPolydata(fnvtk,me.vertices,me.polygons)
+    progress = Throughput("sensor points written") if show_progress else None
+
+    if generate:
+        generate_grids(grids, fn, spacing, offset, clearance, vtk_format, chunks, chunk_mode, ordering,
+                       threads, progress)
+        return
+
+    sensors = []
+    jobs = []
+
+    # to_mesh is not thread safe: meshes are evaluated one at a time here,
+    # while the writer threads format and write the grids evaluated before
+    with writer_pool(threads) as pool:
+        for obj, obj_data in grids:
+            gfn = '%s_%s' % (fn,obj.name)
+            grid = obj
+            name = obj.name
+
+            if is_grid(name):
+                if obj.type=='MESH':
+                    # export vertices and normals
+                    me = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
+                    me.transform(obj.matrix_world) # use world coordinates rather than local coordinate
+                    co, normals, connectivity, counts = grid_arrays(me)
+                    polygons = None
+                    with_vtk = True
+                    if sensor_mode == 'FACE':
+                        # one sensor per face centroid, with the face normal
+                        loop_start = np.cumsum(counts) - counts
+                        co, normals = face_sensors(co, connectivity, loop_start, counts)
+                    else:
+                        polygons = (connectivity, counts)
+                        if vtk_format == 'ASCII':
+                            print("vtk file written:", write_vtk(gfn + ".vtk", me, vtk_format))
+                            with_vtk = False
+                    bpy.data.meshes.remove(me)
+                    sensors.append((gfn, co, normals))
+                    jobs.append(pool.submit(write_grid_files, gfn, co, normals, vtk_format, chunks, chunk_mode,
+                                            ordering, polygons, progress, with_vtk))
+
+        # Grid meshes instanced by duplicators: one grid per duplicator and
+        # instanced mesh, the mesh evaluated once for all of its instances
+        for duplicator, source, matrices in dupli_grids(scene, duplicators):
+            gfn = '%s_%s_%s' % (fn, duplicator.name, source.name)
+            me = source.to_mesh(bpy.context.scene, True, 'PREVIEW')
+            co, normals, connectivity, counts = instance_arrays(grid_arrays(me), matrices)
+            bpy.data.meshes.remove(me)
+            polygons = None
+            if sensor_mode == 'FACE':
+                loop_start = np.cumsum(counts) - counts
+                co, normals = face_sensors(co, connectivity, loop_start, counts)
+            else:
+                polygons = (connectivity, counts)
+            print("%d instances of %s in %s" % (len(matrices), source.name, duplicator.name))
+            sensors.append((gfn, co, normals))
+            jobs.append(pool.submit(write_grid_files, gfn, co, normals, vtk_format, chunks, chunk_mode,
+                                    ordering, polygons, progress))
+        finish_writes(jobs, progress)
+
+    if dedupe and sensors:
+        write_unique_sensors(fn, sensors, tolerance)
         
-from bpy.props import StringProperty, IntProperty, BoolProperty
-from bpy_extras.io_utils import ExportHelper
+def load_results(obj, filepath, binary=None, vmax=0.0, vtk_format='VTP'):
+    """
+    Read rtrace -h -I results for a grid, as illuminance in lux, and write
+    them back: as point data in a VTK file next to the results, and as an
+    "illuminance" false colour vertex colour layer when the results match
+    the vertices of obj. Results of an ordered .pnt are mapped back with
+    the .order.idx next to them; results of a generated grid, which has
+    no mesh, go on the points of the .pnt next to them.
+    Returns the result statistics.
+    """
+    t0 = time.time()
+    root = splitext(filepath)[0]
+    lux = illuminance(read_results(filepath, binary))
+    order = None
+    if os.path.exists(root + ".order.idx"):
+        order = np.fromfile(root + ".order.idx", dtype='<i4')
+        if len(order) == len(lux):
+            vertex_lux = np.empty(len(lux))
+            vertex_lux[order] = lux
+            lux = vertex_lux
+        else:
+            order = None
+    stats = result_stats(lux)
+    point_data = [("illuminance", lux)]
+
+    me = None
+    if obj is not None and obj.type == 'MESH':
+        me = obj.to_mesh(bpy.context.scene, True, 'PREVIEW')
+        me.transform(obj.matrix_world)
+        if len(me.vertices) != len(lux):
+            bpy.data.meshes.remove(me)
+            me = None
+    if me is not None:
+        vtk_name = write_vtk(root + ".vtk", me, vtk_format, point_data)
+        bpy.data.meshes.remove(me)
+    elif os.path.exists(root + ".pnt"):
+        grid = read_results(root + ".pnt", columns=6)
+        if len(grid) != len(lux):
+            raise ValueError("%s has %d results for %d points" % (filepath, len(lux), len(grid)))
+        if order is not None:
+            # the .pnt lists the points in curve order too
+            grid_points = np.empty_like(grid)
+            grid_points[order] = grid
+            grid = grid_points
+        vtk_name = write_points_vtk(root + ".vtk", grid[:, 0:3], grid[:, 3:6], vtk_format, point_data)
+    else:
+        raise ValueError("%d results match neither the vertices of %s nor a %s.pnt" %
+                         (len(lux), obj.name if obj else "the active object", root))
+    print("vtk file written:", vtk_name)
+
+    if obj is not None and obj.type == 'MESH' and len(obj.data.vertices) == len(lux):
+        mesh = obj.data
+        loop_vi = np.empty(len(mesh.loops), dtype=np.int32)
+        mesh.loops.foreach_get("vertex_index", loop_vi)
+        layer = mesh.vertex_colors.get("illuminance")
+        if layer is None:
+            layer = mesh.vertex_colors.new("illuminance")
+        colours = false_colour(lux, vmax)[loop_vi].astype(np.float32)
+        layer.data.foreach_set("color", colours.ravel())
+        mesh.vertex_colors.active = layer
+        mesh.update()
+        print("vertex colours written: %s.illuminance" % obj.name)
+    print("results loaded in %.2fs" % (time.time() - t0))
+    return stats
+
+
+from bpy.props import StringProperty, IntProperty, BoolProperty, EnumProperty, FloatProperty
+from bpy_extras.io_utils import ExportHelper, ImportHelper
 
 
 class GridExporter(bpy.types.Operator, ExportHelper):
@@ -165,10 +494,67 @@ class GridExporter(bpy.types.Operator, ExportHelper):
             default=1, min=1, max=300000)
     only_selected = BoolProperty(name="Only Selected",
             default=True)
+    vtk_format = EnumProperty(name="VTK Format",
+            description="File written next to each .pnt grid for VTK viewers",
+            items=(('ASCII', "Legacy ASCII", "Legacy .vtk text file"),
+                   ('BINARY', "Legacy Binary", "Legacy .vtk binary file, with normals"),
+                   ('VTP', "XML PolyData", "VTK XML .vtp with appended binary arrays, with normals")),
+            default='ASCII')
+    generate = BoolProperty(name="Generate from Faces",
+            description="Rasterise sensor points over the selected faces of any mesh, "
+                        "instead of exporting the vertices of Grid meshes",
+            default=False)
+    spacing = FloatProperty(name="Spacing",
+            description="Distance between generated sensor points",
+            default=0.5, min=0.001, max=1000.0)
+    offset = FloatProperty(name="Offset",
+            description="Distance of the work plane from the faces, along their normals",
+            default=0.8, min=-1000.0, max=1000.0)
+    clearance = FloatProperty(name="Clearance",
+            description="Drop generated points closer than this to the outline of the faces (walls)",
+            default=0.0, min=0.0, max=1000.0)
+    chunks = IntProperty(name="Chunks",
+            description="Also split each grid into this many .pnt files, for parallel rtrace runs "
+                        "(merge the results with radiance_grid_tools.py merge)",
+            default=1, min=1, max=4096)
+    chunk_mode = EnumProperty(name="Chunking",
+            description="How points are shared out between chunks",
+            items=(('SPATIAL', "Spatial", "Compact regions of the grid, by recursive bisection"),
+                   ('ROUND_ROBIN', "Round Robin", "Every n-th point, each chunk spanning the whole grid")),
+            default='SPATIAL')
+    ordering = EnumProperty(name="Point Order",
+            description="Order of the points in the .pnt files; a space filling curve keeps consecutive "
+                        "rays close together, so rtrace -I reuses the ambient cache. The permutation "
+                        "is written to .order.idx to map results back to vertex order",
+            items=(('NONE', "Vertex Order", "As the mesh stores them"),
+                   ('HILBERT', "Hilbert Curve", "Along a 3D Hilbert curve"),
+                   ('MORTON', "Morton Curve", "Along a 3D Morton (Z-order) curve")),
+            default='NONE')
+    sensor_mode = EnumProperty(name="Sensors",
+            description="Where the sensors of Grid meshes go",
+            items=(('VERTEX', "Vertices", "One sensor per vertex, with the vertex normal"),
+                   ('FACE', "Face Centres", "One sensor per face centroid, with the face normal")),
+            default='VERTEX')
+    dedupe = BoolProperty(name="Merge Coincident Sensors",
+            description="Also write the sensors of all grids with coincident ones merged to _sensors.pnt, "
+                        "with a .map.idx per grid to expand the results",
+            default=False)
+    tolerance = FloatProperty(name="Merge Tolerance",
+            description="Distance below which sensors facing the same way are merged",
+            default=0.001, min=0.000001, max=10.0)
+    threads = IntProperty(name="Writer Threads",
+            description="Grids formatted and written at once, while the next grid is evaluated",
+            default=2, min=1, max=64)
+    show_progress = BoolProperty(name="Show Progress",
+            description="Print the points written and the points per second about once a second",
+            default=False)
             
 
     def execute(self, context):
-        write_grids(context, self.filepath, self.frame_start, self.frame_start, self.only_selected)
+        write_grids(context, self.filepath, self.frame_start, self.frame_end, self.only_selected,
+                    self.vtk_format, self.generate, self.spacing, self.offset, self.clearance,
+                    self.chunks, self.chunk_mode, self.ordering, self.sensor_mode, self.dedupe, self.tolerance,
+                    self.threads, self.show_progress)
         return {'FINISHED'}
 
     def invoke(self, context, event):
@@ -180,20 +566,66 @@ class GridExporter(bpy.types.Operator, ExportHelper):
         return {'RUNNING_MODAL'}
 
 
+class GridResultsImporter(bpy.types.Operator, ImportHelper):
+    """Load rtrace Results onto a Radiance Calculation Grid"""
+
+    bl_idname = "import.radiance_grid_results"
+
+    bl_label = "Import Radiance Grid Results"
+
+    filename_ext = ".dat"
+    filter_glob = StringProperty(default="*.dat", options={'HIDDEN'})
+
+    data_format = EnumProperty(name="Data Format",
+            description="rtrace output format the results were written in (header off, -h)",
+            items=(('ASCII', "ASCII", "Default rtrace output, -oa"),
+                   ('FLOAT', "Float", "Binary floats, rtrace -of"),
+                   ('DOUBLE', "Double", "Binary doubles, rtrace -od")),
+            default='ASCII')
+    scale_max = FloatProperty(name="Scale Maximum (lx)",
+            description="Illuminance shown red in the vertex colours, 0 for the maximum of the results",
+            default=0.0, min=0.0)
+    vtk_format = EnumProperty(name="VTK Format",
+            description="File written next to the results, with illuminance as point data",
+            items=(('ASCII', "Legacy ASCII", "Legacy .vtk text file"),
+                   ('BINARY', "Legacy Binary", "Legacy .vtk binary file"),
+                   ('VTP', "XML PolyData", "VTK XML .vtp with appended binary arrays")),
+            default='VTP')
+
+    def execute(self, context):
+        binary = {'ASCII': None, 'FLOAT': 'f', 'DOUBLE': 'd'}[self.data_format]
+        try:
+            stats = load_results(context.active_object, self.filepath, binary, self.scale_max, self.vtk_format)
+        except ValueError as error:
+            self.report({'ERROR'}, str(error))
+            return {'CANCELLED'}
+        message = ("illuminance: %(points)d points, min %(min).1f avg %(avg).1f max %(max).1f lx, "
+                   "uniformity %(uniformity).3f" % stats)
+        print(message)
+        self.report({'INFO'}, message)
+        return {'FINISHED'}
+
+
 def menu_export(self, context):
     import os
     default_path = os.path.splitext(bpy.data.filepath)[0] + ".py"
     self.layout.operator(GridExporter.bl_idname, text="Radiance Calculation Grids (.pnt)").filepath = default_path
 
 
+def menu_import(self, context):
+    self.layout.operator(GridResultsImporter.bl_idname, text="Radiance Grid Results (.dat)")
+
+
 def register():
     bpy.utils.register_module(__name__)
     bpy.types.INFO_MT_file_export.append(menu_export)
+    bpy.types.INFO_MT_file_import.append(menu_import)
 
 
 def unregister():
     bpy.utils.unregister_module(__name__)
     bpy.types.INFO_MT_file_export.remove(menu_export)
+    bpy.types.INFO_MT_file_import.remove(menu_import)
 
 
 if __name__ == "__main__":
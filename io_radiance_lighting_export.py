@@ -37,29 +37,8 @@ from mathutils import Vector
 from os.path import splitext
 from math import degrees
 
-def write_lighting(context, filepath, frame_start, frame_end, only_selected=False):
-
-    fn = splitext(filepath)[0]
-
-    scene = bpy.context.scene
-
-    lighting = []
-
-    for obj in scene.objects:
-        if only_selected and not obj.select:
-            continue
-        if obj.type != 'LAMP':
-            continue
-
-        lighting.append((obj, obj.data))
-
-    frame_range = range(frame_start, frame_end + 1)
-
-    lumname = fn +'.lum'
-    fn = lumname
-    f = open(fn,'w')
-
-
+def make_lighting(lighting):
+    lum_str = ''
     for obj, obj_data in lighting:
     
         if obj.type=='LAMP':
@@ -80,15 +59,53 @@ def write_lighting(context, filepath, frame_start, frame_end, only_selected=Fals
             #print(rx, ry, rz)
             #print(dir(obj.matrix_world))
             xform = '!xform -rx %s -ry %s -rz %s -t %s %s %s %s.rad # %s\n' % (rx, ry, rz, x, y, z, ies, name)
-            print(xform)
-            f.write(xform)
+            lum_str = lum_str + xform
             
 
         #obj.select = False
 
-   
-    f.close()
-    print("written:", fn)
+    return lum_str
+
+
+def write_lighting(context, filepath, frame_start, frame_end, only_selected=False):
+
+    fn = splitext(filepath)[0]
+
+    scene = bpy.context.scene
+
+    lighting = []
+
+    for obj in scene.objects:
+        if only_selected and not obj.select:
+            continue
+        if obj.type != 'LAMP':
+            continue
+
+        lighting.append((obj, obj.data))
+
+    frame_range = range(frame_start, frame_end + 1)
+    frame_current = scene.frame_current
+
+    # the first frame goes to <name>.lum, later frames only when a lamp moved, as <name>_<frame>.lum
+    lum_str = None
+    for frame in frame_range:
+        if frame != scene.frame_current:
+            scene.frame_set(frame)
+        new_lum_str = make_lighting(lighting)
+        if new_lum_str == lum_str:
+            continue
+        lumname = fn + '.lum'
+        if lum_str is not None:
+            lumname = '%s_%04d.lum' % (fn, frame)
+        lum_str = new_lum_str
+        print(lum_str)
+        f = open(lumname,'w')
+        f.write(lum_str)
+        f.close()
+        print("written:", lumname)
+
+    if scene.frame_current != frame_current:
+        scene.frame_set(frame_current)
     
 
         
@@ -117,7 +134,7 @@ class LightingExporter(bpy.types.Operator, ExportHelper):
             
 
     def execute(self, context):
-        write_lighting(context, self.filepath, self.frame_start, self.frame_start, self.only_selected)
+        write_lighting(context, self.filepath, self.frame_start, self.frame_end, self.only_selected)
         return {'FINISHED'}
 
     def invoke(self, context, event):
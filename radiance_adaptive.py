@@ -0,0 +1,354 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Adaptive calculation grids: a coarse generated grid refined where the
+illuminance changes quickly, tracing only the new points.
+
+Every sensor is the centre of a square cell in the plane of its face.
+A refined cell is split into 3 x 3 cells; the middle one keeps the
+sensor and its result, so a refinement costs 8 new rays. The change of
+a cell is the largest difference between its illuminance and that of
+the cells around it (of the same size, or the coarser cell covering
+that side), relative to the average illuminance. Each pass refines the
+cells whose change is above the threshold, largest first, until none
+is left, cells would get smaller than spacing / 3 ** levels, or the
+point budget is spent. Children stay inside the faces of their plane
+(the faces sharing a vertex with the face of their parent) and clear
+of the outline of the faces, as generate_grid keeps them.
+
+    grid = AdaptiveGrid(co, loop_vi, loop_start, loop_total, spacing=1.0, offset=0.8)
+    grid.run(pool.run, threshold=0.1, budget=20000)
+    points, normals, lux = grid.results()
+
+trace, e.g. RtracePool.run, is called with (n, 6) rays and returns
+(n, 3) rtrace -I values.
+
+Run as a script on a grid exported with "Generate from Faces", whose
+faces are saved next to it in a .grid.npz:
+python radiance_adaptive.py scene.oct grid.grid.npz [--threshold 0.1] [--budget n] [--levels 3] [--workers n] [-o grid_adaptive] [-- rtrace options]
+writes grid_adaptive.pnt, grid_adaptive.dat (rtrace -I values in .pnt
+order) and grid_adaptive.vtp with illuminance, cell size and level.
+"""
+
+import os
+import sys
+import time
+import numpy as np
+
+try:
+    from .radiance_grid_tools import face_corners, face_planes, boundary_edges, clear_of, inside_faces, \
+                                     generate_grid, write_pnt, illuminance, result_stats
+    from .radiance_vtk import write_vtk_xml
+except (ImportError, SystemError, ValueError):
+    from radiance_grid_tools import face_corners, face_planes, boundary_edges, clear_of, inside_faces, \
+                                    generate_grid, write_pnt, illuminance, result_stats
+    from radiance_vtk import write_vtk_xml
+
+# the 8 cells around a cell, and the 3 x 3 children of a cell, in lattice steps
+AROUND = np.array([(a, b) for a in (-1, 0, 1) for b in (-1, 0, 1) if a or b], dtype=np.int64)
+CHILDREN = np.array([(a, b) for a in (-1, 0, 1) for b in (-1, 0, 1)], dtype=np.int64)
+
+# lattice indices are packed in a key with 22 bits each, around this offset
+INDEX_OFFSET = 1 << 21
+
+
+def plane_ids(normals, height, spacing):
+    # faces with the same normal and plane height share a lattice
+    rows = np.column_stack((np.round(normals * 1e4), np.round(height / spacing * 1e4))).astype(np.int64)
+    rows = np.ascontiguousarray(rows)
+    _, plane = np.unique(rows.view(np.dtype((np.void, rows.dtype.itemsize * 4))).ravel(), return_inverse=True)
+    return plane
+
+
+def face_neighbours(loop_vi, loop_start, loop_total, plane):
+    # (start, neighbours): the faces of the same plane sharing a vertex with
+    # each face, the face itself included, as neighbours[start[f]:start[f + 1]]
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    vi = loop_vi[corners]
+    order = np.argsort(vi, kind='mergesort')
+    vertex_faces = face[order]
+    group_start = np.flatnonzero(np.r_[True, vi[order][1:] != vi[order][:-1]])
+    group_size = np.diff(np.r_[group_start, len(vi)])
+    entry_group = np.repeat(np.arange(len(group_start)), group_size)
+    sizes = group_size[entry_group]
+    a = np.repeat(vertex_faces, sizes)
+    step = np.arange(len(a)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+    b = vertex_faces[np.repeat(group_start[entry_group], sizes) + step]
+    same = plane[a] == plane[b]
+    nfaces = len(loop_start)
+    pairs = np.unique(a[same] * nfaces + b[same])
+    start = np.searchsorted(pairs // nfaces, np.arange(nfaces + 1))
+    return start, pairs % nfaces
+
+
+class AdaptiveGrid:
+    """
+    A grid generated over faces (as Mesh.vertices/loops/polygons store
+    them, see radiance_grid_tools) and refined cell by cell. The cells
+    ever made are kept, refined ones too, so any cell can find the
+    samples around it; the unrefined ones (leaves) form the grid.
+    """
+
+    def __init__(self, co, loop_vi, loop_start, loop_total, spacing, offset=0.0, clearance=0.0):
+        self.co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+        self.loop_vi = np.asarray(loop_vi, dtype=np.int64)
+        self.loop_start = np.asarray(loop_start, dtype=np.int64)
+        self.loop_total = np.asarray(loop_total, dtype=np.int64)
+        self.spacing = spacing
+        self.offset = offset
+        self.clearance = clearance
+        self.normals, self.u, self.v, self.uv, height = face_planes(self.co, self.loop_vi, self.loop_start,
+                                                                    self.loop_total)
+        self.corners, self.following, face, self.first = face_corners(self.loop_start, self.loop_total)
+        self.plane = plane_ids(self.normals, height, spacing)
+        self.neighbour_start, self.neighbours = face_neighbours(self.loop_vi, self.loop_start, self.loop_total,
+                                                                self.plane)
+        edges = boundary_edges(self.loop_vi, self.loop_start, self.loop_total)
+        self.edge_a = self.co[edges[:, 0]]
+        self.edge_b = self.co[edges[:, 1]]
+
+        points, normals, faces = generate_grid(self.co, self.loop_vi, self.loop_start, self.loop_total,
+                                               spacing, 0.0, clearance)
+        q = np.column_stack(((points * self.u[faces]).sum(axis=1), (points * self.v[faces]).sum(axis=1)))
+        ij = np.floor(q / spacing).astype(np.int64)
+        level = np.zeros(len(points), dtype=np.int64)
+        # points on an edge shared by two faces come once per face
+        keys, unique = np.unique(self.key(self.plane[faces], level, ij), return_index=True)
+        self.base = points[unique]
+        self.face = faces[unique]
+        self.level = level[unique]
+        self.ij = ij[unique]
+        self.value = np.full(len(unique), np.nan)
+        self.leaf = np.ones(len(unique), dtype=bool)
+        self.sorted_keys = keys
+        self.sorted_nodes = np.arange(len(unique))
+        self.passes = []
+
+    def key(self, plane, level, ij):
+        # plane, level and lattice indices packed in one int64 (15, 4, 22 and 22 bits)
+        shifted = ij + INDEX_OFFSET
+        if len(shifted) and (shifted.min() < 0 or shifted.max() >= 2 * INDEX_OFFSET):
+            raise ValueError("grid too large for this many levels of refinement")
+        if len(plane) and plane.max() >= 1 << 15:
+            raise ValueError("too many face planes (%d) for one grid" % (plane.max() + 1))
+        if len(level) and level.max() >= 1 << 4:
+            raise ValueError("too many levels of refinement (%d)" % level.max())
+        return ((plane.astype(np.int64) << 48) | (level << 44) | (shifted[:, 0] << 22) | shifted[:, 1])
+
+    def lookup(self, keys):
+        # node index of every key, -1 where there is no such cell
+        if not len(self.sorted_keys):
+            return np.full(len(keys), -1)
+        at = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)
+        return np.where(self.sorted_keys[at] == keys, self.sorted_nodes[at], -1)
+
+    def cell_size(self, level):
+        return self.spacing / 3.0 ** level
+
+    def rays(self, nodes):
+        normals = self.normals[self.face[nodes]]
+        return np.column_stack((self.base[nodes] + self.offset * normals, normals))
+
+    def trace(self, trace, nodes):
+        if len(nodes):
+            self.value[nodes] = illuminance(trace(self.rays(nodes)))
+
+    def changes(self):
+        # (leaves, change): largest difference to the cells around each leaf, relative to the mean
+        leaves = np.flatnonzero(self.leaf)
+        mean = max(np.nanmean(self.value[leaves]), 1e-9) if len(leaves) else 1.0
+        change = np.zeros(len(leaves))
+        plane = self.plane[self.face[leaves]]
+        for step in AROUND:
+            level = self.level[leaves].copy()
+            ij = self.ij[leaves] + step
+            found = np.full(len(leaves), -1)
+            # the same size cell on that side, else the coarser cell covering it
+            todo = np.arange(len(leaves))
+            while len(todo):
+                hit = self.lookup(self.key(plane[todo], level[todo], ij[todo]))
+                found[todo] = hit
+                todo = todo[(hit < 0) & (level[todo] > 0)]
+                level[todo] -= 1
+                ij[todo] //= 3
+            ok = found >= 0
+            diff = np.abs(self.value[leaves[ok]] - self.value[found[ok]]) / mean
+            change[ok] = np.maximum(change[ok], diff)
+        return leaves, change
+
+    def refine(self, cells):
+        # split cells into 3 x 3, returning the new nodes; children outside the faces are left out
+        ncells = len(cells)
+        level = self.level[cells] + 1
+        size = self.cell_size(level)
+        parent = np.repeat(cells, len(CHILDREN))
+        step = np.tile(CHILDREN, (ncells, 1))
+        child_size = np.repeat(size, len(CHILDREN))
+        faces = self.face[parent]
+        base = self.base[parent] + (step[:, 0:1] * self.u[faces] + step[:, 1:2] * self.v[faces]) * child_size[:, None]
+        ij = self.ij[parent] * 3 + 1 + step
+        middle = np.all(step == 0, axis=1)
+
+        # every child but the middle one, against the faces around its parent's face
+        moved = np.flatnonzero(~middle)
+        counts = self.neighbour_start[faces[moved] + 1] - self.neighbour_start[faces[moved]]
+        pair_child = np.repeat(moved, counts)
+        offsets = np.arange(len(pair_child)) - np.repeat(np.cumsum(counts) - counts, counts)
+        pair_face = self.neighbours[np.repeat(self.neighbour_start[faces[moved]], counts) + offsets]
+        p = base[pair_child]
+        q = np.column_stack(((p * self.u[pair_face]).sum(axis=1), (p * self.v[pair_face]).sum(axis=1)))
+        inside = inside_faces(q, pair_face, self.uv, self.corners, self.following, self.first, self.loop_total)
+        child_face = np.full(len(parent), -1)
+        child_face[middle] = faces[middle]
+        hit_child, first_hit = np.unique(pair_child[inside], return_index=True)
+        child_face[hit_child] = pair_face[inside][first_hit]
+        keep = child_face >= 0
+        if self.clearance > 0.0 and keep.any():
+            test = np.flatnonzero(keep & ~middle)
+            keep[test] = clear_of(base[test], self.edge_a, self.edge_b, self.clearance)
+
+        new = np.arange(len(self.base), len(self.base) + keep.sum())
+        self.base = np.concatenate((self.base, base[keep]))
+        self.face = np.concatenate((self.face, child_face[keep]))
+        self.level = np.concatenate((self.level, np.repeat(level, len(CHILDREN))[keep]))
+        self.ij = np.concatenate((self.ij, ij[keep]))
+        # the middle child is at its parent's point, so it keeps the parent's result
+        values = np.where(middle, self.value[parent], np.nan)
+        self.value = np.concatenate((self.value, values[keep]))
+        self.leaf[cells] = False
+        self.leaf = np.concatenate((self.leaf, np.ones(len(new), dtype=bool)))
+        keys = np.concatenate((self.sorted_keys, self.key(self.plane[self.face[new]], self.level[new], self.ij[new])))
+        nodes = np.concatenate((self.sorted_nodes, new))
+        order = np.argsort(keys, kind='mergesort')
+        self.sorted_keys = keys[order]
+        self.sorted_nodes = nodes[order]
+        return new[~middle[keep]]
+
+    def run(self, trace, threshold=0.1, budget=None, levels=3, verbose=True):
+        """
+        Trace the coarse grid, then refine until no cell changes by more
+        than threshold (a fraction of the average illuminance), or cells
+        would be smaller than spacing / 3 ** levels, or the grid would
+        have more than budget points. Returns the largest change left.
+        """
+        t0 = time.time()
+        self.trace(trace, np.flatnonzero(np.isnan(self.value)))
+        self.initial = len(self.base)
+        while True:
+            leaves, change = self.changes()
+            points = len(leaves)
+            worst = change.max() if len(change) else 0.0
+            candidates = np.flatnonzero((change > threshold) & (self.level[leaves] < levels))
+            if len(candidates) and budget is not None:
+                candidates = candidates[np.argsort(-change[candidates], kind='mergesort')]
+                candidates = candidates[:max((budget - points) // (len(CHILDREN) - 1), 0)]
+            if not len(candidates):
+                break
+            new = self.refine(leaves[candidates])
+            self.trace(trace, new)
+            self.passes.append((len(candidates), len(new), worst))
+            if verbose:
+                print("pass %d: %d cells refined, %d new points, %d points, largest change %.3f" %
+                      (len(self.passes), len(candidates), len(new), points + len(new), worst))
+        if verbose:
+            finest = self.level[self.leaf].max() if self.leaf.any() else 0
+            uniform = self.initial * 9 ** finest
+            print("%d points (%d coarse) in %.2fs, largest change %.3f; a uniform grid at the finest "
+                  "spacing %.4g would have about %d points (%.1fx)" %
+                  (points, self.initial, time.time() - t0, worst, self.cell_size(finest), uniform,
+                   uniform / max(points, 1)))
+        return worst
+
+    def results(self):
+        # (points, normals, illuminance) of the leaves, points on the work plane
+        leaves = np.flatnonzero(self.leaf)
+        rays = self.rays(leaves)
+        return rays[:, 0:3], rays[:, 3:6], self.value[leaves]
+
+    def point_data(self):
+        leaves = np.flatnonzero(self.leaf)
+        return [("illuminance", self.value[leaves]),
+                ("cell_size", self.cell_size(self.level[leaves])),
+                ("level", self.level[leaves].astype(np.float32)),
+                ("normals", self.normals[self.face[leaves]])]
+
+
+def load_grid(filename):
+    # an AdaptiveGrid from the .grid.npz the grid exporter writes next to a generated grid
+    data = np.load(filename)
+    return AdaptiveGrid(data["co"], data["loop_vi"], data["loop_start"], data["loop_total"],
+                        float(data["spacing"]), float(data["offset"]), float(data["clearance"]))
+
+
+def main(argv):
+    try:
+        from .radiance_rtrace import RtracePool
+    except (ImportError, SystemError, ValueError):
+        from radiance_rtrace import RtracePool
+    if "--" in argv:
+        options = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    else:
+        options = ["-I", "-ab", "2"]
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    octree, npz = argv[0], argv[1]
+    output = npz.replace(".grid.npz", "") + "_adaptive"
+    threshold = 0.1
+    budget = None
+    levels = 3
+    workers = None
+    command = "rtrace"
+    args = argv[2:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-o":
+            output = os.path.splitext(args.pop(0))[0]
+        elif arg == "--threshold":
+            threshold = float(args.pop(0))
+        elif arg == "--budget":
+            budget = int(args.pop(0))
+        elif arg == "--levels":
+            levels = int(args.pop(0))
+        elif arg == "--workers":
+            workers = int(args.pop(0))
+        elif arg == "--command":
+            command = args.pop(0)
+    grid = load_grid(npz)
+    pool = RtracePool(octree, options, workers, command=command)
+    try:
+        grid.run(pool.run, threshold, budget, levels)
+    finally:
+        pool.close()
+    points, normals, lux = grid.results()
+    write_pnt(output + ".pnt", points, normals)
+    # the rtrace -I values (lux / 179 in every channel) in .pnt order, as rtrace would write them
+    np.savetxt(output + ".dat", np.repeat(lux[:, None] / 179.0, 3, axis=1), fmt="%.6e", delimiter="\t")
+    write_vtk_xml(output + ".vtp", points, point_data=grid.point_data())
+    print("illuminance: %(points)d points, min %(min).1f avg %(avg).1f max %(max).1f lx, "
+          "uniformity %(uniformity).3f" % result_stats(lux))
+    print("adaptive grid written: %s.pnt, %s.dat, %s.vtp" % (output, output, output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,742 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Calculation grid tools working from NumPy arrays, without Blender.
+
+Meshes are given the way Mesh.vertices/loops/polygons store them:
+co (n, 3) vertex coordinates, loop_vi the vertex index of every face
+corner, loop_start and loop_total the first corner and corner count of
+every face.
+
+generate_grid  sensor points rasterised over faces at a given spacing,
+               lifted to a work plane, optionally kept clear of the
+               outline of the faces (walls)
+write_pnt      x y z nx ny nz per line, as rtrace -I reads them
+Throughput     sampled progress and points per second of long exports
+write_chunks   a grid split into chunk .pnt files for parallel rtrace runs,
+               with the point indices of every chunk and a manifest
+merge_chunks   chunk results put back together in the original point order
+curve_order    Morton or Hilbert space filling curve order of the points,
+               so consecutive rtrace -I rays reuse the ambient cache
+write_ordered  a .pnt in curve order, with the permutation to map back
+unorder        results of an ordered .pnt back in the original point order
+read_results   rtrace -h RGB output, ASCII or -of/-od binary, as an (n, 3) array
+illuminance    179 * (0.265 R + 0.670 G + 0.065 B), from rtrace -I irradiance
+result_stats   min, average, max and uniformities of a set of values
+false_colour   values mapped to a blue - green - red ramp
+face_sensors   one sensor per face, at its centroid with the face normal
+deduplicate    coincident sensors (within a tolerance, same direction)
+               collapsed into one, with the mapping to expand results
+
+Run as a script to merge chunk results, to map ordered results back, or to
+summarise results and write them on the grid points as a VTK point cloud:
+python radiance_grid_tools.py merge grid.chunks.json [--suffix .dat] [-o grid.dat]
+python radiance_grid_tools.py unorder grid.order.idx grid.dat [-o grid_vertices.dat]
+python radiance_grid_tools.py results grid.pnt grid.dat [-of|-od] [-o grid.vtp]
+python radiance_grid_tools.py expand grid.map.idx sensors.dat [-o grid.dat]
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+import numpy as np
+
+# candidate points tested at once, bounds the memory of generate_grid
+BLOCK = 1 << 20
+
+
+def format_rows(fmt, rows, chunk=65536):
+    # format an (n,k) array with one %-operation per block of rows
+    for i in range(0, len(rows), chunk):
+        block = rows[i:i + chunk]
+        yield (fmt * len(block)) % tuple(block.ravel().tolist())
+
+
+def write_pnt(filename, points, normals, progress=None, chunk=65536):
+    # progress, if given, is called with the number of points of every block written
+    rows = np.column_stack((points, normals))
+    f = open(filename, 'w')
+    for i, block in enumerate(format_rows("%.6f %.6f %.6f %.6f %.6f %.6f\n", rows, chunk)):
+        f.write(block)
+        if progress:
+            progress(min(chunk, len(rows) - i * chunk))
+    f.close()
+
+
+class Throughput:
+    """
+    Sampled progress of a long export: called with the points of every
+    block written, it prints a line with the rate at most every interval
+    seconds, instead of a line per point. Thread safe, so several writers
+    can share one.
+    """
+
+    def __init__(self, label="points", total=0, interval=1.0, out=None):
+        self.label = label
+        self.total = total
+        self.interval = interval
+        self.out = out or sys.stdout
+        self.done = 0
+        self.lock = threading.Lock()
+        self.start = self.last = time.time()
+
+    def __call__(self, count):
+        with self.lock:
+            self.done += count
+            now = time.time()
+            if now - self.last >= self.interval:
+                self.last = now
+                self.out.write(self.line(now) + "\n")
+                self.out.flush()
+
+    def line(self, now=None):
+        elapsed = max((now or time.time()) - self.start, 1e-6)
+        of = " of %d (%.0f%%)" % (self.total, 100.0 * self.done / self.total) if self.total else ""
+        return "%s: %d%s in %.1fs, %.0f/s" % (self.label, self.done, of, elapsed, self.done / elapsed)
+
+
+def face_corners(loop_start, loop_total):
+    # corner indices of every face in face order, with each corner's face and following corner
+    first = np.cumsum(loop_total) - loop_total
+    face = np.repeat(np.arange(len(loop_total)), loop_total)
+    position = np.arange(len(face)) - first[face]
+    corners = loop_start[face] + position
+    following = loop_start[face] + (position + 1) % loop_total[face]
+    return corners, following, face, first
+
+
+def face_normals(co, loop_vi, loop_start, loop_total):
+    # Newell's method, robust for concave and slightly non planar faces
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    a = co[loop_vi[corners]]
+    b = co[loop_vi[following]]
+    n = np.column_stack(((a[:, 1] - b[:, 1]) * (a[:, 2] + b[:, 2]),
+                         (a[:, 2] - b[:, 2]) * (a[:, 0] + b[:, 0]),
+                         (a[:, 0] - b[:, 0]) * (a[:, 1] + b[:, 1])))
+    n = np.add.reduceat(n, first, axis=0) if len(first) else n
+    length = np.sqrt((n * n).sum(axis=1))
+    return n / np.where(length > 0.0, length, 1.0)[:, None]
+
+
+def face_frames(normals):
+    # in plane axes (u, v) of every face; horizontal faces use world x and y,
+    # so the lattices of neighbouring floor faces line up
+    u = np.cross([0.0, 0.0, 1.0], normals)
+    length = np.sqrt((u * u).sum(axis=1))
+    flat = length < 1e-6
+    u[flat] = [1.0, 0.0, 0.0]
+    u[~flat] /= length[~flat, None]
+    v = np.cross(normals, u)
+    return u, v
+
+
+def face_sensors(co, loop_vi, loop_start, loop_total):
+    # (centroids, face normals): one sensor per face, facing the way the face does
+    # even where vertex normals are averaged across creases
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    if len(first) == 0:
+        return np.zeros((0, 3)), np.zeros((0, 3))
+    centres = np.add.reduceat(co[loop_vi[corners]], first, axis=0) / np.asarray(loop_total)[:, None]
+    return centres, face_normals(co, loop_vi, loop_start, loop_total)
+
+
+# which axes step to the neighbouring cell, for the tolerance search of deduplicate
+NEIGHBOURS = np.array([(i, j, k) for i in (0, 1) for j in (0, 1) for k in (0, 1)], dtype=np.int64)
+
+
+def cell_hash(cells, bins):
+    # one int64 per position cell and direction bin; collisions only cost a
+    # missed merge, as candidates are checked by distance afterwards
+    h = cells[:, 0] * np.int64(73856093)
+    h ^= cells[:, 1] * np.int64(19349663)
+    h ^= cells[:, 2] * np.int64(83492791)
+    h ^= bins[:, 0] * np.int64(2654435761)
+    h ^= bins[:, 1] * np.int64(805459861)
+    h ^= bins[:, 2] * np.int64(3674653429)
+    return h
+
+
+def deduplicate(points, normals, tolerance=0.001, min_dot=0.999):
+    """
+    Collapse sensors closer than tolerance whose normals agree (cosine at
+    least min_dot), e.g. shared vertices on grid boundaries or coincident
+    vertices of joined meshes. Points are hashed into cells twice the
+    tolerance across, so a sensor's partners can only be in its own cell
+    or across the nearer face on each axis: 8 cells. Normals are hashed
+    into bins at least twice as wide as agreeing normals can differ,
+    centred on 0 and 1 so axis-aligned normals and their float noise
+    share one; the nearer neighbouring bin is only searched on the axes
+    where a partner can reach it. Each sensor takes the lowest index
+    sensor of those that is close enough, transitively. (Distinct
+    sensors less than 1.5 tolerances apart in one cell may shadow each
+    other's partners; sensors are far sparser.)
+    Returns (unique points, unique normals, mapping) with
+    points ~= unique points[mapping]; results for the unique points
+    expand back with expand(results, mapping).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    normals = np.asarray(normals, dtype=np.float64).reshape(-1, 3)
+    n = len(points)
+    if n == 0:
+        return points, normals, np.zeros(0, dtype=np.int64)
+    scaled = points / (2.0 * tolerance)
+    cells = np.floor(scaled).astype(np.int64)
+    side = np.where(scaled - cells >= 0.5, 1, -1).astype(np.int64)
+    # agreeing unit normals differ by at most the chord on any axis
+    chord = max(np.sqrt(max(2.0 - 2.0 * min_dot, 0.0)), 1e-6)
+    per_unit = int(1.0 / (4.0 * chord))
+    width = 1.0 / per_unit if per_unit else 4.0 * chord
+    turned = normals / width + 0.5
+    bins = np.floor(turned).astype(np.int64)
+    fraction = turned - bins
+    bin_side = np.where(fraction >= 0.5, 1, -1).astype(np.int64)
+    near = np.abs(fraction - 0.5) >= 0.5 - chord / width
+    keys = cell_hash(cells, bins)
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    # lowest index point of every key: order is stable, so the first of each run
+    representative = order
+    rep = np.arange(n)
+    for turn in NEIGHBOURS:
+        which = np.nonzero(near[:, turn == 1].all(axis=1))[0]
+        m = len(which)
+        if m == 0:
+            continue
+        turned_bins = bins[which] + bin_side[which] * turn
+        for step in NEIGHBOURS:
+            neighbour = cell_hash(cells[which] + side[which] * step, turned_bins)
+            # searching sorted queries is several times faster than random ones
+            query = np.argsort(neighbour)
+            at = np.empty(m, dtype=np.int64)
+            at[query] = np.minimum(np.searchsorted(sorted_keys, neighbour[query]), n - 1)
+            found = sorted_keys[at] == neighbour
+            candidate = representative[at]
+            delta = points[candidate] - points[which]
+            close = found & ((delta * delta).sum(axis=1) <= tolerance * tolerance)
+            close &= (normals[candidate] * normals[which]).sum(axis=1) >= min_dot
+            rep[which] = np.where(close & (candidate < rep[which]), candidate, rep[which])
+    # follow chains of representatives to their root
+    while True:
+        parent = rep[rep]
+        if np.array_equal(parent, rep):
+            break
+        rep = parent
+    roots, mapping = np.unique(rep, return_inverse=True)
+    return points[roots], normals[roots], mapping
+
+
+def expand(lines, mapping):
+    # results of the unique sensors back out to every original sensor
+    lines = np.asarray(lines, dtype=object)
+    if len(mapping) and mapping.max() >= len(lines):
+        raise ValueError("%d results for %d unique sensors" % (len(lines), mapping.max() + 1))
+    return lines[mapping].tolist()
+
+
+def boundary_edges(loop_vi, loop_start, loop_total):
+    # (m, 2) vertex pairs of the edges used by a single face: the outline of the faces
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    edges = np.sort(np.column_stack((loop_vi[corners], loop_vi[following])), axis=1)
+    edges = np.ascontiguousarray(edges.astype(np.int64))
+    rows = edges.view(np.dtype((np.void, edges.dtype.itemsize * 2))).ravel()
+    _, index, counts = np.unique(rows, return_index=True, return_counts=True)
+    return edges[np.sort(index[counts == 1])]
+
+
+def segment_distance(points, a, b):
+    # (n, m) distances from points to the segments a-b
+    d = b - a
+    dd = (d * d).sum(axis=1)
+    t = np.einsum('nmk,mk->nm', points[:, None, :] - a[None, :, :], d) / np.where(dd > 0.0, dd, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    closest = a[None, :, :] + t[:, :, None] * d[None, :, :]
+    delta = points[:, None, :] - closest
+    return np.sqrt((delta * delta).sum(axis=2))
+
+
+def clear_of(points, a, b, clearance, block=4096):
+    # mask of the points at least clearance away from every segment a-b;
+    # points come in lattice rows, so each block only meets the nearby segments
+    keep = np.ones(len(points), dtype=bool)
+    lo = np.minimum(a, b) - clearance
+    hi = np.maximum(a, b) + clearance
+    for i in range(0, len(points), block):
+        p = points[i:i + block]
+        near = np.all((lo <= p.max(axis=0)) & (hi >= p.min(axis=0)), axis=1)
+        if near.any():
+            keep[i:i + block] = segment_distance(p, a[near], b[near]).min(axis=1) >= clearance
+    return keep
+
+
+def inside_faces(q, pair_face, uv, corners, following, first, loop_total):
+    # even-odd test of 2d points q against the face each one belongs to,
+    # one vectorised pass per edge number; pairs sorted by descending
+    # corner count, so pass k only touches the faces with more than k edges
+    order = np.argsort(-loop_total[pair_face], kind='mergesort')
+    q = q[order]
+    f = pair_face[order]
+    totals = loop_total[f]
+    inside = np.zeros(len(f), dtype=bool)
+    for k in range(int(totals[0]) if len(f) else 0):
+        m = np.searchsorted(-totals, -k, side='left')
+        c = first[f[:m]] + k
+        a = uv[corners[c]]
+        b = uv[following[c]]
+        qm = q[:m]
+        crosses = (a[:, 1] > qm[:, 1]) != (b[:, 1] > qm[:, 1])
+        dy = np.where(crosses, b[:, 1] - a[:, 1], 1.0)
+        x = a[:, 0] + (b[:, 0] - a[:, 0]) * (qm[:, 1] - a[:, 1]) / dy
+        inside[:m] ^= crosses & (qm[:, 0] < x)
+    result = np.empty(len(f), dtype=bool)
+    result[order] = inside
+    return result
+
+
+def face_planes(co, loop_vi, loop_start, loop_total):
+    # (normals, u, v, uv, height): the frame of every face, every corner in
+    # the 2d frame of its face (indexed like loop_vi) and the plane height of each face
+    normals = face_normals(co, loop_vi, loop_start, loop_total)
+    u, v = face_frames(normals)
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    corner_co = co[loop_vi[corners]]
+    uv = np.empty((len(loop_vi), 2))
+    uv[corners, 0] = (corner_co * u[face]).sum(axis=1)
+    uv[corners, 1] = (corner_co * v[face]).sum(axis=1)
+    height = np.add.reduceat((corner_co * normals[face]).sum(axis=1), first) / loop_total
+    return normals, u, v, uv, height
+
+
+def generate_grid(co, loop_vi, loop_start, loop_total, spacing, offset=0.0, clearance=0.0):
+    """
+    Rasterise sensor points over faces.
+
+    Each face gets the centres of a square lattice of the given spacing in
+    its own plane (world aligned for horizontal faces), kept where they
+    fall inside the face, then moved offset along the face normal, e.g.
+    to a work plane 0.8 above a floor. With a clearance, points closer
+    than that to the outline of the faces, i.e. edges not shared by two
+    of them, are dropped.
+
+    Returns (points (n, 3), normals (n, 3), face index (n,)).
+    """
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    loop_vi = np.asarray(loop_vi, dtype=np.int64)
+    loop_start = np.asarray(loop_start, dtype=np.int64)
+    loop_total = np.asarray(loop_total, dtype=np.int64)
+    empty = (np.zeros((0, 3)), np.zeros((0, 3)), np.zeros(0, dtype=np.int64))
+    if len(loop_start) == 0:
+        return empty
+    normals, u, v, uv, height = face_planes(co, loop_vi, loop_start, loop_total)
+    corners, following, face, first = face_corners(loop_start, loop_total)
+    # lattice cells covering the 2d bounding box of every face
+    lo = np.minimum.reduceat(uv[corners], first, axis=0)
+    hi = np.maximum.reduceat(uv[corners], first, axis=0)
+    i0 = np.ceil(lo / spacing - 0.5).astype(np.int64)
+    i1 = np.floor(hi / spacing - 0.5).astype(np.int64)
+    size = np.maximum(i1 - i0 + 1, 0)
+    ncells = size[:, 0] * size[:, 1]
+
+    points = []
+    point_normals = []
+    point_faces = []
+    # blocks of whole faces, so no more than about BLOCK candidates at a time
+    ends = np.cumsum(ncells)
+    f0 = 0
+    while f0 < len(ncells):
+        f1 = max(np.searchsorted(ends, (ends[f0] - ncells[f0]) + BLOCK, side='right'), f0 + 1)
+        faces = np.arange(f0, f1)
+        pair_face = np.repeat(faces, ncells[faces])
+        cell = np.arange(len(pair_face)) - np.repeat(np.cumsum(ncells[faces]) - ncells[faces], ncells[faces])
+        row, col = np.divmod(cell, np.maximum(size[pair_face, 0], 1))
+        q = np.column_stack(((i0[pair_face, 0] + col + 0.5) * spacing, (i0[pair_face, 1] + row + 0.5) * spacing))
+        keep = inside_faces(q, pair_face, uv, corners, following, first, loop_total)
+        q = q[keep]
+        pair_face = pair_face[keep]
+        n = normals[pair_face]
+        points.append(q[:, 0:1] * u[pair_face] + q[:, 1:2] * v[pair_face] + height[pair_face, None] * n)
+        point_normals.append(n)
+        point_faces.append(pair_face)
+        f0 = f1
+    points = np.concatenate(points)
+    point_normals = np.concatenate(point_normals)
+    point_faces = np.concatenate(point_faces)
+
+    if clearance > 0.0 and len(points):
+        edges = boundary_edges(loop_vi, loop_start, loop_total)
+        keep = clear_of(points, co[edges[:, 0]], co[edges[:, 1]], clearance)
+        points = points[keep]
+        point_normals = point_normals[keep]
+        point_faces = point_faces[keep]
+    return points + offset * point_normals, point_normals, point_faces
+
+
+def round_robin_chunks(npoints, nchunks):
+    # point i goes to chunk i % nchunks: balanced, but every chunk spans the whole grid
+    return [np.arange(i, npoints, nchunks) for i in range(nchunks)]
+
+
+def spatial_chunks(points, nchunks):
+    # recursive bisection along the longest side, split in proportion to the
+    # chunks each half gets: balanced and spatially compact for any nchunks
+    parts = []
+
+    def split(index, n):
+        if n == 1 or len(index) <= 1:
+            parts.append(index)
+            parts.extend([index[:0]] * (n - 1))
+            return
+        p = points[index]
+        axis = np.argmax(p.max(axis=0) - p.min(axis=0))
+        order = index[np.argsort(p[:, axis], kind='mergesort')]
+        n0 = n // 2
+        cut = int(round(len(index) * n0 / float(n)))
+        split(np.sort(order[:cut]), n0)
+        split(np.sort(order[cut:]), n - n0)
+
+    split(np.arange(len(points)), nchunks)
+    return parts
+
+
+def quantise(points, bits):
+    # integer coordinates in [0, 2**bits) over the bounding cube of the points
+    lo = points.min(axis=0)
+    extent = (points.max(axis=0) - lo).max()
+    scale = ((1 << bits) - 1) / extent if extent > 0.0 else 0.0
+    return np.floor((points - lo) * scale + 0.5).astype(np.uint64)
+
+
+def spread_bits(x):
+    # 21 bits of x spaced out to every third bit, for the Morton key
+    x = x & np.uint64(0x1fffff)
+    x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+    return x
+
+
+def morton_keys(q):
+    return spread_bits(q[:, 0]) | (spread_bits(q[:, 1]) << np.uint64(1)) | (spread_bits(q[:, 2]) << np.uint64(2))
+
+
+def hilbert_keys(q, bits):
+    # Skilling's transpose form of the 3d Hilbert index (AIP Conf. Proc. 707, 2004),
+    # each step applied to all points at once
+    x = [q[:, i].copy() for i in range(3)]
+    m = 1 << (bits - 1)
+    bit = m
+    while bit > 1:
+        low = np.uint64(bit - 1)
+        for i in range(3):
+            high = (x[i] & np.uint64(bit)) != 0
+            t = np.where(high, np.uint64(0), (x[0] ^ x[i]) & low)
+            x[0] = np.where(high, x[0] ^ low, x[0] ^ t)
+            if i:
+                x[i] = x[i] ^ t
+        bit >>= 1
+    # gray encode
+    x[1] ^= x[0]
+    x[2] ^= x[1]
+    t = np.zeros(len(q), dtype=np.uint64)
+    bit = m
+    while bit > 1:
+        t = np.where((x[2] & np.uint64(bit)) != 0, t ^ np.uint64(bit - 1), t)
+        bit >>= 1
+    # interleave the transposed bits into one key, most significant first
+    key = np.zeros(len(q), dtype=np.uint64)
+    for b in range(bits - 1, -1, -1):
+        for i in range(3):
+            key = (key << np.uint64(1)) | (((x[i] ^ t) >> np.uint64(b)) & np.uint64(1))
+    return key
+
+
+def curve_order(points, curve='HILBERT', bits=16):
+    """
+    Permutation listing the points along a space filling curve through
+    their bounding cube: HILBERT (neighbours stay neighbours) or MORTON
+    (cheaper, with jumps between quadrants).
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+    q = quantise(points, bits)
+    if curve == 'MORTON':
+        keys = morton_keys(q)
+    else:
+        keys = hilbert_keys(q, bits)
+    return np.argsort(keys, kind='mergesort')
+
+
+def write_ordered(gfn, points, normals, curve='HILBERT', progress=None):
+    # gfn.pnt with the points in curve order, and gfn.order.idx holding
+    # (int32 little endian) the original index of every line
+    order = curve_order(points, curve)
+    write_pnt(gfn + ".pnt", points[order], normals[order], progress)
+    order.astype('<i4').tofile(gfn + ".order.idx")
+    return order
+
+
+def unorder(lines, order):
+    # results listed in curve order back in the original point order
+    if len(lines) != len(order):
+        raise ValueError("%d results for %d points" % (len(lines), len(order)))
+    result = np.empty(len(order), dtype=object)
+    result[order] = lines
+    return result.tolist()
+
+
+def write_chunks(gfn, points, normals, nchunks, mode='SPATIAL', order=None):
+    """
+    Split a grid into nchunks .pnt files, gfn_c000.pnt ..., each with a
+    gfn_c000.idx holding the (int32 little endian) point index of every
+    line, a gfn.chunks.json manifest and a gfn_chunks.sh that runs one
+    rtrace per chunk in parallel and merges the results.
+    mode is ROUND_ROBIN or SPATIAL. order, a permutation such as
+    curve_order returns, sets the order of the points within each chunk.
+    Returns the manifest file name.
+    """
+    npoints = len(points)
+    if mode == 'ROUND_ROBIN':
+        chunks = round_robin_chunks(npoints, nchunks)
+    else:
+        chunks = spatial_chunks(points, nchunks)
+    if order is not None:
+        rank = np.empty(npoints, dtype=np.int64)
+        rank[order] = np.arange(npoints)
+        chunks = [index[np.argsort(rank[index], kind='mergesort')] for index in chunks]
+    base = os.path.basename(gfn)
+    manifest = {"grid": base, "points": npoints, "mode": mode, "ordered": order is not None, "chunks": []}
+    for i, index in enumerate(chunks):
+        name = "%s_c%03d" % (gfn, i)
+        write_pnt(name + ".pnt", points[index], normals[index])
+        index.astype('<i4').tofile(name + ".idx")
+        manifest["chunks"].append({"pnt": os.path.basename(name) + ".pnt",
+                                   "index": os.path.basename(name) + ".idx",
+                                   "points": len(index)})
+    manifest_name = gfn + ".chunks.json"
+    f = open(manifest_name, 'w')
+    json.dump(manifest, f, indent=1)
+    f.close()
+    # rtrace settings and octree come from the environment, e.g.
+    # OCTREE=scene.oct RTRACE_OPTIONS="-ab 2 -ad 1024" sh grid_chunks.sh
+    f = open(gfn + "_chunks.sh", 'w')
+    f.write("#!/bin/sh\n")
+    f.write("# one rtrace per chunk, then the results merged in point order\n")
+    f.write(": ${OCTREE:=scene.oct}\n")
+    f.write(": ${RTRACE_OPTIONS:=-ab 2}\n")
+    for chunk in manifest["chunks"]:
+        name = os.path.splitext(chunk["pnt"])[0]
+        f.write("rtrace -h -I $RTRACE_OPTIONS $OCTREE < %s.pnt > %s.dat &\n" % (name, name))
+    f.write("wait\n")
+    f.write("python \"%s\" merge %s.chunks.json --suffix .dat -o %s.dat\n" %
+            (os.path.abspath(__file__), base, base))
+    f.close()
+    return manifest_name
+
+
+def merge_chunks(manifest_name, suffix=".dat", output=None):
+    """
+    Reassemble chunk results (one result line per point, next to each
+    chunk .pnt with the given suffix) in the original point order.
+    Lines are copied as they are, whatever rtrace -o options made them.
+    Returns the merged lines, also written to output if given.
+    """
+    folder = os.path.dirname(os.path.abspath(manifest_name))
+    f = open(manifest_name)
+    manifest = json.load(f)
+    f.close()
+    merged = np.empty(manifest["points"], dtype=object)
+    found = np.zeros(manifest["points"], dtype=bool)
+    for chunk in manifest["chunks"]:
+        index = np.fromfile(os.path.join(folder, chunk["index"]), dtype='<i4')
+        name = os.path.join(folder, os.path.splitext(chunk["pnt"])[0] + suffix)
+        f = open(name)
+        lines = [line for line in f.read().splitlines() if line.strip()]
+        f.close()
+        if len(lines) != len(index):
+            raise ValueError("%s has %d results for %d points" % (name, len(lines), len(index)))
+        merged[index] = lines
+        found[index] = True
+    if not found.all():
+        raise ValueError("%s: %d points have no results" % (manifest_name, (~found).sum()))
+    merged = merged.tolist()
+    if output:
+        f = open(output, 'w')
+        f.write("\n".join(merged) + "\n")
+        f.close()
+    return merged
+
+
+def iter_results(f, dtype=None, columns=3, block=1 << 24):
+    # (m, columns) arrays from an open file, about block bytes at a time;
+    # dtype None reads ASCII, else binary values of that dtype
+    if dtype is not None:
+        rowsize = np.dtype(dtype).itemsize * columns
+        while True:
+            data = f.read(max(block // rowsize, 1) * rowsize)
+            if not data:
+                break
+            yield np.frombuffer(data, dtype=dtype).reshape(-1, columns).astype(np.float64)
+        return
+    rest = b""
+    while True:
+        data = f.read(block)
+        if not data:
+            break
+        # parse whole lines only, keeping a partial last line for the next block
+        cut = data.rfind(b"\n") + 1
+        text = rest + data[:cut]
+        rest = data[cut:]
+        if text.strip():
+            yield np.fromstring(text.decode('ascii'), sep=" ").reshape(-1, columns)
+    if rest.strip():
+        yield np.fromstring(rest.decode('ascii'), sep=" ").reshape(-1, columns)
+
+
+def read_results(filename, binary=None, columns=3):
+    """
+    rtrace results with the header off (-h), one ray per row, as an
+    (n, columns) float64 array. binary is None for ASCII output, 'f' for
+    -of (float) and 'd' for -od (double) output, in native byte order.
+    """
+    f = open(filename, 'rb')
+    blocks = list(iter_results(f, binary, columns))
+    f.close()
+    if not blocks:
+        return np.zeros((0, columns))
+    return np.concatenate(blocks)
+
+
+def illuminance(rgb):
+    # rtrace -I gives irradiance; photopic weighting times the luminous efficacy 179 lm/W
+    rgb = np.asarray(rgb, dtype=np.float64).reshape(-1, 3)
+    return 179.0 * (0.265 * rgb[:, 0] + 0.670 * rgb[:, 1] + 0.065 * rgb[:, 2])
+
+
+def result_stats(values):
+    # uniformity is min/avg, diversity min/max, as daylighting guidance uses them
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) == 0:
+        return {"points": 0}
+    vmin = float(values.min())
+    vavg = float(values.mean())
+    vmax = float(values.max())
+    return {"points": len(values), "min": vmin, "avg": vavg, "max": vmax,
+            "uniformity": vmin / vavg if vavg > 0.0 else 0.0,
+            "diversity": vmin / vmax if vmax > 0.0 else 0.0}
+
+
+def false_colour(values, vmax=None):
+    # (n, 3) rgb in 0 - 1: blue at 0, green at vmax / 2, red at vmax and above
+    values = np.asarray(values, dtype=np.float64)
+    if vmax is None or vmax <= 0.0:
+        vmax = values.max() if len(values) and values.max() > 0.0 else 1.0
+    x = np.clip(values / vmax, 0.0, 1.0)
+    stops = [0.0, 0.25, 0.5, 0.75, 1.0]
+    return np.column_stack((np.interp(x, stops, [0.0, 0.0, 0.0, 1.0, 1.0]),
+                            np.interp(x, stops, [0.0, 1.0, 1.0, 1.0, 0.0]),
+                            np.interp(x, stops, [1.0, 1.0, 0.0, 0.0, 0.0])))
+
+
+def splitext_suffix(filename, suffix):
+    root, ext = os.path.splitext(filename)
+    return root + suffix + ext
+
+
+def main(argv):
+    if len(argv) >= 3 and argv[0] == "expand":
+        mapping = np.fromfile(argv[1], dtype='<i4')
+        f = open(argv[2])
+        lines = [line for line in f.read().splitlines() if line.strip()]
+        f.close()
+        output = argv[4] if len(argv) >= 5 and argv[3] == "-o" else argv[1].replace(".map.idx", "") + ".dat"
+        f = open(output, 'w')
+        f.write("\n".join(expand(lines, mapping)) + "\n")
+        f.close()
+        print("%d results expanded to %d sensors in %s" % (len(lines), len(mapping), output))
+        return 0
+    if len(argv) >= 3 and argv[0] == "results":
+        grid = np.loadtxt(argv[1], ndmin=2)
+        binary = None
+        output = os.path.splitext(argv[2])[0] + ".vtp"
+        args = argv[3:]
+        while args:
+            arg = args.pop(0)
+            if arg == "-of":
+                binary = 'f'
+            elif arg == "-od":
+                binary = 'd'
+            elif arg == "-o":
+                output = args.pop(0)
+        lux = illuminance(read_results(argv[2], binary))
+        if len(lux) != len(grid):
+            raise ValueError("%s has %d results for %d points" % (argv[2], len(lux), len(grid)))
+        stats = result_stats(lux)
+        print("illuminance: %(points)d points, min %(min).1f avg %(avg).1f max %(max).1f lx, "
+              "uniformity %(uniformity).3f, diversity %(diversity).3f" % stats)
+        try:
+            from .radiance_vtk import write_vtk_legacy, write_vtk_xml
+        except (ImportError, SystemError, ValueError):
+            from radiance_vtk import write_vtk_legacy, write_vtk_xml
+        point_data = [("illuminance", lux), ("normals", grid[:, 3:6])]
+        if output.endswith(".vtk"):
+            write_vtk_legacy(output, grid[:, 0:3], point_data=point_data)
+        else:
+            write_vtk_xml(output, grid[:, 0:3], point_data=point_data, unstructured=output.endswith(".vtu"))
+        print("vtk file written:", output)
+        return 0
+    if len(argv) >= 3 and argv[0] == "unorder":
+        order = np.fromfile(argv[1], dtype='<i4')
+        f = open(argv[2])
+        lines = [line for line in f.read().splitlines() if line.strip()]
+        f.close()
+        output = argv[4] if len(argv) >= 5 and argv[3] == "-o" else splitext_suffix(argv[2], "_vertices")
+        f = open(output, 'w')
+        f.write("\n".join(unorder(lines, order)) + "\n")
+        f.close()
+        print("%d results in vertex order written to %s" % (len(lines), output))
+        return 0
+    if len(argv) < 2 or argv[0] != "merge":
+        print(__doc__)
+        return 1
+    manifest_name = argv[1]
+    suffix = ".dat"
+    output = None
+    args = argv[2:]
+    while args:
+        arg = args.pop(0)
+        if arg == "--suffix":
+            suffix = args.pop(0)
+        elif arg == "-o":
+            output = args.pop(0)
+    if output is None:
+        output = manifest_name.replace(".chunks.json", "") + suffix
+    merged = merge_chunks(manifest_name, suffix, output)
+    print("merged %d results into %s" % (len(merged), output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,108 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Radiance pictures (RGBE, as rpict writes them) read into float RGB.
+
+    header, rgb = read_picture(open("scene.hdr", "rb"))   # rgb: (height, width, 3), top row first
+
+Only the standard -Y height +X width orientation and flat or new run
+length encoded scanlines are read.
+"""
+
+import numpy as np
+
+
+class RGBEError(Exception):
+    pass
+
+
+def read_exactly(stream, nbytes):
+    data = b''
+    while len(data) < nbytes:
+        chunk = stream.read(nbytes - len(data))
+        if not chunk:
+            raise RGBEError("picture ended after %d of %d bytes" % (len(data), nbytes))
+        data += chunk
+    return data
+
+
+def read_header(stream):
+    """
+    The header lines of a Radiance picture, up to the blank line, and
+    the resolution string after it: returns (header, width, height).
+    Only the standard -Y height +X width orientation is accepted.
+    """
+    header = []
+    while True:
+        line = stream.readline()
+        if not line:
+            raise RGBEError("picture ended in its header")
+        line = line.decode('ascii', 'replace').rstrip('\n')
+        if not line:
+            break
+        header.append(line)
+    words = stream.readline().decode('ascii', 'replace').split()
+    if len(words) != 4 or words[0] != '-Y' or words[2] != '+X':
+        raise RGBEError("unsupported picture orientation %s" % " ".join(words))
+    return header, int(words[3]), int(words[1])
+
+
+def read_scanline(stream, width):
+    # one (width, 4) RGBE scanline: new run length encoded, or flat
+    start = read_exactly(stream, 4)
+    if not (8 <= width < 0x8000) or start[0] != 2 or start[1] != 2 or start[2] & 0x80:
+        # flat (or old run length) pixels: the first one is already read
+        pixels = np.frombuffer(start + read_exactly(stream, (width - 1) * 4), dtype=np.uint8).reshape(width, 4)
+        if np.any((pixels[:, 0] == 1) & (pixels[:, 1] == 1) & (pixels[:, 2] == 1)):
+            raise RGBEError("old style run length encoding is not supported")
+        return pixels
+    if (start[2] << 8 | start[3]) != width:
+        raise RGBEError("scanline width %d does not match the picture width %d" %
+                        (start[2] << 8 | start[3], width))
+    scanline = np.empty((4, width), dtype=np.uint8)
+    for component in range(4):
+        row = scanline[component]
+        i = 0
+        while i < width:
+            count = read_exactly(stream, 1)[0]
+            if count > 128:
+                count -= 128
+                row[i:i + count] = read_exactly(stream, 1)[0]
+            else:
+                row[i:i + count] = np.frombuffer(read_exactly(stream, count), dtype=np.uint8)
+            i += count
+    return scanline.T
+
+
+def rgbe_to_float(pixels):
+    # (n, 4) RGBE bytes to (n, 3) float RGB, as Radiance's colr_color does
+    exponent = pixels[:, 3].astype(np.int32)
+    scale = np.where(exponent > 0, np.ldexp(1.0, exponent - (128 + 8)), 0.0)
+    return (pixels[:, 0:3] + 0.5) * scale[:, None]
+
+
+def read_picture(stream):
+    # the header lines and the whole picture, (height, width, 3) from the top row down
+    header, width, height = read_header(stream)
+    rgb = np.empty((height, width, 3))
+    for y in range(height):
+        rgb[y] = rgbe_to_float(read_scanline(stream, width))
+    return header, rgb
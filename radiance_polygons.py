@@ -0,0 +1,113 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+Radiance polygons from plain mesh arrays, in the layout obj2rad writes,
+shared by the geometry exporter and the render engine's update_files.
+Needs no Blender.
+"""
+
+import numpy as np
+
+# obj2rad falls back to this modifier for faces without a usemtl statement
+DEFAULT_MATERIAL = "white"
+
+# obj2rad's tolerance when it compares face normals
+FTINY = 1e-6
+
+
+def nonplanar_faces(coords, loop_start, loop_total):
+    """
+    Faces obj2rad would split into triangles. As in obj2rad, the normals
+    at the corners of a face, across each edge and the one before it,
+    are summed, a normal pointing against the sum (a reflex corner of a
+    flat concave face) counting with its sign flipped, and a face is bent
+    when a corner normal is not parallel to the sum: |d| < 1 - FTINY.
+    The corner at the last vertex is not checked, as in obj2rad.
+    Triangles and corners between coincident points count as planar.
+    """
+    nonplanar = np.zeros(len(loop_start), dtype=bool)
+    faces = np.nonzero(loop_total > 3)[0]
+    if len(faces) == 0:
+        return nonplanar
+    totals = loop_total[faces]
+    face_of = np.repeat(np.arange(len(faces)), totals)
+    index = np.arange(len(face_of)) - np.repeat(np.cumsum(totals) - totals, totals)
+    p = coords[loop_start[faces][face_of] + index]
+    # the edge into every vertex, from the last vertex for the first one
+    wrap = np.arange(len(p)) + np.where(index == 0, totals[face_of] - 1, -1)
+    v = p - p[wrap]
+    corner = np.nonzero(index > 0)[0]
+    normals = np.cross(v[corner - 1], v[corner])
+    face_of = face_of[corner]
+    length = np.sqrt((normals * normals).sum(axis=1))
+    valid = length > 0.0
+    normals = normals[valid] / length[valid, None]
+    face_of = face_of[valid]
+    if len(face_of) == 0:
+        return nonplanar
+    # the sum of the normals of every face, each turned towards its first one
+    first = np.ones(len(face_of), dtype=bool)
+    first[1:] = face_of[1:] != face_of[:-1]
+    starts = np.nonzero(first)[0]
+    reference = normals[starts][np.cumsum(first) - 1]
+    sign = np.where((normals * reference).sum(axis=1) < 0.0, -1.0, 1.0)
+    total = np.add.reduceat(normals * sign[:, None], starts)
+    total /= np.sqrt((total * total).sum(axis=1))[:, None]
+    d = (normals * total[np.cumsum(first) - 1]).sum(axis=1)
+    bent = np.abs(d) < 1.0 - FTINY
+    nonplanar[faces[np.unique(face_of[bent])]] = True
+    return nonplanar
+
+
+def polygon_records(name, co, loop_vi, loop_start, loop_total, modifiers, material_index, faceno=1):
+    """
+    Generate Radiance polygon primitives in the layout obj2rad uses:
+
+    <blank line>
+    white polygon name.1
+    0
+    0
+    9
+        x y z (%18.12g, one vertex per line)
+
+    Coordinates are rounded to the 6 decimals the OBJ exporter writes,
+    so the output can be compared with the obj2rad round trip. Like
+    obj2rad (without vertex normals), non-planar faces are split into
+    triangles of the same name, turning around the face as it does.
+    """
+    rounded = np.around(co.astype(np.float64)[loop_vi], 6)
+    nonplanar = nonplanar_faces(rounded, loop_start, loop_total)
+    coords = ["%18.12g %18.12g %18.12g\n" % (x, y, z) for x, y, z in rounded.tolist()]
+    for i in range(len(loop_start)):
+        start = loop_start[i]
+        total = loop_total[i]
+        mod = modifiers[material_index[i]] if material_index[i] < len(modifiers) else DEFAULT_MATERIAL
+        face = coords[start:start + total]
+        if not nonplanar[i]:
+            yield "".join(["\n%s polygon %s.%d\n0\n0\n%d\n" % (mod, name, faceno + i, total * 3)] + face)
+            continue
+        # obj2rad: a triangle of the first three, then the third vertex onwards and the first
+        header = "\n%s polygon %s.%d\n0\n0\n9\n" % (mod, name, faceno + i)
+        triangles = []
+        while len(face) > 2:
+            triangles += [header] + face[0:3]
+            face = face[2:] + face[0:1]
+        yield "".join(triangles)
@@ -0,0 +1,238 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+rpict options from the quality settings of a scene, and an autotuner
+choosing between quality presets.
+
+rpict_options maps the RenderRadianceSettingsScene properties to rpict:
+
+    radio_recursion_limit   -ab (0 without radio_enable)
+    radio_count             -ad, and -as a quarter of it
+    radio_error_bound       -aa, scaled by ERROR_BOUND_SCALE
+    radio_minimum_reuse     -ar, its inverse (0 for no limit)
+    max_trace_level         -lr
+    radio_adc_bailout       -lw
+    antialias_depth         -ps 2 ** (FULL_DEPTH - depth), finer with depth down to
+                            -ps 1 at FULL_DEPTH, and -ps 1 without antialias_enable
+    antialias_threshold     -pt
+    jitter_amount           -pj (0 without jitter_enable)
+
+Properties without an rpict counterpart (radio_nearest_count, the photon
+and media settings) are left out.
+
+The autotuner renders a small probe of the view with every preset,
+the last, best one first as the reference, timing each. Of the presets
+whose relative RMS luminance error against the reference is within the
+target, the one whose probe took the least time is chosen. Autotuner
+probes one preset per step(), so a caller can run the steps from a
+thread and show progress in between.
+
+Run as a script to tune a scene outside Blender:
+python radiance_quality.py scene.oct view.vf [--target 0.05] [--size 64] [--no-ambient] [--command rpict] [-- rpict options]
+"""
+
+import sys
+import time
+import shlex
+import subprocess
+import numpy as np
+from types import SimpleNamespace
+
+try:
+    from .radiance_picture import read_picture
+except (ImportError, SystemError, ValueError):
+    from radiance_picture import read_picture
+
+# radio_error_bound keeps the range of the POV-Ray add-on; -aa is a tenth of it
+ERROR_BOUND_SCALE = 0.1
+
+# antialias_depth at which rpict samples every pixel (-ps 1); each step below doubles -ps
+FULL_DEPTH = 4
+
+# quality presets, cheapest first, as values of the scene properties
+PRESETS = (
+    ("Draft", {"radio_recursion_limit": 1, "radio_count": 128, "radio_error_bound": 3.0,
+               "radio_minimum_reuse": 1.0 / 32, "max_trace_level": 4, "radio_adc_bailout": 0.01,
+               "antialias_depth": 1, "antialias_threshold": 0.15}),
+    ("Low", {"radio_recursion_limit": 2, "radio_count": 256, "radio_error_bound": 2.0,
+             "radio_minimum_reuse": 1.0 / 64, "max_trace_level": 6, "radio_adc_bailout": 0.005,
+             "antialias_depth": 2, "antialias_threshold": 0.1}),
+    ("Medium", {"radio_recursion_limit": 3, "radio_count": 512, "radio_error_bound": 1.5,
+                "radio_minimum_reuse": 1.0 / 128, "max_trace_level": 8, "radio_adc_bailout": 0.002,
+                "antialias_depth": 2, "antialias_threshold": 0.05}),
+    ("High", {"radio_recursion_limit": 4, "radio_count": 1024, "radio_error_bound": 1.0,
+              "radio_minimum_reuse": 1.0 / 256, "max_trace_level": 10, "radio_adc_bailout": 0.001,
+              "antialias_depth": 3, "antialias_threshold": 0.03}),
+    ("Max", {"radio_recursion_limit": 5, "radio_count": 2048, "radio_error_bound": 0.5,
+             "radio_minimum_reuse": 1.0 / 512, "max_trace_level": 12, "radio_adc_bailout": 0.0005,
+             "antialias_depth": 4, "antialias_threshold": 0.02}),
+)
+
+
+def rpict_options(settings, **values):
+    """
+    rpict options, as a list of arguments, from settings (scene.Radiance
+    or anything with the same attributes); values replace attributes.
+    """
+    def get(name):
+        return values[name] if name in values else getattr(settings, name)
+
+    options = []
+    if get("radio_enable"):
+        count = get("radio_count")
+        reuse = get("radio_minimum_reuse")
+        options += ["-ab", str(get("radio_recursion_limit")), "-ad", str(count), "-as", str(count // 4),
+                    "-aa", "%g" % (get("radio_error_bound") * ERROR_BOUND_SCALE),
+                    "-ar", str(int(round(1.0 / reuse)) if reuse > 0.0 else 0)]
+    else:
+        options += ["-ab", "0"]
+    options += ["-lr", str(get("max_trace_level")), "-lw", "%g" % get("radio_adc_bailout")]
+    if get("antialias_enable"):
+        options += ["-ps", str(2 ** max(FULL_DEPTH - get("antialias_depth"), 0)),
+                    "-pt", "%g" % get("antialias_threshold")]
+    else:
+        options += ["-ps", "1"]
+    options += ["-pj", "%g" % (get("jitter_amount") if get("jitter_enable") else 0.0)]
+    return options
+
+
+def probe(octree, view, options, size, command="rpict", cwd=None):
+    """
+    Render octree at most size x size pixels with rpict, view and options
+    lists of arguments. Returns ((height, width, 3) values, seconds).
+    """
+    if isinstance(command, str):
+        command = shlex.split(command)
+    args = list(command) + list(options) + list(view) + ["-x", str(size), "-y", str(size), octree]
+    t0 = time.time()
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, cwd=cwd)
+    try:
+        header, rgb = read_picture(process.stdout)
+    finally:
+        process.stdout.close()
+        status = process.wait()
+    if status != 0:
+        raise RuntimeError("%s failed with exit status %d" % (args[0], status))
+    return rgb, time.time() - t0
+
+
+def relative_error(rgb, reference):
+    # RMS luminance difference, relative to the mean luminance of the reference
+    weights = np.array([0.265, 0.670, 0.065])
+    lum = np.dot(rgb, weights)
+    ref = np.dot(reference, weights)
+    if lum.shape != ref.shape:
+        raise ValueError("probe of %s pixels against a reference of %s" % (lum.shape, ref.shape))
+    return float(np.sqrt(np.mean((lum - ref) ** 2)) / max(np.mean(ref), 1e-9))
+
+
+class Autotuner:
+    """
+    Probes presets with render(name, values), which returns (values,
+    seconds) of a probe for the property values of a preset. results
+    holds (name, seconds, error) of every probe so far, the reference
+    first.
+    """
+
+    def __init__(self, render, presets=PRESETS, target=0.05):
+        self.render = render
+        self.presets = presets
+        self.target = target
+        self.reference = None
+        self.results = []
+
+    @property
+    def done(self):
+        return len(self.results) == len(self.presets)
+
+    def step(self):
+        # probe the next preset, returning its (name, seconds, error)
+        if self.reference is None:
+            name, values = self.presets[-1]
+            self.reference, seconds = self.render(name, values)
+            result = (name, seconds, 0.0)
+        else:
+            name, values = self.presets[len(self.results) - 1]
+            rgb, seconds = self.render(name, values)
+            result = (name, seconds, relative_error(rgb, self.reference))
+        self.results.append(result)
+        return result
+
+    def best(self):
+        # (name, values) of the fastest probe within the target; the reference always is
+        name = min([result for result in self.results if result[2] <= self.target], key=lambda result: result[1])[0]
+        return name, dict(self.presets)[name]
+
+
+def autotune(render, presets=PRESETS, target=0.05, progress=None):
+    """
+    Probe every preset with an Autotuner. progress, if given, is called
+    with (name, seconds, error) after every probe. Returns (name, values,
+    results) of the fastest preset within the target.
+    """
+    tuner = Autotuner(render, presets, target)
+    while not tuner.done:
+        result = tuner.step()
+        if progress:
+            progress(*result)
+    name, values = tuner.best()
+    return name, values, tuner.results
+
+
+def main(argv):
+    if "--" in argv:
+        switches = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    else:
+        switches = []
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    octree, vf = argv[0], argv[1]
+    target = 0.05
+    size = 64
+    command = "rpict"
+    settings = SimpleNamespace(radio_enable=True, antialias_enable=True, jitter_enable=True, jitter_amount=1.0)
+    args = argv[2:]
+    while args:
+        arg = args.pop(0)
+        if arg == "--target":
+            target = float(args.pop(0))
+        elif arg == "--size":
+            size = int(args.pop(0))
+        elif arg == "--no-ambient":
+            settings.radio_enable = False
+        elif arg == "--command":
+            command = args.pop(0)
+
+    def render(name, values):
+        return probe(octree, ["-vf", vf], rpict_options(settings, **values) + switches, size, command)
+
+    def report(name, seconds, error):
+        print("%-8s %7.2fs  error %.4f" % (name, seconds, error))
+
+    name, values, results = autotune(render, target=target, progress=report)
+    print("%s: %s" % (name, " ".join(rpict_options(settings, **values))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,288 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+A pool of long lived rtrace processes for one octree.
+
+Every worker loads the octree once and keeps its ambient cache between
+runs, instead of a fresh rtrace per grid. Rays go to the workers in
+batches of float data (rtrace -ff), each rtrace flushing its output
+after every batch (-x batch -y 0); the last batch is padded with zero
+direction rays, for which rtrace returns zero. Workers take the next
+batch as soon as they have room, so fast workers do more of the work,
+and results land in ray order whatever order the batches finish in.
+
+    pool = RtracePool("scene.oct", ["-I", "-ab", "2"], workers=8)
+    rgb = pool.run(rays)            # (n, 6) rays in, (n, 3) values out
+    print(pool.report())
+    pool.close()
+
+Run as a script to trace a .pnt file:
+python radiance_rtrace.py scene.oct grid.pnt [-o grid.dat] [--workers n] [--batch n] [-- rtrace options]
+
+With --stub in place of the octree options, the script stands in for
+rtrace itself (rtrace -ff -x n ... < rays): it answers every ray with
+the z of its origin plus the z of its direction in all three channels,
+and zero for a zero direction, so the pool can be tested without
+Radiance:
+python radiance_rtrace.py scene.oct grid.pnt --command "python radiance_rtrace.py --stub"
+"""
+
+import os
+import sys
+import time
+import queue
+import shlex
+import threading
+import subprocess
+import numpy as np
+
+
+class RtraceError(Exception):
+    pass
+
+
+class RtraceWorker:
+    """One rtrace process, fed by a writer thread and drained by a reader thread."""
+
+    def __init__(self, number, args):
+        self.number = number
+        self.args = args
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        self.rays = 0
+        self.seconds = 0.0
+
+    def read_exactly(self, nbytes):
+        chunks = []
+        while nbytes > 0:
+            data = self.process.stdout.read(nbytes)
+            if not data:
+                raise RtraceError("%s (worker %d) ended early, exit status %s" %
+                                  (self.args[0], self.number, self.process.poll()))
+            chunks.append(data)
+            nbytes -= len(data)
+        return b"".join(chunks)
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process.stdout.close()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+
+class RtracePool:
+    """
+    workers rtrace processes on one octree, options as a list of rtrace
+    arguments (e.g. ["-I", "-ab", "2"]), batch rays per flush and at most
+    inflight batches queued in each process. command replaces "rtrace",
+    e.g. with the stub of this module.
+    """
+
+    def __init__(self, octree, options=(), workers=None, batch=1024, inflight=2, command="rtrace"):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.batch = batch
+        self.inflight = inflight
+        self.cancelled = threading.Event()
+        if isinstance(command, str):
+            command = shlex.split(command)
+        args = list(command) + ["-h", "-ff", "-x", str(batch), "-y", "0"] + list(options) + [octree]
+        self.workers = [RtraceWorker(i, args) for i in range(workers)]
+
+    def run(self, rays, progress=None):
+        """
+        Trace (n, 6) rays (origin and direction), returning (n, 3) values
+        in ray order. progress, if given, is called with the number of
+        rays done after every batch. Raises RtraceError when cancelled or
+        when a worker fails.
+        """
+        rays = np.ascontiguousarray(rays, dtype=np.float32).reshape(-1, 6)
+        n = len(rays)
+        results = np.zeros((n, 3), dtype=np.float32)
+        batches = queue.Queue()
+        for start in range(0, n, self.batch):
+            batches.put(start)
+        errors = []
+        done = [0]
+        lock = threading.Lock()
+
+        def feed(worker, pending, room):
+            # writer: take batches while this worker has room for them
+            try:
+                while not self.cancelled.is_set():
+                    room.acquire()
+                    try:
+                        start = batches.get_nowait()
+                    except queue.Empty:
+                        break
+                    block = rays[start:start + self.batch]
+                    if len(block) < self.batch:
+                        block = np.concatenate((block, np.zeros((self.batch - len(block), 6), dtype=np.float32)))
+                    pending.put(start)
+                    worker.process.stdin.write(block.tobytes())
+            except (OSError, ValueError) as error:
+                # a broken pipe after cancel() is expected
+                if not self.cancelled.is_set():
+                    errors.append(RtraceError("worker %d: %s" % (worker.number, error)))
+                    self.cancelled.set()
+            pending.put(None)
+
+        def drain(worker, pending, room):
+            # reader: results come back in the order this worker was fed
+            t0 = time.time()
+            try:
+                while True:
+                    start = pending.get()
+                    if start is None or self.cancelled.is_set():
+                        break
+                    values = np.frombuffer(worker.read_exactly(self.batch * 12), dtype=np.float32)
+                    count = min(self.batch, n - start)
+                    results[start:start + count] = values.reshape(-1, 3)[:count]
+                    worker.rays += count
+                    room.release()
+                    with lock:
+                        done[0] += count
+                        if progress:
+                            progress(done[0])
+            except RtraceError as error:
+                if not self.cancelled.is_set():
+                    errors.append(error)
+                    self.cancelled.set()
+            room.release()
+            worker.seconds += time.time() - t0
+
+        threads = []
+        for worker in self.workers:
+            pending = queue.Queue()
+            room = threading.Semaphore(self.inflight)
+            threads.append(threading.Thread(target=feed, args=(worker, pending, room)))
+            threads.append(threading.Thread(target=drain, args=(worker, pending, room)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # a cancel() from before the run started counts too, so the event is
+        # only cleared once the run is over
+        cancelled = self.cancelled.is_set()
+        self.cancelled.clear()
+        if errors:
+            raise errors[0]
+        if cancelled:
+            raise RtraceError("cancelled after %d of %d rays" % (done[0], n))
+        return results
+
+    def cancel(self):
+        """
+        Stop a run from another thread, or the next one when none is under
+        way. The processes are killed, as their pipes may still hold queued
+        batches, so the pool cannot be reused.
+        """
+        self.cancelled.set()
+        for worker in self.workers:
+            worker.kill()
+
+    def report(self):
+        # rays and rays/sec of every worker, over the runs so far
+        lines = []
+        for worker in self.workers:
+            rate = worker.rays / worker.seconds if worker.seconds > 0.0 else 0.0
+            lines.append("worker %d: %d rays in %.2fs, %.0f rays/s" % (worker.number, worker.rays, worker.seconds, rate))
+        return "\n".join(lines)
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+
+
+def stub(argv):
+    # stand in for rtrace -ff: 6 floats in, 3 floats out per ray, flushed every -x rays
+    flush = 1
+    if "-x" in argv:
+        flush = max(int(argv[argv.index("-x") + 1]), 1)
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    while True:
+        data = stdin.read(flush * 24)
+        if not data:
+            break
+        rays = np.frombuffer(data[:len(data) // 24 * 24], dtype=np.float32).reshape(-1, 6)
+        value = rays[:, 2] + rays[:, 5]
+        value[np.all(rays[:, 3:6] == 0.0, axis=1)] = 0.0
+        stdout.write(np.repeat(value, 3).astype(np.float32).tobytes())
+        stdout.flush()
+    return 0
+
+
+def main(argv):
+    if argv and argv[0] == "--stub":
+        return stub(argv[1:])
+    if "--" in argv:
+        options = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+    else:
+        options = ["-I", "-ab", "2"]
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    octree, pnt = argv[0], argv[1]
+    output = os.path.splitext(pnt)[0] + ".dat"
+    workers = None
+    batch = 1024
+    command = "rtrace"
+    args = argv[2:]
+    while args:
+        arg = args.pop(0)
+        if arg == "-o":
+            output = args.pop(0)
+        elif arg == "--workers":
+            workers = int(args.pop(0))
+        elif arg == "--batch":
+            batch = int(args.pop(0))
+        elif arg == "--command":
+            command = args.pop(0)
+    rays = np.loadtxt(pnt, ndmin=2)[:, 0:6]
+    pool = RtracePool(octree, options, workers, batch, command=command)
+    t0 = time.time()
+    try:
+        results = pool.run(rays)
+    finally:
+        pool.close()
+    dt = max(time.time() - t0, 1e-6)
+    np.savetxt(output, results, fmt="%.6e", delimiter="\t")
+    print(pool.report())
+    print("%d rays in %.2fs (%.0f rays/s), results written to %s" % (len(rays), dt, len(rays) / dt, output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,215 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+VTK writers for calculation grids, working from NumPy arrays.
+
+No Blender is needed, so grids and results can also be written from
+plain Python. Points are an (n, 3) array; polygons are given as a flat
+connectivity array of vertex indices and the number of vertices of each
+polygon, as Mesh.loops/Mesh.polygons store them. Point data is a list of
+(name, array) pairs: (n,) arrays are written as scalars, (n, 3) arrays
+as vectors (or normals, if the name is "normals").
+
+write_vtk_legacy  legacy .vtk, ASCII or binary
+write_vtk_xml     VTK XML .vtp (PolyData) or .vtu (UnstructuredGrid),
+                  with the arrays appended as raw binary
+"""
+
+import sys
+import numpy as np
+
+VTK_POLYGON = 7
+
+
+def polygon_cells(loop_vi, loop_start, loop_total):
+    # connectivity in polygon order, whatever order the loops are stored in
+    first = np.cumsum(loop_total) - loop_total
+    face = np.repeat(np.arange(len(loop_total)), loop_total)
+    return loop_vi[loop_start[face] + np.arange(len(face)) - first[face]]
+
+
+def format_rows(fmt, rows, chunk=65536):
+    # format an (n,k) array with one %-operation per block of rows
+    for i in range(0, len(rows), chunk):
+        block = rows[i:i + chunk]
+        yield (fmt * len(block)) % tuple(block.ravel().tolist())
+
+
+def _point_data(point_data, npoints):
+    arrays = []
+    for name, values in point_data or []:
+        values = np.asarray(values)
+        if len(values) != npoints:
+            raise ValueError("point data %s has %d values for %d points" % (name, len(values), npoints))
+        arrays.append((name.replace(' ', '_'), values.reshape(npoints, -1)))
+    return arrays
+
+
+def write_vtk_legacy(filename, points, connectivity=None, counts=None, point_data=None, binary=True, title=None):
+    """
+    Legacy VTK POLYDATA. Binary files are big-endian, as the format requires.
+    Without polygons the points are written as one vertex cell each.
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    npoints = len(points)
+    if connectivity is None:
+        connectivity = np.arange(npoints)
+        counts = np.ones(npoints, dtype=np.int32)
+        cell_kind = "VERTICES"
+    else:
+        cell_kind = "POLYGONS"
+    counts = np.asarray(counts, dtype=np.int32)
+    # cell list: each cell is its vertex count followed by its indices
+    cells = np.empty(len(counts) + len(connectivity), dtype=np.int32)
+    starts = np.cumsum(counts + 1) - (counts + 1)
+    cells[starts] = counts
+    mask = np.ones(len(cells), dtype=bool)
+    mask[starts] = False
+    cells[mask] = connectivity
+    arrays = _point_data(point_data, npoints)
+
+    f = open(filename, "wb")
+    f.write(("# vtk DataFile Version 3.0\n%s\n%s\nDATASET POLYDATA\n" %
+             ((title or filename)[:255], "BINARY" if binary else "ASCII")).encode('ascii'))
+
+    def block(a, fmt):
+        if binary:
+            f.write(a.astype(a.dtype.newbyteorder('>')).tobytes())
+            f.write(b"\n")
+        else:
+            for piece in format_rows(fmt * a.shape[1] + "\n", a):
+                f.write(piece.encode('ascii'))
+
+    f.write(("POINTS %d float\n" % npoints).encode('ascii'))
+    block(points, "%.6g ")
+    f.write(("%s %d %d\n" % (cell_kind, len(counts), len(cells))).encode('ascii'))
+    if binary:
+        block(cells.reshape(-1, 1), "%d ")
+    else:
+        lines = np.split(cells, np.cumsum(counts + 1)[:-1]) if len(counts) else []
+        for line in lines:
+            f.write((" ".join(map(str, line.tolist())) + "\n").encode('ascii'))
+    if arrays:
+        f.write(("POINT_DATA %d\n" % npoints).encode('ascii'))
+    for name, values in arrays:
+        values = values.astype(np.float32)
+        if values.shape[1] == 1:
+            f.write(("SCALARS %s float 1\nLOOKUP_TABLE default\n" % name).encode('ascii'))
+        elif values.shape[1] == 3 and name.lower() == "normals":
+            f.write(("NORMALS %s float\n" % name).encode('ascii'))
+        elif values.shape[1] == 3:
+            f.write(("VECTORS %s float\n" % name).encode('ascii'))
+        else:
+            f.write(("SCALARS %s float %d\nLOOKUP_TABLE default\n" % (name, values.shape[1])).encode('ascii'))
+        block(values, "%.6g ")
+    f.close()
+
+
+def _vtk_type(a):
+    return {'f4': "Float32", 'f8': "Float64", 'i4': "Int32", 'i8': "Int64", 'u1': "UInt8"}[a.dtype.str[1:]]
+
+
+def write_vtk_xml(filename, points, connectivity=None, counts=None, point_data=None, unstructured=False):
+    """
+    VTK XML PolyData (.vtp) or UnstructuredGrid (.vtu, with unstructured=True),
+    every array appended as raw little-endian binary with a UInt64 size header.
+    Without polygons the points are written as one vertex cell each.
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 3)
+    npoints = len(points)
+    if connectivity is None:
+        connectivity = np.arange(npoints)
+        counts = np.ones(npoints, dtype=np.int32)
+        polys = False
+    else:
+        polys = True
+    counts = np.asarray(counts, dtype=np.int64)
+    index_type = np.int32 if len(connectivity) < 2 ** 31 and npoints < 2 ** 31 else np.int64
+    connectivity = np.asarray(connectivity).astype(index_type)
+    offsets = np.cumsum(counts).astype(index_type)
+    arrays = _point_data(point_data, npoints)
+
+    appended = []
+    offset = [0]
+
+    def data_array(a, name, components=1, indent="        "):
+        a = np.ascontiguousarray(a.astype(a.dtype.newbyteorder('<')))
+        xml = '%s<DataArray type="%s" Name="%s" NumberOfComponents="%d" format="appended" offset="%d"/>\n' % (
+            indent, _vtk_type(a), name, components, offset[0])
+        appended.append(a)
+        offset[0] += 8 + a.nbytes
+        return xml
+
+    kind = "UnstructuredGrid" if unstructured else "PolyData"
+    xml = ['<?xml version="1.0"?>\n',
+           '<VTKFile type="%s" version="1.0" byte_order="LittleEndian" header_type="UInt64">\n' % kind,
+           '  <%s>\n' % kind]
+    if unstructured:
+        xml.append('    <Piece NumberOfPoints="%d" NumberOfCells="%d">\n' % (npoints, len(counts)))
+    elif polys:
+        xml.append('    <Piece NumberOfPoints="%d" NumberOfPolys="%d">\n' % (npoints, len(counts)))
+    else:
+        xml.append('    <Piece NumberOfPoints="%d" NumberOfVerts="%d">\n' % (npoints, len(counts)))
+    if arrays:
+        scalars = [name for name, values in arrays if values.shape[1] == 1]
+        attrs = ' Scalars="%s"' % scalars[0] if scalars else ''
+        xml.append('      <PointData%s>\n' % attrs)
+        for name, values in arrays:
+            xml.append(data_array(values.astype(np.float32), name, values.shape[1]))
+        xml.append('      </PointData>\n')
+    xml.append('      <Points>\n')
+    xml.append(data_array(points, "Points", 3))
+    xml.append('      </Points>\n')
+    if unstructured:
+        xml.append('      <Cells>\n')
+        xml.append(data_array(connectivity, "connectivity"))
+        xml.append(data_array(offsets, "offsets"))
+        types = np.where(counts == 1, 1, VTK_POLYGON).astype(np.uint8)
+        xml.append(data_array(types, "types"))
+        xml.append('      </Cells>\n')
+    else:
+        section = "Polys" if polys else "Verts"
+        xml.append('      <%s>\n' % section)
+        xml.append(data_array(connectivity, "connectivity"))
+        xml.append(data_array(offsets, "offsets"))
+        xml.append('      </%s>\n' % section)
+    xml.append('    </Piece>\n')
+    xml.append('  </%s>\n' % kind)
+    xml.append('  <AppendedData encoding="raw">\n   _')
+
+    f = open(filename, "wb")
+    f.write("".join(xml).encode('ascii'))
+    for a in appended:
+        f.write(np.array([a.nbytes], dtype='<u8').tobytes())
+        f.write(a.tobytes())
+    f.write(b"\n  </AppendedData>\n</VTKFile>\n")
+    f.close()
+
+
+if __name__ == "__main__":
+    # convert a .pnt grid (x y z nx ny nz per line) into a point cloud
+    # usage: python radiance_vtk.py grid.pnt grid.vtp|grid.vtu|grid.vtk
+    grid = np.loadtxt(sys.argv[1], ndmin=2)
+    out = sys.argv[2]
+    if out.endswith(".vtk"):
+        write_vtk_legacy(out, grid[:, 0:3], point_data=[("normals", grid[:, 3:6])])
+    else:
+        write_vtk_xml(out, grid[:, 0:3], point_data=[("normals", grid[:, 3:6])], unstructured=out.endswith(".vtu"))
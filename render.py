@@ -0,0 +1,330 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+The Radiance render engine.
+
+The scene files are brought up to date (update_files), then rpict runs
+as a subprocess writing its picture to a pipe. A reader thread decodes
+the RGBE scanlines as they arrive, top to bottom, and queues them in
+bands; the engine copies every band into its own RenderResult tile as
+soon as it is queued, so the picture fills in while rpict works and
+is never held whole. Escape kills rpict.
+"""
+
+import os
+import time
+import atexit
+import hashlib
+import queue
+import shlex
+import shutil
+import tempfile
+import threading
+import subprocess
+import bpy
+import numpy as np
+from math import atan, tan, degrees
+
+from . import update_files
+from . import radiance_quality
+from .radiance_picture import RGBEError, read_header, read_scanline, rgbe_to_float
+
+# scanlines per RenderResult tile, and the longest wait before a partial band is shown
+BAND_ROWS = 16
+BAND_SECONDS = 0.5
+
+
+class PictureReader(threading.Thread):
+    """
+    Reads a Radiance picture from a stream, putting (first row, rows)
+    float bands on a queue, rows counted from the top, then None at the
+    end. Errors are kept in self.error. copy, a file, gets the raw bytes.
+    """
+
+    def __init__(self, stream, bands, copy=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.stream = stream
+        self.bands = bands
+        self.copy = copy
+        self.error = None
+        self.width = self.height = 0
+
+    def run(self):
+        stream = self.stream
+        if self.copy is not None:
+            stream = TeeStream(stream, self.copy)
+        try:
+            header, self.width, self.height = read_header(stream)
+            band = []
+            first = 0
+            last = time.time()
+            for y in range(self.height):
+                band.append(rgbe_to_float(read_scanline(stream, self.width)))
+                if len(band) >= BAND_ROWS or time.time() - last >= BAND_SECONDS:
+                    self.bands.put((first, np.array(band)))
+                    first += len(band)
+                    band = []
+                    last = time.time()
+            if band:
+                self.bands.put((first, np.array(band)))
+        except (RGBEError, OSError, ValueError) as error:
+            self.error = error
+        self.bands.put(None)
+
+
+class TeeStream:
+    # a stream also copying everything read to a file
+    def __init__(self, stream, copy):
+        self.stream = stream
+        self.copy = copy
+
+    def read(self, nbytes):
+        data = self.stream.read(nbytes)
+        self.copy.write(data)
+        return data
+
+    def readline(self):
+        data = self.stream.readline()
+        self.copy.write(data)
+        return data
+
+
+def render_size(scene):
+    scale = scene.render.resolution_percentage / 100.0
+    return int(scene.render.resolution_x * scale), int(scene.render.resolution_y * scale)
+
+
+def view_options(camera, width, height):
+    """
+    -vh/-vv matching the render resolution, as Blender fits the camera:
+    the angle of the camera spans the wider side of the picture.
+    """
+    data = camera.data
+    if data.type == 'ORTHO':
+        wide = data.ortho_scale
+        other = wide * min(width, height) / max(width, height)
+    elif data.type == 'PERSP':
+        wide = degrees(data.angle)
+        other = degrees(2.0 * atan(tan(data.angle / 2.0) * min(width, height) / max(width, height)))
+    else:
+        return []
+    vh, vv = (wide, other) if width >= height else (other, wide)
+    return ["-vh", "%f" % vh, "-vv", "%f" % vv]
+
+
+def rpict_options(scene, **values):
+    # the quality settings, then the scene's command line switches, which override them
+    settings = scene.Radiance
+    return radiance_quality.rpict_options(settings, **values) + shlex.split(settings.command_line_switches)
+
+
+def working_folder(scene):
+    """
+    The folder of the scene's Radiance files. OS temp files go to the
+    same folder for every render of a scene of a blend file, so
+    update_files only rewrites what changed; with deletefiles_enable it
+    is removed when Blender quits, not after every render.
+    """
+    settings = scene.Radiance
+    if settings.tempfiles_enable:
+        blend = bpy.data.filepath or "untitled"
+        name = "radiance_%s_%s" % (bpy.path.clean_name(bpy.path.display_name_from_filepath(blend)),
+                                   hashlib.sha1(blend.encode('utf-8')).hexdigest()[:8])
+        folder = os.path.join(tempfile.gettempdir(), name, bpy.path.clean_name(scene.name))
+        os.makedirs(folder, exist_ok=True)
+        if settings.deletefiles_enable:
+            temp_folders.add(os.path.dirname(folder))
+        return folder
+    name = settings.scene_name or bpy.path.display_name_from_filepath(bpy.data.filepath) or "scene"
+    folder = os.path.join(bpy.path.abspath(settings.scene_path) or tempfile.gettempdir(), name)
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+# temp folders to delete at exit
+temp_folders = set()
+
+
+@atexit.register
+def delete_temp_folders():
+    for folder in temp_folders:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+class RadianceRender(bpy.types.RenderEngine):
+    bl_idname = 'RADIANCE_RENDER'
+    bl_label = "Radiance 4.1"
+    bl_use_preview = False
+
+    def render(self, scene):
+        if scene.camera is None:
+            self.report({'ERROR'}, "The scene has no camera")
+            return
+        width, height = render_size(scene)
+        folder = working_folder(scene)
+        self.update_stats("", "Radiance: updating scene files")
+        try:
+            octree, view, written = update_files.update_scene(scene, folder)
+        except (OSError, RuntimeError) as error:
+            self.report({'ERROR'}, "Radiance: %s" % error)
+            return
+        if self.test_break():
+            return
+        self.render_picture(scene, octree, view, width, height)
+
+    def render_picture(self, scene, octree, view, width, height):
+        command = (["rpict"] + rpict_options(scene) + ["-vf", view] + view_options(scene.camera, width, height) +
+                   ["-x", str(width), "-y", str(height), "-pa", "0", octree])
+        copy = None
+        if scene.Radiance.renderimage_path:
+            folder = bpy.path.abspath(scene.Radiance.renderimage_path)
+            os.makedirs(folder, exist_ok=True)
+            copy = open(os.path.join(folder, "%s_%04d.hdr" % (scene.name, scene.frame_current)), 'wb')
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=os.path.dirname(octree))
+        except OSError as error:
+            self.report({'ERROR'}, "Radiance: cannot run rpict (%s)" % error)
+            return
+        bands = queue.Queue()
+        reader = PictureReader(process.stdout, bands, copy)
+        reader.start()
+        t0 = time.time()
+        done = 0
+        try:
+            while True:
+                if self.test_break():
+                    process.kill()
+                    break
+                try:
+                    band = bands.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if band is None:
+                    break
+                first, rows = band
+                self.show_band(first, rows, reader.width, reader.height)
+                done = first + len(rows)
+                self.update_progress(done / float(reader.height))
+                self.update_stats("", "Radiance: %d of %d scanlines, %.1fs" % (done, reader.height, time.time() - t0))
+        finally:
+            if process.poll() is None:
+                process.kill()
+            process.wait()
+            reader.join(1.0)
+            process.stdout.close()
+            if copy is not None:
+                copy.close()
+        if reader.error is not None and not self.test_break():
+            self.report({'ERROR'}, "Radiance: %s (rpict exit status %s)" % (reader.error, process.returncode))
+        else:
+            self.update_stats("", "Radiance: %d scanlines in %.2fs" % (done, time.time() - t0))
+
+    def show_band(self, first, rows, width, height):
+        # rows come top down; Blender results start at the bottom left
+        nrows = len(rows)
+        result = self.begin_result(0, height - first - nrows, width, nrows)
+        rect = np.ones((nrows, width, 4), dtype=np.float32)
+        rect[:, :, 0:3] = rows.reshape(nrows, width, 3)[::-1]
+        result.layers[0].passes["Combined"].rect = rect.reshape(-1, 4).tolist()
+        self.end_result(result)
+
+
+class RadianceAutotune(bpy.types.Operator):
+    """Render small probes with the quality presets and keep the fastest within the target error"""
+    bl_idname = "render.radiance_autotune"
+    bl_label = "Tune Quality"
+
+    _timer = None
+
+    @classmethod
+    def poll(cls, context):
+        return context.scene.camera is not None
+
+    def execute(self, context):
+        # the scene files and the options of every preset are taken here, in the
+        # main thread; the probes only run rpict, on a thread between timer events
+        scene = context.scene
+        settings = scene.Radiance
+        width, height = render_size(scene)
+        folder = working_folder(scene)
+        try:
+            octree, view, written = update_files.update_scene(scene, folder)
+        except (OSError, RuntimeError) as error:
+            self.report({'ERROR'}, "Radiance: %s" % error)
+            return {'CANCELLED'}
+        view = ["-vf", view] + view_options(scene.camera, width, height)
+        options = dict((name, rpict_options(scene, **values)) for name, values in radiance_quality.PRESETS)
+        size = settings.autotune_size
+
+        def render(name, values):
+            return radiance_quality.probe(octree, view, options[name], size, cwd=folder)
+
+        self.tuner = radiance_quality.Autotuner(render, target=settings.autotune_target)
+        self.thread = None
+        self.error = None
+        wm = context.window_manager
+        wm.progress_begin(0, len(radiance_quality.PRESETS))
+        self._timer = wm.event_timer_add(0.2, context.window)
+        wm.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def step(self):
+        try:
+            self.tuner.step()
+        except (OSError, RuntimeError, RGBEError) as error:
+            self.error = error
+
+    def modal(self, context, event):
+        if event.type == 'ESC':
+            # the probe under way is left to finish, they are small
+            self.finish(context)
+            self.report({'WARNING'}, "Radiance: quality tuning cancelled")
+            return {'CANCELLED'}
+        if event.type != 'TIMER' or (self.thread is not None and self.thread.is_alive()):
+            return {'PASS_THROUGH'}
+        tuner = self.tuner
+        if self.error is not None:
+            self.finish(context)
+            self.report({'ERROR'}, "Radiance: %s" % self.error)
+            return {'CANCELLED'}
+        if tuner.results:
+            context.window_manager.progress_update(len(tuner.results))
+            self.report({'INFO'}, "Radiance: %s probe %.2fs, error %.4f" % tuner.results[-1])
+        if not tuner.done:
+            self.thread = threading.Thread(target=self.step)
+            self.thread.daemon = True
+            self.thread.start()
+            return {'PASS_THROUGH'}
+        self.finish(context)
+        settings = context.scene.Radiance
+        name, values = tuner.best()
+        for key, value in values.items():
+            setattr(settings, key, value)
+        settings.tuned_preset = name
+        settings.tuned_options = " ".join(rpict_options(context.scene))
+        self.report({'INFO'}, "Radiance: %s quality, %s" % (name, settings.tuned_options))
+        return {'FINISHED'}
+
+    def finish(self, context):
+        wm = context.window_manager
+        wm.event_timer_remove(self._timer)
+        wm.progress_end()
@@ -0,0 +1,41 @@
+"""
+The cell keys of AdaptiveGrid, and the fields they must fit in.
+
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiance_adaptive import AdaptiveGrid
+
+# a 2 by 2 quad
+CO = np.array([[0, 0, 0], [2, 0, 0], [2, 2, 0], [0, 2, 0]], dtype=np.float64)
+
+
+class KeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.grid = AdaptiveGrid(CO, [0, 1, 2, 3], [0], [4], 0.5)
+
+    def test_keys_distinct(self):
+        plane = np.array([0, 1, (1 << 15) - 1])
+        level = np.array([0, 0, 15])
+        ij = np.array([[0, 0], [0, 0], [-5, 7]])
+        self.assertEqual(len(set(self.grid.key(plane, level, ij).tolist())), 3)
+
+    def test_too_many_planes(self):
+        with self.assertRaisesRegex(ValueError, "too many face planes"):
+            self.grid.key(np.array([1 << 15]), np.array([0]), np.array([[0, 0]]))
+
+    def test_too_many_levels(self):
+        with self.assertRaisesRegex(ValueError, "too many levels"):
+            self.grid.key(np.array([0]), np.array([16]), np.array([[0, 0]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+"""
+Sensors merged by deduplicate, however the normals fall on its bins.
+
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiance_grid_tools import deduplicate
+
+
+class DeduplicateTest(unittest.TestCase):
+
+    def test_float_noise_normals(self):
+        # an axis-aligned normal and its float noise twin at one point
+        points = [[1.0, 2.0, 0.8], [1.0, 2.0, 0.8]]
+        normals = [[0.0, 0.0, 1.0], [-2e-8, 1e-8, 0.99999994]]
+        unique, unique_normals, mapping = deduplicate(points, normals)
+        self.assertEqual(len(unique), 1)
+        self.assertEqual(mapping.tolist(), [0, 0])
+
+    def test_keeps_opposite_and_distant_sensors(self):
+        points = [[0, 0, 0], [0, 0, 0], [0.0005, 0, 0], [0.01, 0, 0]]
+        normals = [[0, 0, 1], [0, 0, -1], [0, 1e-7, 1], [0, 0, 1]]
+        unique, unique_normals, mapping = deduplicate(points, normals)
+        self.assertEqual(mapping.tolist(), [0, 1, 0, 2])
+
+    def test_noisy_grid(self):
+        rng = np.random.RandomState(1)
+        grid = np.mgrid[0:20, 0:20, 0:1].reshape(3, -1).T * 0.5
+        normals = np.tile([0.0, 0.0, 1.0], (len(grid), 1))
+        points = np.concatenate([grid, grid + rng.uniform(-2e-4, 2e-4, grid.shape)])
+        noisy = normals + rng.uniform(-1e-3, 1e-3, normals.shape)
+        noisy /= np.linalg.norm(noisy, axis=1)[:, None]
+        unique, unique_normals, mapping = deduplicate(points, np.concatenate([normals, noisy]))
+        self.assertEqual(len(unique), len(grid))
+        self.assertTrue(np.allclose(unique[mapping], points, atol=1e-3))
+
+
+if __name__ == '__main__':
+    unittest.main()
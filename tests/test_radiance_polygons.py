@@ -0,0 +1,43 @@
+"""
+Planarity as obj2rad sees it, and the polygons written from it.
+
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radiance_polygons import nonplanar_faces, polygon_records
+
+# a flat concave L, a bent quad, a flat convex quad and a triangle
+CO = np.array([[0, 0, 0], [2, 0, 0], [2, 1, 0], [1, 1, 0], [1, 2, 0], [0, 2, 0],
+               [0, 0, 1], [1, 0, 1], [1, 1, 1.5], [0, 1, 1],
+               [3, 0, 0], [4, 0, 0], [4, 1, 0], [3, 1, 0]], dtype=np.float32)
+LOOP_VI = np.array([0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 10, 11, 12], dtype=np.int32)
+LOOP_START = np.array([0, 6, 10, 14], dtype=np.int32)
+LOOP_TOTAL = np.array([6, 4, 4, 3], dtype=np.int32)
+
+
+class PlanarityTest(unittest.TestCase):
+
+    def test_nonplanar_faces(self):
+        coords = CO.astype(np.float64)[LOOP_VI]
+        self.assertEqual(nonplanar_faces(coords, LOOP_START, LOOP_TOTAL).tolist(), [False, True, False, False])
+
+    def test_polygon_records(self):
+        records = list(polygon_records("m", CO, LOOP_VI, LOOP_START, LOOP_TOTAL, ["a"],
+                                       np.zeros(4, dtype=np.int32)))
+        # the concave face stays one polygon of 6 vertices, the bent quad is 2 triangles of its name
+        self.assertEqual(records[0].count(" polygon "), 1)
+        self.assertIn("\na polygon m.1\n0\n0\n18\n", records[0])
+        self.assertEqual(records[1].count("\na polygon m.2\n0\n0\n9\n"), 2)
+        self.assertEqual(records[2].count(" polygon "), 1)
+        self.assertIn("\na polygon m.4\n0\n0\n9\n", records[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+"""
+RtracePool against the stub of radiance_rtrace, which answers every ray
+with the z of its origin plus the z of its direction, and zero for a
+zero direction, so no Radiance is needed.
+
+The add-on's __init__ needs Blender, so run the tests from here:
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+import numpy as np
+
+ADDON = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ADDON)
+
+from radiance_rtrace import RtracePool, RtraceError
+
+STUB = [sys.executable, os.path.join(ADDON, "radiance_rtrace.py"), "--stub"]
+
+
+def rays(n):
+    rng = np.random.RandomState(0)
+    r = rng.uniform(-1.0, 1.0, (n, 6)).astype(np.float32)
+    r[::7, 3:6] = 0.0
+    return r
+
+
+def expected(r):
+    value = r[:, 2] + r[:, 5]
+    value[np.all(r[:, 3:6] == 0.0, axis=1)] = 0.0
+    return np.repeat(value[:, None], 3, axis=1)
+
+
+class RtracePoolTest(unittest.TestCase):
+
+    def test_results_in_ray_order(self):
+        # several workers, a last batch that needs padding, and a second run
+        r = rays(1000)
+        pool = RtracePool("scene.oct", workers=3, batch=64, command=STUB)
+        try:
+            done = []
+            results = pool.run(r, progress=done.append)
+            again = pool.run(r[:10])
+        finally:
+            pool.close()
+        self.assertTrue(np.allclose(results, expected(r)))
+        self.assertTrue(np.allclose(again, expected(r[:10])))
+        self.assertEqual(done[-1], len(r))
+        self.assertEqual(sum(worker.rays for worker in pool.workers), len(r) + 10)
+
+    def test_cancel_before_run(self):
+        # a cancel that arrives before the run starts is not lost
+        pool = RtracePool("scene.oct", workers=2, batch=16, command=STUB)
+        try:
+            pool.cancel()
+            with self.assertRaisesRegex(RtraceError, "^cancelled after 0 of 100 rays"):
+                pool.run(rays(100))
+        finally:
+            pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,136 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+import bpy
+
+# Use some of the existing buttons.
+from bl_ui import properties_render
+properties_render.RENDER_PT_render.COMPAT_ENGINES.add('RADIANCE_RENDER')
+properties_render.RENDER_PT_dimensions.COMPAT_ENGINES.add('RADIANCE_RENDER')
+properties_render.RENDER_PT_output.COMPAT_ENGINES.add('RADIANCE_RENDER')
+del properties_render
+
+from bl_ui import properties_data_camera
+properties_data_camera.DATA_PT_context_camera.COMPAT_ENGINES.add('RADIANCE_RENDER')
+properties_data_camera.DATA_PT_lens.COMPAT_ENGINES.add('RADIANCE_RENDER')
+properties_data_camera.DATA_PT_camera_display.COMPAT_ENGINES.add('RADIANCE_RENDER')
+del properties_data_camera
+
+
+class RenderButtonsPanel():
+    bl_space_type = 'PROPERTIES'
+    bl_region_type = 'WINDOW'
+    bl_context = "render"
+    # COMPAT_ENGINES must be defined in each subclass, external engines can add themselves here
+
+    @classmethod
+    def poll(cls, context):
+        rd = context.scene.render
+        return (rd.use_game_engine is False) and (rd.engine in cls.COMPAT_ENGINES)
+
+
+class RENDER_PT_radiance_export_settings(RenderButtonsPanel, bpy.types.Panel):
+    bl_label = "Export Settings"
+    COMPAT_ENGINES = {'RADIANCE_RENDER'}
+
+    def draw(self, context):
+        layout = self.layout
+
+        scene = context.scene
+
+        layout.prop(scene.Radiance, "tempfiles_enable", text="OS Tempfiles")
+        split = layout.split()
+        split.active = scene.Radiance.tempfiles_enable
+        split.prop(scene.Radiance, "deletefiles_enable", text="Delete files")
+
+        col = layout.column()
+        col.active = not scene.Radiance.tempfiles_enable
+        col.prop(scene.Radiance, "scene_name", text="Name")
+        col.prop(scene.Radiance, "scene_path", text="Path to files")
+
+        layout.prop(scene.Radiance, "renderimage_path", text="Path to image")
+
+
+class RENDER_PT_radiance_render_settings(RenderButtonsPanel, bpy.types.Panel):
+    bl_label = "Render Settings"
+    COMPAT_ENGINES = {'RADIANCE_RENDER'}
+
+    def draw(self, context):
+        layout = self.layout
+
+        scene = context.scene
+
+        layout.label(text="rpict options:")
+        layout.prop(scene.Radiance, "command_line_switches", text="")
+
+        layout.prop(scene.Radiance, "max_trace_level", text="Ray Depth")
+
+        layout.prop(scene.Radiance, "antialias_enable", text="Adaptive Sampling")
+        split = layout.split()
+        split.active = scene.Radiance.antialias_enable
+        split.prop(scene.Radiance, "antialias_depth", text="Depth")
+        split.prop(scene.Radiance, "antialias_threshold", text="Threshold")
+
+        split = layout.split()
+        split.prop(scene.Radiance, "jitter_enable", text="Jitter")
+        sub = split.column()
+        sub.active = scene.Radiance.jitter_enable
+        sub.prop(scene.Radiance, "jitter_amount", text="Amount")
+
+
+class RENDER_PT_radiance_ambient(RenderButtonsPanel, bpy.types.Panel):
+    bl_label = "Ambient"
+    COMPAT_ENGINES = {'RADIANCE_RENDER'}
+
+    def draw_header(self, context):
+        self.layout.prop(context.scene.Radiance, "radio_enable", text="")
+
+    def draw(self, context):
+        layout = self.layout
+
+        scene = context.scene
+
+        layout.active = scene.Radiance.radio_enable
+
+        split = layout.split()
+        col = split.column()
+        col.prop(scene.Radiance, "radio_recursion_limit", text="Bounces")
+        col.prop(scene.Radiance, "radio_count", text="Divisions")
+        col = split.column()
+        col.prop(scene.Radiance, "radio_error_bound", text="Error Bound")
+        col.prop(scene.Radiance, "radio_minimum_reuse", text="Minimum Reuse")
+        layout.prop(scene.Radiance, "radio_adc_bailout", text="Weight Limit")
+
+
+class RENDER_PT_radiance_autotune(RenderButtonsPanel, bpy.types.Panel):
+    bl_label = "Quality Tuning"
+    COMPAT_ENGINES = {'RADIANCE_RENDER'}
+
+    def draw(self, context):
+        layout = self.layout
+
+        scene = context.scene
+
+        split = layout.split()
+        split.prop(scene.Radiance, "autotune_target")
+        split.prop(scene.Radiance, "autotune_size")
+        layout.operator("render.radiance_autotune")
+        if scene.Radiance.tuned_preset:
+            layout.label(text="%s: %s" % (scene.Radiance.tuned_preset, scene.Radiance.tuned_options))
@@ -0,0 +1,217 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+The Radiance files of a scene, kept up to date in a working folder for
+the render engine.
+
+Files are only rewritten when their content changes (meshes compared by
+a hash of their arrays, in manifest.json), and oconv only runs when a
+scene file changed, so rendering again after moving the camera costs
+no more than the new view.
+
+    materials.rad  plastic, mirror, trans or glow per material
+    lights.rad     lamps as light spheres, spotlights and a distant sun
+    sky.rad        a glow sky and ground from the world colours
+    geom/*.rad     one file of polygons per mesh, in world coordinates
+    scene.oct      oconv of all of them
+    view.vf        the scene camera, as the view exporter writes it
+"""
+
+import os
+import json
+import time
+import hashlib
+import subprocess
+import bpy
+import numpy as np
+from math import degrees
+
+from . import io_radiance_geometry_export as geometry_export
+from . import io_radiance_camera_export as camera_export
+
+# lamp energy to Radiance light radiance, as the BRADD exporter's default
+ENERGY_TO_RADIANCE = 0.5
+
+
+def update_file(filename, content):
+    # write content unless the file already holds it; True when it was written
+    if os.path.exists(filename):
+        f = open(filename)
+        same = f.read() == content
+        f.close()
+        if same:
+            return False
+    f = open(filename, 'w')
+    f.write(content)
+    f.close()
+    return True
+
+
+def make_material(mat, name):
+    # the BRADD material mapping, reduced to the common types
+    if mat.emit > 0.0:
+        r, g, b = mat.diffuse_color * mat.emit
+        return "void glow %s\n0\n0\n4 %f %f %f 0\n\n" % (name, r, g, b)
+    if mat.raytrace_mirror.use:
+        r, g, b = mat.mirror_color * mat.raytrace_mirror.reflect_factor
+        return "void mirror %s\n0\n0\n3 %f %f %f\n\n" % (name, r, g, b)
+    r, g, b = mat.diffuse_color * mat.diffuse_intensity
+    specular = sum(c * c for c in mat.specular_color) ** 0.5 * mat.specular_intensity * 0.2
+    roughness = (1.0 - mat.specular_hardness / 100.0) * 0.25
+    if mat.use_transparency:
+        transmission = (1.0 - mat.alpha)
+        return "void trans %s\n0\n0\n7 %f %f %f %f %f %f %f\n\n" % (name, r, g, b, specular, roughness,
+                                                                  transmission, transmission)
+    return "void plastic %s\n0\n0\n5 %f %f %f %f %f\n\n" % (name, r, g, b, specular, roughness)
+
+
+def make_lights(lamps):
+    lights = ''
+    for obj in lamps:
+        lamp = obj.data
+        name = geometry_export.name_compat(obj.name)
+        r, g, b = lamp.color * lamp.energy * ENERGY_TO_RADIANCE
+        x, y, z = obj.matrix_world.translation
+        dx, dy, dz = -obj.matrix_world.col[2].xyz.normalized()
+        if lamp.type == 'SUN':
+            lights += "void light %s.light\n0\n0\n3 %f %f %f\n\n" % (name, r * 1e5, g * 1e5, b * 1e5)
+            lights += "%s.light source %s\n0\n0\n4 %f %f %f 0.5\n\n" % (name, name, -dx, -dy, -dz)
+        elif lamp.type == 'SPOT':
+            lights += "void spotlight %s.light\n0\n0\n7 %f %f %f %f %f %f %f\n\n" % (
+                name, r, g, b, degrees(lamp.spot_size), dx, dy, dz)
+            lights += "%s.light sphere %s\n0\n0\n4 %f %f %f 0.05\n\n" % (name, name, x, y, z)
+        else:
+            lights += "void light %s.light\n0\n0\n3 %f %f %f\n\n" % (name, r, g, b)
+            lights += "%s.light sphere %s\n0\n0\n4 %f %f %f 0.05\n\n" % (name, name, x, y, z)
+    return lights
+
+
+def make_sky(world):
+    if world is None:
+        return ''
+    r, g, b = world.horizon_color
+    gr, gg, gb = world.zenith_color if world.use_sky_blend else world.horizon_color
+    return ("void glow sky_glow\n0\n0\n4 %f %f %f 0\n\nsky_glow source sky\n0\n0\n4 0 0 1 180\n\n"
+            "void glow ground_glow\n0\n0\n4 %f %f %f 0\n\nground_glow source ground\n0\n0\n4 0 0 -1 180\n\n" %
+            (r, g, b, gr, gg, gb))
+
+
+def mesh_hash(job):
+    # content hash of a mesh snapshot: its arrays and material names
+    filepath, title, name, co, loop_vi, loop_start, loop_total, modifiers, material_index = job
+    digest = hashlib.sha1(name.encode('utf-8'))
+    for a in (co, loop_vi, loop_start, loop_total, material_index):
+        digest.update(np.ascontiguousarray(a).tobytes())
+    digest.update(" ".join(modifiers).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def update_scene(scene, folder, workers=1):
+    """
+    Bring the Radiance files of scene in folder up to date, recompiling
+    the octree when any of them changed. Meshes are formatted serially
+    by default, as forking from a render thread is not safe. Returns
+    (octree, view file, number of files written).
+    """
+    t0 = time.time()
+    geom = os.path.join(folder, "geom")
+    os.makedirs(geom, exist_ok=True)
+    manifest_name = os.path.join(folder, "manifest.json")
+    manifest = {}
+    if os.path.exists(manifest_name):
+        f = open(manifest_name)
+        manifest = json.load(f)
+        f.close()
+
+    meshes = []
+    lamps = []
+    materials = {}
+    for obj in scene.objects:
+        if obj.hide_render or not obj.is_visible(scene):
+            continue
+        if obj.type == 'MESH':
+            meshes.append(obj)
+            for slot in obj.material_slots:
+                if slot.material:
+                    materials[geometry_export.name_compat(slot.material.name)] = slot.material
+        elif obj.type == 'LAMP':
+            lamps.append(obj)
+
+    written = 0
+    mat_str = "void plastic %s\n0\n0\n5 .5 .5 .5 0 0\n\n" % geometry_export.DEFAULT_MATERIAL
+    for name in sorted(materials):
+        mat_str += make_material(materials[name], name)
+    written += update_file(os.path.join(folder, "materials.rad"), mat_str)
+    written += update_file(os.path.join(folder, "lights.rad"), make_lights(lamps))
+    written += update_file(os.path.join(folder, "sky.rad"), make_sky(scene.world))
+
+    hashes = {}
+    changed = []
+    geom_files = []
+    taken = set()
+    for obj in sorted(meshes, key=lambda obj: obj.name):
+        # clean names collide ("Cube.001", "Cube_001"), as may case on some file
+        # systems; later ones take a suffix, in name order so it stays theirs
+        name = base = bpy.path.clean_name(obj.name)
+        index = 1
+        while name.lower() in taken:
+            index += 1
+            name = "%s_%d" % (base, index)
+        taken.add(name.lower())
+        job = geometry_export.mesh_snapshot(scene, obj, os.path.join(geom, name + ".rad"))
+        hashes[name] = mesh_hash(job)
+        geom_files.append("geom/%s.rad" % name)
+        if manifest.get(name) != hashes[name] or not os.path.exists(job[0]):
+            changed.append(job)
+    if changed:
+        geometry_export.format_batch(changed, workers)
+        written += len(changed)
+    if set(hashes) != set(manifest):
+        written += 1
+
+    octree = os.path.join(folder, "scene.oct")
+    if written or not os.path.exists(octree):
+        # oconv writes next to the octree, which is only replaced when it succeeds;
+        # on failure the old octree goes too, so the next update runs oconv again
+        f = open(octree + ".tmp", 'wb')
+        try:
+            status = subprocess.call(["oconv", "materials.rad", "sky.rad", "lights.rad"] + geom_files,
+                                     stdout=f, cwd=folder)
+        except OSError:
+            status = -1
+        f.close()
+        if status != 0:
+            os.remove(octree + ".tmp")
+            if os.path.exists(octree):
+                os.remove(octree)
+            raise RuntimeError("oconv failed with exit status %d" % status if status >= 0 else "cannot run oconv")
+        os.replace(octree + ".tmp", octree)
+
+    # the manifest only once the octree holds the meshes it lists
+    f = open(manifest_name, 'w')
+    json.dump(hashes, f, indent=1, sort_keys=True)
+    f.close()
+
+    view = os.path.join(folder, "view.vf")
+    update_file(view, camera_export.make_view(scene.camera, scene.camera.data))
+    print("radiance files: %d of %d meshes written, %d files changed in %.2fs" %
+          (len(changed), len(meshes), written, time.time() - t0))
+    return octree, view, written